@@ -6,11 +6,18 @@ from sqlalchemy import pool
 from alembic import context
 
 from sqlite.models import Base
+from sqlite.database import SQLALCHEMY_DATABASE_URL
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# Migrate the same database the app is configured to use
+config.set_main_option(
+    "sqlalchemy.url",
+    SQLALCHEMY_DATABASE_URL.render_as_string(hide_password=False).replace("%", "%%"),
+)
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,143 @@
+"""Compare the blocking (sync Session) and async (AsyncSession) database paths.
+
+Each request looks a user up by email and commits a write, the same shape as
+the meter-facing routes. While the requests run, a ticker task measures how
+late the event loop wakes it up, which is what every other in-flight request
+experiences as well.
+
+    python -m benchmarks.async_db_concurrency --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, joinedload, sessionmaker
+
+from sqlite import models
+from sqlite.database import Base, set_sqlite_pragmas
+from sqlite.crud.users import get_user_by_email
+
+from sqlalchemy import event
+
+EMAIL = "benchmark@example.com"
+
+
+def build_apps(db_path: str, pool_size: int) -> dict[str, FastAPI]:
+    # Sessions are only closed once the response is sent, so the pool has to
+    # fit every in-flight request or a blocking checkout stalls the loop for good
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    SyncSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SyncSession() as db:
+        db.add(models.User(name="benchmark", email=EMAIL, password="-"))
+        db.commit()
+
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+    )
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+    def get_sync_db():
+        with SyncSession() as db:
+            yield db
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    sync_app = FastAPI()
+    async_app = FastAPI()
+
+    @sync_app.post("/")
+    async def blocking(db: Session = Depends(get_sync_db)):
+        user = (
+            db.query(models.User)
+            .filter(models.User.email == EMAIL)
+            .options(joinedload(models.User.customer))
+            .first()
+        )
+        user.name = str(time.perf_counter())
+        db.commit()
+        return {"id": user.id}
+
+    @async_app.post("/")
+    async def non_blocking(db: AsyncSession = Depends(get_async_db)):
+        user = await get_user_by_email(user_email=EMAIL, db=db)
+        user.name = str(time.perf_counter())
+        await db.commit()
+        return {"id": user.id}
+
+    return {"sync": sync_app, "async": async_app}
+
+
+async def measure(app: FastAPI, requests: int, concurrency: int) -> dict:
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        interval = 0.001
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started - interval)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+
+        async def one():
+            async with semaphore:
+                response = await c.post("/")
+                response.raise_for_status()
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker_task
+
+    lags.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(requests / elapsed, 1),
+        "event_loop_lag_p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 3),
+        "event_loop_lag_max_ms": round(lags[-1] * 1000, 3),
+    }
+
+
+async def main(requests: int, concurrency: int) -> None:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        apps = build_apps(os.path.join(directory, "benchmark.db"), concurrency)
+        for name, app in apps.items():
+            results[name] = await measure(app, requests, concurrency)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(requests=args.requests, concurrency=args.concurrency))
@@ -0,0 +1,121 @@
+"""Fire parallel readings and top-ups at one customer and check the final balance.
+
+Runs the real app in-process against a temporary SQLite database and exits
+with a non-zero status if any update was lost.
+
+    python -m benchmarks.balance_race --readings 200 --topups 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+READING = {
+    "voltage": 220.0,
+    "current": 1.0,
+    "units_consumed": 1.0,
+    # Off-peak, so every reading is charged the same rate
+    "timestamp": "2024-01-01T10:00:00",
+}
+TOPUP_AMOUNT = 3.0
+
+
+async def race(readings: int, topups: int) -> dict:
+    from main import app
+    from sqlite.database import Base, async_engine
+    from sqlite import models
+    from utils import get_password_context, secret
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    from sqlite.database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        db.add(
+            models.User(
+                name="admin",
+                email="admin@race",
+                password=get_password_context().hash("pw"),
+                is_admin=True,
+            )
+        )
+        customer_user = models.User(
+            name="meter", email="meter@race", password=get_password_context().hash("pw")
+        )
+        customer_user.customer = models.Customer(
+            nic_number="1234567890123", account_balance_in_rupees=100
+        )
+        db.add(customer_user)
+        await db.commit()
+        customer_user_id = customer_user.id
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://race") as c:
+
+        async def login(email: str) -> dict:
+            response = await c.post(
+                "/token", data={"username": email, "password": "pw"}
+            )
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        admin, meter = await login("admin@race"), await login("meter@race")
+
+        async def reading():
+            response = await c.post(
+                "/customers/increase/batch", json={"readings": [READING]}, headers=meter
+            )
+            response.raise_for_status()
+
+        async def topup():
+            response = await c.post(
+                f"/users/customer/topup/{customer_user_id}",
+                json={"account_balance_in_rupees": TOPUP_AMOUNT},
+                headers=admin,
+            )
+            response.raise_for_status()
+
+        await asyncio.gather(
+            *[reading() for _ in range(readings)], *[topup() for _ in range(topups)]
+        )
+        customer = (await c.get("/customers/me", headers=meter)).json()["customer"]
+
+    expected_balance = (
+        100 + topups * TOPUP_AMOUNT - readings * secret.PER_UNIT_COST_IN_RUPEES
+    )
+    return {
+        "readings": readings,
+        "topups": topups,
+        "expected_balance": expected_balance,
+        "final_balance": customer["account_balance_in_rupees"],
+        "expected_units_consumed": float(readings),
+        "final_units_consumed": customer["units_consumed"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=200)
+    parser.add_argument("--topups", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app opens sqlite.db relative to the working directory
+        os.chdir(directory)
+        result = asyncio.run(race(readings=args.readings, topups=args.topups))
+
+    print(json.dumps(result, indent=2))
+    if (
+        abs(result["final_balance"] - result["expected_balance"]) > 1e-6
+        or abs(result["final_units_consumed"] - result["expected_units_consumed"])
+        > 1e-6
+    ):
+        sys.exit("Lost update: final balance or units do not match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Measure import time and time to first request of a freshly started worker.
+
+Every run is a new interpreter, so nothing is shared between runs except
+the bytecode cache, which a warm-up run fills first. Import times come from
+`python -X importtime`, for `main` as a worker pays it and for
+`sqlite.models` as alembic and tooling pay it, with the slowest modules by
+their own import time. Time to first request starts a uvicorn worker and
+polls until it answers. Runs against a temporary SQLite database.
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str, env: dict) -> tuple[float, dict[str, float]]:
+    """Cumulative import time of `module`, and every module's own import time, in ms"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+        env=env,
+    )
+    total = 0.0
+    own = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        own[name.strip()] = int(self_us) / 1000
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+    return total, own
+
+
+def time_to_first_request(port: int, env: dict, timeout: float = 30.0) -> float:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as c:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError("The server exited before answering")
+                try:
+                    if c.get("/docs").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+        raise RuntimeError(f"No response within {timeout} seconds")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def cold_start(runs: int, port: int, top: int, env: dict) -> dict:
+    results = {}
+    for module in ("sqlite.models", "main"):
+        import_times(module, env)
+        totals, own_times = [], {}
+        for _ in range(runs):
+            total, own = import_times(module, env)
+            totals.append(total)
+            for name, ms in own.items():
+                own_times.setdefault(name, []).append(ms)
+        slowest = sorted(
+            ((statistics.median(ms), name) for name, ms in own_times.items()),
+            reverse=True,
+        )[:top]
+        results[f"import_{module}"] = {
+            "median_ms": round(statistics.median(totals), 1),
+            "min_ms": round(min(totals), 1),
+            "slowest_modules_ms": {name: round(ms, 1) for ms, name in slowest},
+        }
+
+    time_to_first_request(port, env)
+    latencies = [time_to_first_request(port, env) for _ in range(runs)]
+    results["time_to_first_request"] = {
+        "median_ms": round(statistics.median(latencies) * 1000, 1),
+        "min_ms": round(min(latencies) * 1000, 1),
+    }
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8124)
+    parser.add_argument(
+        "--top", type=int, default=10, help="Slowest modules to list per import"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{directory}/cold_start.db",
+            "CREATE_DATABASE_SCHEMA_ON_STARTUP": "True",
+        }
+        env.pop("ASYNC_DATABASE_URL", None)
+        results = cold_start(runs=args.runs, port=args.port, top=args.top, env=env)
+
+    print(
+        json.dumps(
+            {"commit": git_commit(), "runs": args.runs, **results},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
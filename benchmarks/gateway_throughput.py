@@ -0,0 +1,175 @@
+"""Stream readings through the meter gateway and report throughput as JSON.
+
+Seeds `--meters` customers with device API keys into a temporary SQLite
+database and starts the gateway on a free localhost port, in plain TCP. Each
+meter connects, authenticates and pipelines `--frames` READINGS frames of
+`--readings-per-frame` readings, then waits for the ACKs covering them.
+Exits with a non-zero status if a customer's units do not add up.
+
+    python -m benchmarks.gateway_throughput --meters 50 --frames 20
+    python -m benchmarks.gateway_throughput --batch-window-ms 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+UNITS_PER_READING = 0.001
+
+
+async def stream(port: int, api_key: str, frames: int, readings_per_frame: int) -> dict:
+    import gateway
+    from sqlite import schemas
+    from utils_packed_readings import packed_readings
+
+    started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    bodies = [
+        packed_readings.pack_batch(
+            [
+                schemas.CustomerTimestampedReadingBase(
+                    timestamp=started_at + timedelta(seconds=sequence_number),
+                    voltage=230.0,
+                    current=1.0,
+                    units_consumed=UNITS_PER_READING,
+                    sequence_number=sequence_number,
+                )
+                for sequence_number in range(
+                    frame * readings_per_frame, (frame + 1) * readings_per_frame
+                )
+            ]
+        )
+        for frame in range(frames)
+    ]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(gateway.encode_frame(gateway.AUTH, api_key.encode()))
+    frame_type, payload = await gateway.read_frame(reader)
+    if frame_type != gateway.AUTHENTICATED:
+        raise RuntimeError(payload.decode())
+
+    writer.write(
+        b"".join(gateway.encode_frame(gateway.READINGS, body) for body in bodies)
+    )
+    await writer.drain()
+    acks = acked_frames = 0
+    while acked_frames < frames:
+        frame_type, payload = await gateway.read_frame(reader)
+        if frame_type != gateway.ACK:
+            raise RuntimeError(payload.decode())
+        acks += 1
+        acked_frames += gateway.ACK_PAYLOAD.unpack(payload)[0]
+    writer.close()
+    await writer.wait_closed()
+    return {"acks": acks}
+
+
+async def measure(meters: int, frames: int, readings_per_frame: int) -> dict:
+    from sqlalchemy import select
+
+    import gateway
+    from sqlite import models, schemas
+    from sqlite.crud.device_credentials import create_device_credential
+    from sqlite.database import AsyncSessionLocal, Base, async_engine
+    from sqlite.readings_buffer import readings_buffer
+    from utils import get_password_context
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    password = get_password_context().hash("pw")
+    api_keys = []
+    async with AsyncSessionLocal() as db:
+        for i in range(meters):
+            user = models.User(
+                name="meter", email=f"meter{i}@gateway", password=password
+            )
+            user.customer = models.Customer(
+                nic_number=f"{i:013d}", account_balance_in_rupees=1000
+            )
+            db.add(user)
+            await db.commit()
+            credential = await create_device_credential(
+                credential=schemas.DeviceCredentialCreate(name="benchmark"),
+                db_user=user,
+                db=db,
+            )
+            api_keys.append(credential.api_key)
+
+    server = await gateway.serve_gateway(host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *[
+            stream(
+                port=port,
+                api_key=api_key,
+                frames=frames,
+                readings_per_frame=readings_per_frame,
+            )
+            for api_key in api_keys
+        ]
+    )
+    elapsed = time.perf_counter() - started
+    await gateway.close_gateway(server)
+    await readings_buffer.flush()
+
+    async with AsyncSessionLocal() as db:
+        units = list(
+            await db.scalars(
+                select(models.Customer.units_consumed).order_by(models.Customer.id)
+            )
+        )
+    await async_engine.dispose()
+
+    readings = meters * frames * readings_per_frame
+    commits = sum(result["acks"] for result in results)
+    return {
+        "meters": meters,
+        "frames_per_meter": frames,
+        "readings_per_frame": readings_per_frame,
+        "readings": readings,
+        "seconds": round(elapsed, 3),
+        "readings_per_second": round(readings / elapsed, 1),
+        "commits": commits,
+        "readings_per_commit": round(readings / commits, 1),
+        "expected_units_consumed": frames * readings_per_frame * UNITS_PER_READING,
+        "units_consumed": {"min": min(units), "max": max(units)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meters", type=int, default=20)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--readings-per-frame", type=int, default=5)
+    parser.add_argument("--batch-window-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    # Read by the settings on import, so set before the app is imported
+    os.environ["GATEWAY_ALLOW_PLAINTEXT"] = "true"
+    if args.batch_window_ms is not None:
+        os.environ["GATEWAY_BATCH_WINDOW_IN_MILLISECONDS"] = str(args.batch_window_ms)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app opens sqlite.db relative to the working directory
+        os.chdir(directory)
+        result = asyncio.run(
+            measure(
+                meters=args.meters,
+                frames=args.frames,
+                readings_per_frame=args.readings_per_frame,
+            )
+        )
+
+    print(json.dumps(result, indent=2))
+    expected = result["expected_units_consumed"]
+    if any(abs(units - expected) > 1e-9 for units in result["units_consumed"].values()):
+        sys.exit("Lost readings: a customer's units do not match")
+
+
+if __name__ == "__main__":
+    main()
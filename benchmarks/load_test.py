@@ -0,0 +1,292 @@
+"""Load test the meter-facing endpoints and report throughput and latency as JSON.
+
+Seeds `--customers` customers and an admin into a temporary SQLite database,
+mints their access tokens and drives each scenario with `--concurrency`
+concurrent clients for `--duration` seconds. The app runs in-process through
+its ASGI interface, or with `--uvicorn` in a local uvicorn server on the same
+temporary database. Nothing outside this machine is needed, and the output
+can be diffed between commits.
+
+    python -m benchmarks.load_test --customers 200 --concurrency 20 --duration 10
+    python -m benchmarks.load_test --uvicorn --workers 2 --scenarios increase
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import httpx
+
+SCENARIOS = ("increase", "should-get-service", "token", "all-customers")
+PASSWORD = "load-test"
+READING = {"voltage": 220.0, "current": 1.0, "units_consumed": 0.001}
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_per_second": round(len(latencies) / elapsed, 2),
+    }
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary.update(
+            p50_ms=round(quantiles[49] * 1000, 2),
+            p95_ms=round(quantiles[94] * 1000, 2),
+            p99_ms=round(quantiles[98] * 1000, 2),
+            max_ms=round(max(latencies) * 1000, 2),
+        )
+    return summary
+
+
+def seed(customers: int) -> tuple[list[str], str]:
+    """Create the schema, an admin and the customers, returns their emails"""
+    from sqlalchemy import insert, select
+
+    from sqlite import models
+    from sqlite.database import Base, engine
+    from utils import get_password_context
+
+    Base.metadata.create_all(bind=engine)
+    # Every user shares one hash, so seeding does not take a bcrypt call per row
+    password = get_password_context().hash(PASSWORD)
+    emails = [f"meter-{i}@load.test" for i in range(customers)]
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.User.__table__),
+            [
+                {
+                    "name": "admin",
+                    "email": "admin@load.test",
+                    "password": password,
+                    "is_admin": True,
+                },
+                *(
+                    {
+                        "name": email,
+                        "email": email,
+                        "password": password,
+                        "is_admin": False,
+                    }
+                    for email in emails
+                ),
+            ],
+        )
+        user_ids = connection.execute(
+            select(models.User.id).where(models.User.is_admin == False)
+        ).scalars()
+        connection.execute(
+            insert(models.Customer.__table__),
+            [
+                {
+                    "user_id": user_id,
+                    "nic_number": f"{user_id:013d}",
+                    "account_balance_in_rupees": 10**9,
+                    "should_get_service": True,
+                }
+                for user_id in user_ids
+            ],
+        )
+    return emails, "admin@load.test"
+
+
+def mint_token(email: str) -> dict:
+    from utils import create_access_token, secret
+
+    token = create_access_token(
+        data={"sub": email},
+        expires_delta=timedelta(hours=1),
+        key=secret.SECRET_KEY,
+        algorithm=secret.ALGORITHM,
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def run_scenario(
+    c: httpx.AsyncClient,
+    scenario: str,
+    concurrency: int,
+    duration: float,
+    customers: list[dict],
+    admin: dict,
+    emails: list[str],
+) -> dict:
+    async def request() -> httpx.Response:
+        if scenario == "increase":
+            return await c.post(
+                "/customers/increase", json=READING, headers=random.choice(customers)
+            )
+        if scenario == "should-get-service":
+            return await c.get(
+                "/customers/should-get-service", headers=random.choice(customers)
+            )
+        if scenario == "token":
+            return await c.post(
+                "/token",
+                data={"username": random.choice(emails), "password": PASSWORD},
+            )
+        return await c.get("/users/all/customers", headers=admin)
+
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client() -> None:
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await request()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+@contextlib.asynccontextmanager
+async def in_process_client():
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load.test", timeout=None
+        ) as c:
+            yield c
+
+
+@contextlib.asynccontextmanager
+async def uvicorn_client(port: int, workers: int):
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=None
+        ) as c:
+            for _ in range(100):
+                try:
+                    await c.get("/docs")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            yield c
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def load_test(args: argparse.Namespace) -> dict:
+    emails, admin_email = seed(args.customers)
+    customers = [mint_token(email) for email in emails]
+    admin = mint_token(admin_email)
+
+    if args.uvicorn:
+        client = uvicorn_client(port=args.port, workers=args.workers)
+    else:
+        client = in_process_client()
+
+    results = {}
+    async with client as c:
+        for scenario in args.scenarios:
+            results[scenario] = await run_scenario(
+                c,
+                scenario=scenario,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                customers=customers,
+                admin=admin,
+                emails=emails,
+            )
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="Seconds per scenario"
+    )
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"Comma separated, out of {','.join(SCENARIOS)}",
+    )
+    parser.add_argument("--uvicorn", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {','.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as directory:
+        # Read by the app on import, and by the uvicorn workers
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/load_test.db"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        results = asyncio.run(load_test(args))
+
+    print(
+        json.dumps(
+            {
+                "commit": commit,
+                "mode": "uvicorn" if args.uvicorn else "in-process",
+                "customers": args.customers,
+                "concurrency": args.concurrency,
+                "duration_in_seconds": args.duration,
+                "workers": args.workers if args.uvicorn else 1,
+                "scenarios": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Measure meter ingest latency while a burst of logins hashes passwords.
+
+Runs the real app in-process against a temporary SQLite database. Readings
+are sent at a steady rate while `--logins` concurrent logins run, and the
+latency percentiles of both are printed. `--inline` verifies passwords on
+the event loop, as before the hashing pool, for comparison.
+
+    python -m benchmarks.login_latency --logins 40 --readings 200
+    python -m benchmarks.login_latency --logins 40 --readings 200 --inline
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+READING = {"voltage": 220.0, "current": 1.0, "units_consumed": 0.01}
+
+
+def percentiles(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "count": len(latencies),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+async def measure(logins: int, readings: int, interval: float, inline: bool) -> dict:
+    from main import app
+    from sqlite import models
+    from sqlite.database import AsyncSessionLocal, Base, async_engine
+    from utils import get_password_context
+    from utils_hashing import password_hasher
+
+    if inline:
+
+        async def run_inline(fn, *args):
+            return fn(*args)
+
+        password_hasher._run = run_inline
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        customer_user = models.User(
+            name="meter",
+            email="meter@bench",
+            password=get_password_context().hash("pw"),
+        )
+        customer_user.customer = models.Customer(
+            nic_number="1234567890123", account_balance_in_rupees=1000
+        )
+        db.add(customer_user)
+        await db.commit()
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as c:
+
+        async def login() -> tuple[float, int]:
+            started = time.perf_counter()
+            response = await c.post(
+                "/token", data={"username": "meter@bench", "password": "pw"}
+            )
+            return time.perf_counter() - started, response.status_code
+
+        response = await c.post(
+            "/token", data={"username": "meter@bench", "password": "pw"}
+        )
+        meter = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        async def reading() -> tuple[float, int]:
+            started = time.perf_counter()
+            response = await c.post("/customers/increase", json=READING, headers=meter)
+            return time.perf_counter() - started, response.status_code
+
+        async def steady_readings() -> list[tuple[float, int]]:
+            tasks = []
+            for _ in range(readings):
+                tasks.append(asyncio.create_task(reading()))
+                await asyncio.sleep(interval)
+            return await asyncio.gather(*tasks)
+
+        baseline = await steady_readings()
+        reading_results, login_results = await asyncio.gather(
+            steady_readings(), asyncio.gather(*[login() for _ in range(logins)])
+        )
+
+    return {
+        "mode": "inline" if inline else "pool",
+        "max_workers": password_hasher.max_workers,
+        "ingest_without_logins": percentiles([latency for latency, _ in baseline]),
+        "ingest_during_logins": percentiles(
+            [latency for latency, status_code in reading_results if status_code == 200]
+        ),
+        "ingest_failed": sum(
+            1 for _, status_code in [*baseline, *reading_results] if status_code != 200
+        ),
+        "logins": percentiles(
+            [latency for latency, status_code in login_results if status_code == 200]
+        ),
+        "logins_rejected": sum(
+            1 for _, status_code in login_results if status_code == 503
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--readings", type=int, default=200)
+    parser.add_argument(
+        "--interval", type=float, default=0.02, help="Seconds between readings"
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    if args.max_workers is not None:
+        os.environ["PASSWORD_HASHING_MAX_WORKERS"] = str(args.max_workers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app opens sqlite.db relative to the working directory
+        os.chdir(directory)
+        result = asyncio.run(
+            measure(
+                logins=args.logins,
+                readings=args.readings,
+                interval=args.interval,
+                inline=args.inline,
+            )
+        )
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
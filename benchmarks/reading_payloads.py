@@ -0,0 +1,93 @@
+"""Compare the size and decoding cost of JSON and packed reading batches.
+
+Builds a batch of `--readings` timestamped readings and encodes it both
+ways. "json" is what a JSON client sends to /customers/increase/batch,
+validated with the batch schema. "packed" is the same batch in the
+`utils_packed_readings` layout, decoded into the same schema objects. No
+database is touched.
+
+    python -m benchmarks.reading_payloads --readings 100 --repeat 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(readings: int, repeat: int) -> dict:
+    from sqlite import schemas
+    from utils_packed_readings import packed_readings
+
+    started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    batch = [
+        schemas.CustomerTimestampedReadingBase(
+            timestamp=started_at + timedelta(minutes=i),
+            voltage=220.5,
+            current=1.25,
+            units_consumed=0.125,
+            sequence_number=i,
+        )
+        for i in range(readings)
+    ]
+    bodies = {
+        "json": schemas.CustomerReadingBatchBase(readings=batch).model_dump_json(),
+        "packed": packed_readings.pack_batch(batch),
+    }
+    decoders = {
+        "json": lambda: schemas.CustomerReadingBatchBase.model_validate_json(
+            bodies["json"]
+        ).readings,
+        "packed": lambda: packed_readings.unpack_batch(bodies["packed"]),
+    }
+
+    decoded = {name: decode() for name, decode in decoders.items()}
+    timings = {name: best_of(repeat, decode) for name, decode in decoders.items()}
+    return {
+        "same_readings": [
+            (r.sequence_number, r.timestamp, r.voltage, r.current, r.units_consumed)
+            for r in decoded["json"]
+        ]
+        == [
+            (r.sequence_number, r.timestamp, r.voltage, r.current, r.units_consumed)
+            for r in decoded["packed"]
+        ],
+        **{
+            name: {
+                "bytes_per_reading": round(len(body) / readings, 1),
+                "decode_us_per_reading": round(timings[name] / readings * 1e6, 2),
+            }
+            for name, body in bodies.items()
+        },
+        "size_ratio": round(len(bodies["json"]) / len(bodies["packed"]), 2),
+        "speedup": round(timings["json"] / timings["packed"], 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The models are imported, but nothing is read or written
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/reading_payloads.db"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        results = measure(readings=args.readings, repeat=args.repeat)
+
+    print(json.dumps({"readings": args.readings, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
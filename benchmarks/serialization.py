@@ -0,0 +1,149 @@
+"""Compare the per-object cost of FastAPI's response path with the fast JSON path.
+
+Builds `--users` customers as ORM objects, and as the projected rows the
+listings select, then times turning them into a response body both ways.
+"response_model" is what FastAPI does for `response_model=...`, validating
+every object and encoding it with the stdlib `json`. "fast" is
+`utils_json`, reading the fields with a serializer built once per schema and
+encoding with orjson. No database is touched.
+
+    python -m benchmarks.serialization --users 1000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+
+def build_users(count: int) -> list:
+    from sqlite import models
+
+    now = datetime(2026, 1, 1, 12, 30, 15, 250000, tzinfo=timezone.utc)
+    users = []
+    for i in range(count):
+        user = models.User(
+            id=i + 1,
+            name=f"customer {i}",
+            email=f"customer-{i}@example.com",
+            is_admin=False,
+            created_at=now,
+            updated_at=now,
+        )
+        user.customer = models.Customer(
+            id=i + 1,
+            user_id=i + 1,
+            nic_number=f"{i:013d}",
+            units_consumed=123.456 + i,
+            account_balance_in_rupees=1000,
+            should_get_service=True,
+            previous_voltage_reading=220.5,
+            previous_current_reading=1.25,
+            previous_reading_at=now,
+            created_at=now,
+            updated_at=now,
+        )
+        users.append(user)
+    return users
+
+
+def project(users: list) -> list[dict]:
+    """Rows shaped like `crud.users.get_users_page` returns them"""
+    from sqlite import schemas
+
+    return [
+        {
+            **{field: getattr(user, field) for field in schemas.UserAdmin.model_fields},
+            "customer": {
+                field: getattr(user.customer, field)
+                for field in schemas.Customer.model_fields
+            },
+        }
+        for user in users
+    ]
+
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(users: int, repeat: int) -> dict:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    from sqlite import schemas
+    from utils_json import FastJSONResponse, serialize_user, serialize_user_partial
+
+    objects = build_users(users)
+    rows = project(objects)
+
+    def response_model(type_, content, exclude_unset=False):
+        field = create_response_field(name="Response", type_=type_)
+
+        def render():
+            value = asyncio.run(
+                serialize_response(
+                    field=field, response_content=content, exclude_unset=exclude_unset
+                )
+            )
+            return JSONResponse(value).body
+
+        return render
+
+    cases = {
+        "orm_objects": {
+            "response_model": response_model(list[schemas.User], objects),
+            "fast": lambda: FastJSONResponse(
+                [serialize_user(user) for user in objects]
+            ).body,
+        },
+        "projected_rows": {
+            "response_model": response_model(
+                list[schemas.UserPartial], rows, exclude_unset=True
+            ),
+            "fast": lambda: FastJSONResponse(
+                [serialize_user_partial.mapping(row) for row in rows]
+            ).body,
+        },
+    }
+
+    results = {}
+    for case, paths in cases.items():
+        bodies = {path: json.loads(render()) for path, render in paths.items()}
+        timings = {path: best_of(repeat, render) for path, render in paths.items()}
+        results[case] = {
+            "same_output": bodies["response_model"] == bodies["fast"],
+            **{
+                f"{path}_us_per_object": round(seconds / users * 1e6, 2)
+                for path, seconds in timings.items()
+            },
+            "speedup": round(timings["response_model"] / timings["fast"], 2),
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The models are imported, but nothing is read or written
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/serialization.db"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        results = measure(users=args.users, repeat=args.repeat)
+
+    print(json.dumps({"users": args.users, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
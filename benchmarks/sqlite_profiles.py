@@ -0,0 +1,139 @@
+"""Measure ingest-shaped write throughput under each SQLite tuning profile.
+
+Every transaction debits a customer and appends a reading, like
+/customers/increase, and commits. Writers run concurrently on the async
+engine the app uses, so lock contention shows up as well as fsync cost.
+
+    python -m benchmarks.sqlite_profiles --writers 20 --transactions 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event, insert, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from sqlite import models
+from sqlite.database import Base, engine_options, sqlite_pragmas
+from utils import secret
+
+PROFILES = {
+    # SQLite's own defaults, which is what the app used to run with
+    "default": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size_in_bytes": 0,
+        "cache_size_in_kibibytes": 2000,
+        "busy_timeout_in_milliseconds": 5000,
+    },
+    "configured": {
+        "journal_mode": secret.SQLITE_JOURNAL_MODE,
+        "synchronous": secret.SQLITE_SYNCHRONOUS,
+        "mmap_size_in_bytes": secret.SQLITE_MMAP_SIZE_IN_BYTES,
+        "cache_size_in_kibibytes": secret.SQLITE_CACHE_SIZE_IN_KIBIBYTES,
+        "busy_timeout_in_milliseconds": secret.SQLITE_BUSY_TIMEOUT_IN_MILLISECONDS,
+    },
+}
+
+
+async def run_profile(
+    db_path: str, pragmas: dict, writers: int, transactions: int
+) -> dict:
+    url = make_url(f"sqlite+aiosqlite:///{db_path}")
+    async_engine = create_async_engine(url, **engine_options(url, is_async=True))
+    event.listen(async_engine.sync_engine, "connect", sqlite_pragmas(**pragmas))
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(
+            insert(models.User.__table__),
+            [
+                {
+                    "id": 1,
+                    "name": "benchmark",
+                    "email": "b@b",
+                    "password": "-",
+                    "is_admin": False,
+                }
+            ],
+        )
+        await connection.execute(
+            insert(models.Customer.__table__),
+            [
+                {
+                    "id": 1,
+                    "user_id": 1,
+                    "nic_number": "1234567890123",
+                    "units_consumed": 0.0,
+                    "account_balance_in_rupees": 0,
+                    "should_get_service": False,
+                    "previous_voltage_reading": 0.0,
+                    "previous_current_reading": 0.0,
+                }
+            ],
+        )
+
+    latencies = []
+
+    async def writer():
+        for _ in range(transactions):
+            started = time.perf_counter()
+            async with async_engine.begin() as connection:
+                await connection.execute(
+                    update(models.Customer.__table__)
+                    .where(models.Customer.id == 1)
+                    .values(
+                        account_balance_in_rupees=models.Customer.account_balance_in_rupees
+                        - 1
+                    )
+                )
+                await connection.execute(
+                    insert(models.Reading.__table__),
+                    {
+                        "customer_id": 1,
+                        "timestamp": datetime.utcnow(),
+                        "voltage": 220.0,
+                        "current": 1.0,
+                        "units_consumed": 1.0,
+                        "per_unit_cost_in_rupees": 1.0,
+                    },
+                )
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(writers)))
+    elapsed = time.perf_counter() - started
+    await async_engine.dispose()
+
+    latencies.sort()
+    return {
+        "pragmas": pragmas,
+        "transactions": len(latencies),
+        "seconds": round(elapsed, 4),
+        "commits_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    }
+
+
+async def main(writers: int, transactions: int) -> None:
+    results = {}
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            results[name] = await run_profile(
+                os.path.join(directory, "benchmark.db"), pragmas, writers, transactions
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=20)
+    parser.add_argument("--transactions", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(writers=args.writers, transactions=args.transactions))
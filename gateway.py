@@ -0,0 +1,329 @@
+"""Socket gateway for meters, lighter than HTTP for a reading every few seconds.
+
+Runs inside the app when GATEWAY_PORT is set, or on its own:
+
+    python -m gateway --host 0.0.0.0 --port 9000
+
+Meters connect over TLS with the certificate in GATEWAY_TLS_CERT_FILE and
+GATEWAY_TLS_KEY_FILE. Plain TCP is only for testing, it takes
+GATEWAY_ALLOW_PLAINTEXT and a loopback host.
+
+Every frame, in both directions, is a little-endian header of the frame type
+as a uint8 and the payload length as a uint16, followed by the payload.
+
+    AUTH           meter   device API key, UTF-8, must be the first frame
+    READINGS       meter   readings in the packed batch layout, see
+                           `utils_packed_readings`
+    AUTHENTICATED  gateway should_get_service, as a bool
+    ACK            gateway frames, readings and replayed readings as uint16,
+                           then should_get_service as a bool
+    ERROR          gateway a UTF-8 message, the connection is closed after it
+
+A meter authenticates once per connection and then streams READINGS frames
+without waiting. Frames of one connection that arrive within
+GATEWAY_BATCH_WINDOW_IN_MILLISECONDS of each other are applied together in
+one transaction, through the same billing code as POST
+/customers/increase/batch, and acknowledged by one ACK covering that many
+frames, in the order they were sent. Batches are per connection: readings of
+different meters are committed separately, since each customer's batch is
+guarded by its own sequence mark and may have to be filtered and retried on
+its own.
+
+On shutdown open connections are closed without waiting for their batch, a
+meter sends unacknowledged frames again after reconnecting and sequence
+numbers keep them from being billed twice.
+"""
+import argparse
+import asyncio
+import ipaddress
+import logging
+import ssl
+import struct
+
+from sqlite import schemas
+from sqlite.crud import customers, users
+from sqlite.database import AsyncSessionLocal
+from utils import secret
+from utils_cache import principal_cache
+from utils_device_credentials import device_credential_index
+from utils_packed_readings import packed_readings
+
+logger = logging.getLogger(__name__)
+
+AUTH = 0x01
+READINGS = 0x02
+AUTHENTICATED = 0x81
+ACK = 0x82
+ERROR = 0xFF
+
+HEADER = struct.Struct("<BH")
+AUTHENTICATED_PAYLOAD = struct.Struct("<?")
+ACK_PAYLOAD = struct.Struct("<HHH?")
+AUTH_TIMEOUT_IN_SECONDS = 10.0
+# READINGS frames read ahead of the batch being applied
+MAX_PENDING_FRAMES = 64
+
+# Handler tasks of open connections, cancelled by `close_gateway`
+_connections: set[asyncio.Task] = set()
+
+
+class GatewayError(Exception):
+    """Reported to the meter in an ERROR frame, then the connection is closed"""
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    frame_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return frame_type, await reader.readexactly(length)
+
+
+class MeterConnection:
+    """One authenticated meter, reading frames ahead while a batch is applied"""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        batch_window_in_seconds: float,
+        session_factory=AsyncSessionLocal,
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.batch_window_in_seconds = batch_window_in_seconds
+        self.session_factory = session_factory
+        self.api_key: str | None = None
+        # Decoded READINGS frames, then `None` or the error that ended the stream
+        self._frames: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING_FRAMES)
+        # A frame taken from the queue that did not fit in the last batch
+        self._carried: list = []
+
+    async def current_user(self) -> schemas.User:
+        """The meter's customer, checked again so a revoked key stops at once"""
+        user_id = device_credential_index.authenticate(self.api_key)
+        if user_id is None:
+            raise GatewayError("Could not validate credentials")
+        user = principal_cache.get(self.api_key)
+        if user is None:
+            async with self.session_factory() as db:
+                db_user = await users.get_user_by_id(user_id=user_id, db=db)
+                if db_user is None:
+                    raise GatewayError("Could not validate credentials")
+                user = principal_cache.set(token=self.api_key, db_user=db_user)
+        if user.is_admin or user.customer is None:
+            raise GatewayError("This gateway is for customers only")
+        return user
+
+    async def authenticate(self) -> schemas.User:
+        try:
+            frame_type, payload = await asyncio.wait_for(
+                read_frame(self.reader), timeout=AUTH_TIMEOUT_IN_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise GatewayError("Expected an AUTH frame")
+        if frame_type != AUTH:
+            raise GatewayError("Expected an AUTH frame")
+        self.api_key = payload.decode("utf-8", errors="replace")
+        user = await self.current_user()
+        self.writer.write(
+            encode_frame(
+                AUTHENTICATED,
+                AUTHENTICATED_PAYLOAD.pack(user.customer.should_get_service),
+            )
+        )
+        await self.writer.drain()
+        return user
+
+    async def read_readings(self) -> None:
+        """Decode READINGS frames into the queue, `None` once the meter hangs up"""
+        try:
+            while True:
+                frame_type, payload = await read_frame(self.reader)
+                if frame_type != READINGS:
+                    raise GatewayError(f"Unexpected frame type {frame_type}")
+                try:
+                    readings = packed_readings.unpack_batch(payload)
+                except ValueError as e:
+                    raise GatewayError(str(e))
+                await self._frames.put(readings)
+        except asyncio.IncompleteReadError:
+            await self._frames.put(None)
+        except GatewayError as e:
+            await self._frames.put(e)
+
+    async def next_batch(self) -> tuple[int, list] | None:
+        """Frames that arrived within the batch window of the first, up to a full batch"""
+        first = self._carried.pop() if self._carried else await self._frames.get()
+        if not isinstance(first, list):
+            self._carried.append(first)
+            return None
+        frames, readings = 1, list(first)
+        deadline = asyncio.get_running_loop().time() + self.batch_window_in_seconds
+        while True:
+            timeout = deadline - asyncio.get_running_loop().time()
+            try:
+                frame = (
+                    self._frames.get_nowait()
+                    if timeout <= 0
+                    else await asyncio.wait_for(self._frames.get(), timeout)
+                )
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if (
+                not isinstance(frame, list)
+                or len(readings) + len(frame) > packed_readings.max_batch_size
+            ):
+                # Applied with the next batch, or reported after this one
+                self._carried.append(frame)
+                break
+            frames += 1
+            readings.extend(frame)
+        return frames, readings
+
+    async def apply_readings(self) -> None:
+        while (batch := await self.next_batch()) is not None:
+            frames, readings = batch
+            user = await self.current_user()
+            async with self.session_factory() as db:
+                user, replayed = await customers.increase_units_consumed_in_batch(
+                    readings=readings, current_user=user, db=db
+                )
+            self.writer.write(
+                encode_frame(
+                    ACK,
+                    ACK_PAYLOAD.pack(
+                        frames,
+                        len(readings),
+                        replayed,
+                        user.customer.should_get_service,
+                    ),
+                )
+            )
+            await self.writer.drain()
+        ended = self._carried.pop()
+        if ended is not None:
+            raise ended
+
+    async def handle(self) -> None:
+        reading_task = None
+        try:
+            await self.authenticate()
+            reading_task = asyncio.create_task(self.read_readings())
+            await self.apply_readings()
+        except GatewayError as e:
+            self.writer.write(encode_frame(ERROR, str(e).encode()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Could not apply readings from a meter")
+            self.writer.write(encode_frame(ERROR, b"Internal error"))
+        finally:
+            if reading_task is not None:
+                reading_task.cancel()
+            self.writer.close()
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def gateway_ssl_context(host: str) -> ssl.SSLContext | None:
+    """TLS with the configured certificate, `None` where plaintext is allowed"""
+    if secret.GATEWAY_TLS_CERT_FILE:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(
+            certfile=secret.GATEWAY_TLS_CERT_FILE,
+            keyfile=secret.GATEWAY_TLS_KEY_FILE,
+        )
+        return context
+    if secret.GATEWAY_ALLOW_PLAINTEXT and is_loopback(host):
+        return None
+    raise ValueError(
+        "The meter gateway needs GATEWAY_TLS_CERT_FILE, "
+        "or GATEWAY_ALLOW_PLAINTEXT on a loopback host"
+    )
+
+
+async def serve_gateway(host: str, port: int):
+    """Accept meter connections, each handled until the meter hangs up"""
+
+    ssl_context = gateway_ssl_context(host)
+    batch_window_in_seconds = secret.GATEWAY_BATCH_WINDOW_IN_MILLISECONDS / 1000
+
+    async def handle(reader, writer):
+        task = asyncio.current_task()
+        _connections.add(task)
+        try:
+            await MeterConnection(
+                reader=reader,
+                writer=writer,
+                batch_window_in_seconds=batch_window_in_seconds,
+            ).handle()
+        except asyncio.CancelledError:
+            # Closed by `close_gateway`, asyncio would log a cancelled handler
+            pass
+        finally:
+            _connections.discard(task)
+
+    return await asyncio.start_server(handle, host=host, port=port, ssl=ssl_context)
+
+
+async def close_gateway(server: asyncio.Server) -> None:
+    """Stop accepting meters and close the open connections"""
+    server.close()
+    connections = list(_connections)
+    for task in connections:
+        task.cancel()
+    await asyncio.gather(*connections, return_exceptions=True)
+    await server.wait_closed()
+
+
+async def run(host: str, port: int) -> None:
+    # The background work of the app that readings depend on
+    from sqlite.depletion_forecaster import depletion_forecaster
+    from sqlite.power_quality import power_quality_monitor
+    from sqlite.readings_buffer import readings_buffer
+
+    await device_credential_index.load()
+    await depletion_forecaster.load()
+    tasks = [
+        asyncio.create_task(device_credential_index.resync_periodically()),
+        asyncio.create_task(readings_buffer.flush_periodically()),
+        asyncio.create_task(depletion_forecaster.run()),
+        asyncio.create_task(power_quality_monitor.checkpoint_periodically()),
+    ]
+    server = await serve_gateway(host=host, port=port)
+    logger.info("Meter gateway listening on %s:%s", host, port)
+    try:
+        await server.serve_forever()
+    finally:
+        await close_gateway(server)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await readings_buffer.flush()
+        await power_quality_monitor.checkpoint()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=secret.GATEWAY_HOST)
+    parser.add_argument("--port", type=int, default=secret.GATEWAY_PORT or 9000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run(host=args.host, port=args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,18 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from routers import jwt_tokens, users, customers
+from gateway import close_gateway, serve_gateway
+from routers import jwt_tokens, users, customers, metrics as metrics_router
+from sqlite.database import Base, async_engine, engine
+from sqlite.depletion_forecaster import depletion_forecaster
+from sqlite.power_quality import power_quality_monitor
+from sqlite.readings_buffer import readings_buffer
+from utils import get_password_context, secret
+from utils_device_credentials import device_credential_index
+from utils_metrics import MetricsMiddleware, metrics, serve_metrics
 
 tags_metadata = [
     {
@@ -16,17 +27,67 @@ tags_metadata = [
         "name": "customers",
         "description": "Create, read, update and manage all customers.",
     },
+    {
+        "name": "metrics",
+        "description": "Prometheus metrics of requests and database queries.",
+    },
 ]
 origins = [
     "*",
 ]
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Opening the first connection here also fails startup early on a bad URL
+    async with async_engine.begin() as connection:
+        if secret.CREATE_DATABASE_SCHEMA_ON_STARTUP:
+            await connection.run_sync(Base.metadata.create_all)
+    # Built here rather than on import, so the first login does not pay for it
+    get_password_context()
+    flush_task = asyncio.create_task(readings_buffer.flush_periodically())
+    await device_credential_index.load()
+    resync_task = asyncio.create_task(device_credential_index.resync_periodically())
+    await depletion_forecaster.load()
+    forecast_task = asyncio.create_task(depletion_forecaster.run())
+    checkpoint_task = asyncio.create_task(
+        power_quality_monitor.checkpoint_periodically()
+    )
+    metrics_server = None
+    if secret.METRICS_PORT is not None:
+        metrics_server = await serve_metrics(
+            host=secret.METRICS_HOST, port=secret.METRICS_PORT
+        )
+    gateway_server = None
+    if secret.GATEWAY_PORT is not None:
+        gateway_server = await serve_gateway(
+            host=secret.GATEWAY_HOST, port=secret.GATEWAY_PORT
+        )
+    yield
+    if gateway_server is not None:
+        await close_gateway(gateway_server)
+    if metrics_server is not None:
+        metrics_server.close()
+    tasks = [checkpoint_task, forecast_task, resync_task, flush_task]
+    for task in tasks:
+        task.cancel()
+    # A flush or checkpoint in flight puts its rows back before the last one
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await readings_buffer.flush()
+    await power_quality_monitor.checkpoint()
+    await async_engine.dispose()
+    engine.dispose()
+
+
 app = FastAPI(
     title="Smart Energy Meter API",
     description="Python FastAPI based server and backend",
     openapi_tags=tags_metadata,
     redoc_url=None,
+    lifespan=lifespan,
 )
+metrics.instrument_engine(engine, name="sync")
+metrics.instrument_engine(async_engine.sync_engine, name="async")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -34,6 +95,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it is outermost and times everything, including CORS
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 app.include_router(jwt_tokens.router)
 app.include_router(users.router)
 app.include_router(customers.router)
+app.include_router(metrics_router.router)
@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+from datetime import datetime
+from typing import Literal
 
-from sqlite.database import get_db
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from sqlite.database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from sqlite import schemas
-from sqlite.models import User
-from sqlite.crud import customers
+from sqlite.crud import customers, usage
+from sqlite.depletion_forecaster import depletion_forecaster
 
 from utils_auth import user_should_be_customer, get_current_user
+from utils_json import FastJSONResponse, serialize_usage_period, serialize_user
+from utils_packed_readings import PACKED_READINGS_MEDIA_TYPE, packed_readings
+from utils_pubsub import service_state_broker
 
 
 router = APIRouter(
@@ -21,23 +32,199 @@ router = APIRouter(
 )
 
 
-@router.get("/me", response_model=schemas.User)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+@router.get("/me", response_model=schemas.UserWithForecast)
+async def get_me(current_user: schemas.User = Depends(get_current_user)):
+    # Already a validated snapshot, validating it again only costs time
+    user = serialize_user(current_user)
+    user["customer"][
+        "projected_cut_off_at"
+    ] = depletion_forecaster.projected_cut_off_at(customer=current_user.customer)
+    return FastJSONResponse(user)
+
+
+@router.get("/me/usage", response_model=list[schemas.UsagePeriod])
+async def get_my_usage(
+    granularity: Literal["hourly", "daily"] = "hourly",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Consumption per period, naive bounds are in the tariff's timezone"""
+    try:
+        start, end = usage.usage_range(granularity=granularity, start=start, end=end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_usage = await usage.get_usage(
+        customer_id=current_user.customer.id,
+        granularity=granularity,
+        start=start,
+        end=end,
+        db=db,
+    )
+    return FastJSONResponse([serialize_usage_period(period) for period in db_usage])
 
 
 @router.get("/should-get-service", response_model=bool)
-async def should_get_service(current_user: User = Depends(get_current_user)):
+async def should_get_service(current_user: schemas.User = Depends(get_current_user)):
     return current_user.customer.should_get_service
 
 
-@router.post("/increase", response_model=schemas.User)
+@router.get(
+    "/should-get-service/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def stream_should_get_service(
+    request: Request,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Server-Sent Events stream that pushes should_get_service when it changes"""
+    # The session authentication used is only closed once the stream ends, so
+    # give its connection back to the pool now rather than hold it per meter
+    await db.close()
+    customer_id = current_user.customer.id
+    queue = service_state_broker.subscribe(customer_id=customer_id)
+
+    def event(should_get_service: bool) -> str:
+        return f"event: should-get-service\ndata: {json.dumps(should_get_service)}\n\n"
+
+    async def event_stream():
+        try:
+            last_sent = current_user.customer.should_get_service
+            yield event(last_sent)
+            while not await request.is_disconnected():
+                try:
+                    should_get_service = await asyncio.wait_for(
+                        queue.get(),
+                        timeout=service_state_broker.heartbeat_interval_in_seconds,
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if should_get_service is None:
+                    break
+                if should_get_service != last_sent:
+                    last_sent = should_get_service
+                    yield event(should_get_service)
+        finally:
+            service_state_broker.unsubscribe(customer_id=customer_id, queue=queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def reading_response(user: schemas.User, replayed: int) -> FastJSONResponse:
+    """The customer's state, with how many readings were replays and not applied again"""
+    return FastJSONResponse(
+        serialize_user(user), headers={"X-Replayed-Readings": str(replayed)}
+    )
+
+
+def is_packed(request: Request) -> bool:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    return media_type == PACKED_READINGS_MEDIA_TYPE
+
+
+def parse_json_body(schema: type[BaseModel], body: bytes):
+    """Validate a JSON body, failing like FastAPI does for a body parameter"""
+    try:
+        return schema.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+
+
+async def read_reading(request: Request) -> schemas.CustomerReadingBase:
+    body = await request.body()
+    if is_packed(request):
+        try:
+            return packed_readings.unpack_reading(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return parse_json_body(schemas.CustomerReadingBase, body)
+
+
+async def read_reading_batch(request: Request) -> schemas.CustomerReadingBatchBase:
+    body = await request.body()
+    if is_packed(request):
+        try:
+            readings = packed_readings.unpack_batch(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return schemas.CustomerReadingBatchBase.model_construct(readings=readings)
+    return parse_json_body(schemas.CustomerReadingBatchBase, body)
+
+
+def reading_request_body(json_schema: dict, packed_layout: str) -> dict:
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": json_schema},
+                PACKED_READINGS_MEDIA_TYPE: {
+                    "schema": {
+                        "type": "string",
+                        "format": "binary",
+                        "description": packed_layout,
+                    }
+                },
+            },
+        }
+    }
+
+
+@router.post(
+    "/increase",
+    response_model=schemas.User,
+    openapi_extra=reading_request_body(
+        json_schema=schemas.CustomerReadingBase.model_json_schema(),
+        packed_layout="Little-endian int64 sequence number (-1 for none), "
+        "then float32 voltage and current and float64 units consumed, 24 bytes",
+    ),
+)
 async def increase_units_consumed(
-    readings: schemas.CustomerReadingBase,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    readings: schemas.CustomerReadingBase = Depends(read_reading),
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    user, replayed = await customers.increase_units_consumed(
+        readings=readings, current_user=current_user, db=db
+    )
+    return reading_response(user=user, replayed=replayed)
+
+
+@router.post(
+    "/increase/batch",
+    response_model=schemas.User,
+    openapi_extra=reading_request_body(
+        json_schema={
+            "type": "object",
+            "required": ["readings"],
+            "properties": {
+                "readings": {
+                    "type": "array",
+                    "minItems": 1,
+                    "maxItems": packed_readings.max_batch_size,
+                    "items": schemas.CustomerTimestampedReadingBase.model_json_schema(),
+                }
+            },
+        },
+        packed_layout="Readings back to back, each a little-endian float64 Unix "
+        "time in seconds, then the 24 bytes of a single reading, 32 bytes",
+    ),
+)
+async def increase_units_consumed_in_batch(
+    batch: schemas.CustomerReadingBatchBase = Depends(read_reading_batch),
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    current_user.customer.update_previous_readings(readings=readings)
-    return customers.increase_units_consumed(
-        units_consumed=readings.units_consumed, db_user=current_user, db=db
+    user, replayed = await customers.increase_units_consumed_in_batch(
+        readings=batch.readings, current_user=current_user, db=db
     )
+    return reading_response(user=user, replayed=replayed)
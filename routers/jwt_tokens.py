@@ -3,8 +3,8 @@ from fastapi.security import OAuth2PasswordRequestForm
 
 from datetime import timedelta
 
-from sqlite.database import get_db
-from sqlalchemy.orm import Session
+from sqlite.database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from sqlite.schemas import Token
@@ -18,9 +18,10 @@ router = APIRouter(tags=["auth"])
 
 @router.post("/token", summary="Generate a new access token", response_model=Token)
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user = authenticate_user(
+    user = await authenticate_user(
         email=form_data.username, password=form_data.password, db=db
     )
     if not user:
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from utils_auth import user_should_be_admin
+from utils_metrics import metrics
+
+router = APIRouter(
+    tags=["metrics"],
+    dependencies=[Depends(user_should_be_admin)],
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,15 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlite.crud import users, customers
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Literal
 
-from sqlite.database import get_db
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlite.crud import (
+    users,
+    customers,
+    device_credentials,
+    power_quality,
+    topups,
+    usage,
+)
+
+from sqlite.database import AsyncSessionLocal, get_async_db
+from sqlite.depletion_forecaster import depletion_forecaster
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlite import schemas
+from sqlite.power_quality import power_quality_monitor
+from sqlite.readings_buffer import readings_buffer
 
 from utils import (
+    secret,
     are_object_to_edit_and_other_object_same_by_email,
     are_object_to_edit_and_other_object_same_by_nic,
 )
 from utils_auth import user_should_be_admin
+from utils_cache import principal_cache
+from utils_export import (
+    CUSTOMER_EXPORT_FIELDS,
+    EXPORT_MEDIA_TYPES,
+    accepts_gzip,
+    encode_export,
+)
+from utils_hashing import password_hasher
+from utils_json import (
+    FastJSONResponse,
+    serialize_usage_period,
+    serialize_user,
+    serialize_user_partial,
+)
 
 router = APIRouter(
     prefix="/users",
@@ -22,50 +56,328 @@ router = APIRouter(
 )
 
 
-@router.get("/all", response_model=list[schemas.User])
-async def get_everyone(db: Session = Depends(get_db)):
-    return users.get_everyone(db=db)
+USER_FIELDS = set(schemas.UserAdmin.model_fields)
+CUSTOMER_FIELDS = set(schemas.Customer.model_fields)
+
+
+def split_fields(
+    fields: str | None, allow_customer_fields: bool = True
+) -> tuple[list[str] | None, list[str] | None]:
+    """Split `name,email,customer.nic_number` into user and customer columns"""
+    if not fields:
+        return (
+            list(schemas.UserAdmin.model_fields),
+            list(schemas.Customer.model_fields) if allow_customer_fields else None,
+        )
+
+    user_fields, customer_fields = [], []
+    for field in filter(None, (f.strip() for f in fields.split(","))):
+        if field in USER_FIELDS:
+            user_fields.append(field)
+        elif field == "customer" and allow_customer_fields:
+            customer_fields.extend(schemas.Customer.model_fields)
+        elif (
+            field.startswith("customer.")
+            and allow_customer_fields
+            and field.removeprefix("customer.") in CUSTOMER_FIELDS
+        ):
+            customer_fields.append(field.removeprefix("customer."))
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown field {field}")
+    return user_fields, customer_fields
+
+
+async def get_users_page(
+    get_page,
+    after: int | None,
+    limit: int,
+    fields: str | None,
+    db: AsyncSession,
+    allow_customer_fields: bool = True,
+):
+    user_fields, customer_fields = split_fields(
+        fields=fields, allow_customer_fields=allow_customer_fields
+    )
+    page, next_cursor = await get_page(
+        db=db,
+        after_id=after,
+        limit=limit,
+        user_fields=user_fields,
+        customer_fields=customer_fields,
+    )
+    # Rows come straight from our own tables, so skip re-validating them
+    return FastJSONResponse(
+        [serialize_user_partial.mapping(row) for row in page],
+        headers={"X-Next-Cursor": str(next_cursor)}
+        if next_cursor is not None
+        else None,
+    )
+
+
+@router.get(
+    "/all",
+    response_model=list[schemas.UserPartial],
+    response_model_exclude_unset=True,
+)
+async def get_everyone(
+    after: int | None = Query(None, description="Cursor from X-Next-Cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    fields: str | None = Query(None, description="e.g. name,customer.nic_number"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await get_users_page(
+        get_page=users.get_everyone,
+        after=after,
+        limit=limit,
+        fields=fields,
+        db=db,
+    )
+
+
+@router.get(
+    "/all/admins",
+    response_model=list[schemas.UserAdminPartial],
+    response_model_exclude_unset=True,
+)
+async def get_all_admins(
+    after: int | None = Query(None, description="Cursor from X-Next-Cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    fields: str | None = Query(None, description="e.g. name,email"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await get_users_page(
+        get_page=users.get_admins,
+        after=after,
+        limit=limit,
+        fields=fields,
+        db=db,
+        allow_customer_fields=False,
+    )
 
 
-@router.get("/all/admins", response_model=list[schemas.UserAdmin])
-async def get_all_admins(db: Session = Depends(get_db)):
-    return users.get_admins(db=db)
+@router.get(
+    "/all/customers",
+    response_model=list[schemas.UserPartial],
+    response_model_exclude_unset=True,
+)
+async def get_all_customers(
+    after: int | None = Query(None, description="Cursor from X-Next-Cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    fields: str | None = Query(None, description="e.g. name,customer.nic_number"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await get_users_page(
+        get_page=users.get_customers,
+        after=after,
+        limit=limit,
+        fields=fields,
+        db=db,
+    )
+
+
+@router.get(
+    "/all/customers/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}
+    },
+)
+async def export_all_customers(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    should_get_service: bool | None = None,
+    accept_encoding: str = Header(""),
+):
+    async def chunks():
+        # The export outlives the request scoped session, so it opens its own
+        async with AsyncSessionLocal() as db:
+            async for rows in users.stream_customers_export(
+                db=db,
+                should_get_service=should_get_service,
+                chunk_size=secret.EXPORT_CHUNK_SIZE,
+            ):
+                yield rows
 
+    gzip = accepts_gzip(accept_encoding)
+    headers = {
+        "Content-Disposition": f'attachment; filename="customers.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        encode_export(
+            chunks=chunks(),
+            format=format,
+            fields=CUSTOMER_EXPORT_FIELDS,
+            gzip=gzip,
+        ),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers,
+    )
 
-@router.get("/all/customers", response_model=list[schemas.User])
-async def get_all_customers(db: Session = Depends(get_db)):
-    return users.get_customers(db=db)
+
+@router.get("/readings/buffer", response_model=schemas.ReadingsBufferStats)
+async def get_readings_buffer_stats():
+    return readings_buffer.stats()
+
+
+@router.get("/auth/cache", response_model=schemas.PrincipalCacheStats)
+async def get_principal_cache_stats():
+    return principal_cache.stats()
+
+
+@router.get("/auth/hashing", response_model=schemas.PasswordHasherStats)
+async def get_password_hasher_stats():
+    return password_hasher.stats()
+
+
+@router.get("/service/forecast", response_model=schemas.DepletionForecasterStats)
+async def get_depletion_forecaster_stats():
+    return depletion_forecaster.stats()
+
+
+@router.get("/power-quality/monitor", response_model=schemas.PowerQualityMonitorStats)
+async def get_power_quality_monitor_stats():
+    return power_quality_monitor.stats()
+
+
+@router.get("/power-quality", response_model=list[schemas.PowerQualityStats])
+async def get_power_quality_page(
+    flag: Literal["sag", "swell", "overcurrent"] | None = None,
+    after: int | None = Query(None, description="Cursor from X-Next-Cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Fold in what this worker has seen so far, other workers checkpoint on their own
+    await power_quality_monitor.checkpoint()
+    page, next_cursor = await power_quality.get_power_quality_page(
+        db=db,
+        conditions=[power_quality_monitor.flag_conditions()[flag]] if flag else None,
+        after_id=after,
+        limit=limit,
+    )
+    return FastJSONResponse(
+        [power_quality_monitor.describe(db_stats) for db_stats in page],
+        headers={"X-Next-Cursor": str(next_cursor)}
+        if next_cursor is not None
+        else None,
+    )
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = users.get_user_by_id(user_id=user_id, db=db)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return FastJSONResponse(serialize_user(db_user))
 
 
 @router.post("/admin", response_model=schemas.UserAdmin)
-async def set_admin_user(user: schemas.UserAdminCreate, db: Session = Depends(get_db)):
-    db_user = users.get_user_by_email(user_email=user.email, db=db)
+async def set_admin_user(
+    user: schemas.UserAdminCreate, db: AsyncSession = Depends(get_async_db)
+):
+    db_user = await users.get_user_by_email(user_email=user.email, db=db)
     if db_user:
         raise HTTPException(status_code=403, detail="User already exists")
-    return users.create_admin_user(user=user, db=db)
+    return await users.create_admin_user(user=user, db=db)
 
 
 @router.post("/customer", response_model=schemas.User)
 async def set_customer_user(
-    user: schemas.UserCustomerCreate, db: Session = Depends(get_db)
+    user: schemas.UserCustomerCreate, db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = users.get_user_by_email(user_email=user.email, db=db)
+    db_user = await users.get_user_by_email(user_email=user.email, db=db)
     if db_user:
         raise HTTPException(status_code=403, detail="User already exists")
-    db_cux = customers.get_customer_by_nic_number(
+    db_cux = await customers.get_customer_by_nic_number(
         cux_nic=user.customer.nic_number, db=db
     )
     if db_cux:
         raise HTTPException(status_code=403, detail="Customer already exists")
-    return users.create_customer_user(user=user, db=db)
+    return await users.create_customer_user(user=user, db=db)
+
+
+CUSTOMER_PROVISIONING_CSV_COLUMNS = ("name", "email", "password", "nic_number")
+
+
+async def read_customer_provisioning_rows(request: Request) -> list:
+    """Rows of a JSON array of customers, or of a CSV file with a header line"""
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+    try:
+        if media_type == "text/csv":
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            missing = set(CUSTOMER_PROVISIONING_CSV_COLUMNS) - set(
+                reader.fieldnames or ()
+            )
+            if missing:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Missing CSV columns: {', '.join(sorted(missing))}",
+                )
+            rows = [
+                {
+                    "name": row["name"],
+                    "email": row["email"],
+                    "password": row["password"],
+                    "customer": {"nic_number": row["nic_number"]},
+                }
+                for row in reader
+            ]
+        elif media_type == "application/json":
+            rows = json.loads(body)
+            if not isinstance(rows, list):
+                raise HTTPException(
+                    status_code=400, detail="Expected a JSON array of customers"
+                )
+        else:
+            raise HTTPException(
+                status_code=415, detail="Send application/json or text/csv"
+            )
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+    if len(rows) > secret.BULK_PROVISIONING_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {secret.BULK_PROVISIONING_MAX_ROWS} customers per upload",
+        )
+    return rows
+
+
+@router.post(
+    "/customers/bulk",
+    response_model=schemas.CustomerProvisioningReport,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/UserCustomerCreate"},
+                    }
+                },
+                "text/csv": {
+                    "schema": {"type": "string"},
+                    "example": ",".join(CUSTOMER_PROVISIONING_CSV_COLUMNS),
+                },
+            },
+        }
+    },
+)
+async def provision_customer_users(
+    rows: list = Depends(read_customer_provisioning_rows),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Valid rows are created even when others fail, the report says which and why
+    try:
+        return await users.provision_customers(rows=rows, db=db)
+    except IntegrityError:
+        # Another request created one of the emails or NIC numbers meanwhile
+        await db.rollback()
+        raise HTTPException(
+            status_code=409, detail="Customers changed during the upload, retry it"
+        )
 
 
 @router.put(
@@ -73,14 +385,16 @@ async def set_customer_user(
     response_model=schemas.UserAdmin,
 )
 async def update_admin_user(
-    user_id: int, user: schemas.UserUpdateWithoutCustomer, db: Session = Depends(get_db)
+    user_id: int,
+    user: schemas.UserUpdateWithoutCustomer,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_user = users.get_user_by_id(user_id=user_id, db=db)
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     if not db_user.is_admin:
         raise HTTPException(status_code=403, detail="User must be an admin")
-    other_object = users.get_user_by_email(user_email=user.email, db=db)
+    other_object = await users.get_user_by_email(user_email=user.email, db=db)
     if other_object:
         if not are_object_to_edit_and_other_object_same_by_email(
             obj_to_edit=db_user, other_object_with_same_email=other_object
@@ -88,7 +402,7 @@ async def update_admin_user(
             raise HTTPException(
                 status_code=403, detail="User with same email already exists"
             )
-    return users.update_admin_user(user=user, db_user=db_user, db=db)
+    return await users.update_admin_user(user=user, db_user=db_user, db=db)
 
 
 @router.put(
@@ -96,14 +410,16 @@ async def update_admin_user(
     response_model=schemas.User,
 )
 async def update_customer_user(
-    user_id: int, user: schemas.UserUpdateWithCustomer, db: Session = Depends(get_db)
+    user_id: int,
+    user: schemas.UserUpdateWithCustomer,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_user = users.get_user_by_id(user_id=user_id, db=db)
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     if db_user.is_admin:
         raise HTTPException(status_code=403, detail="User must be a customer")
-    other_object = users.get_user_by_email(user_email=user.email, db=db)
+    other_object = await users.get_user_by_email(user_email=user.email, db=db)
     if other_object:
         if not are_object_to_edit_and_other_object_same_by_email(
             obj_to_edit=db_user, other_object_with_same_email=other_object
@@ -111,10 +427,11 @@ async def update_customer_user(
             raise HTTPException(
                 status_code=403, detail="User with same email already exists"
             )
-    db_cux = customers.get_customer_by_id(cux_id=db_user.customer.id, db=db)
+    # Loaded with the user, fetching it again by id is one more round trip
+    db_cux = db_user.customer
     if db_cux is None:
         raise HTTPException(status_code=404, detail="Customer not found")
-    other_object = customers.get_customer_by_nic_number(
+    other_object = await customers.get_customer_by_nic_number(
         cux_nic=user.customer.nic_number, db=db
     )
     if other_object:
@@ -124,31 +441,279 @@ async def update_customer_user(
             raise HTTPException(
                 status_code=403, detail="Customer with same nic already exists"
             )
-    return users.update_customer_user(user=user, db_user=db_user, db=db)
+    return await users.update_customer_user(user=user, db_user=db_user, db=db)
 
 
 @router.delete(
     "/{user_id}",
     response_model=schemas.CustomSuccessResponse,
 )
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = users.get_user_by_id(user_id=user_id, db=db)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return users.delete_user(db_user=db_user, db=db)
+    return await users.delete_user(db_user=db_user, db=db)
 
 
 @router.post("/customer/topup/{user_id}", response_model=schemas.User)
 async def top_up_customer_account(
     user_id: int,
     topup_amount: schemas.CustomerTopupAccountBalanceBase,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_user = users.get_user_by_id(user_id=user_id, db=db)
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     if db_user.is_admin:
         raise HTTPException(status_code=403, detail="User must be a customer")
-    return customers.top_up_account(
+    db_user = await customers.top_up_account(
         topup_amount=topup_amount, db_user=db_user, db=db
     )
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@router.post("/{user_id}/sequence-number/reset", response_model=schemas.User)
+async def reset_customer_sequence_number(
+    user_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    # For a meter whose counter restarted, e.g. after a firmware reset, whose
+    # readings would otherwise all be skipped as replays. Other workers pick
+    # the reset up once their cached principal expires.
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_admin:
+        raise HTTPException(status_code=403, detail="User must be a customer")
+    db_user = await customers.reset_sequence_number(db_user=db_user, db=db)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+SETTLEMENT_CSV_COLUMNS = ("nic_number", "user_id", "amount_in_rupees")
+
+
+async def request_lines(request: Request):
+    """Decoded lines of the body, as the chunks arrive"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def read_settlement_rows(request: Request):
+    """Rows of a CSV file with a header line, JSON lines, or a JSON array.
+
+    A line that cannot be parsed is yielded as a `SettlementTopupFailure`,
+    numbered when it is applied.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type == "text/csv":
+        columns = None
+        async for line in request_lines(request):
+            if not line:
+                continue
+            try:
+                values = next(csv.reader([line]))
+            except csv.Error as e:
+                if columns is None:
+                    raise HTTPException(
+                        status_code=400, detail=f"Malformed upload: {e}"
+                    )
+                yield schemas.SettlementTopupFailure(row_number=0, errors=[f"row: {e}"])
+                continue
+            if columns is None:
+                columns = values
+                if not set(columns) & set(SETTLEMENT_CSV_COLUMNS):
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Expected CSV columns: {', '.join(SETTLEMENT_CSV_COLUMNS)}",
+                    )
+                continue
+            # Empty cells are missing values, e.g. the user id of a row with a NIC
+            yield {column: value for column, value in zip(columns, values) if value}
+    elif media_type in ("application/x-ndjson", "application/jsonl"):
+        async for line in request_lines(request):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                row = schemas.SettlementTopupFailure(row_number=0, errors=[f"row: {e}"])
+            yield row
+    elif media_type == "application/json":
+        try:
+            rows = json.loads(await request.body())
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+        if not isinstance(rows, list):
+            raise HTTPException(
+                status_code=400, detail="Expected a JSON array of top-ups"
+            )
+        for row in rows:
+            yield row
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail="Send text/csv, application/x-ndjson or application/json",
+        )
+
+
+@router.post(
+    "/customers/topups",
+    response_model=schemas.SettlementTopupReport,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "text/csv": {
+                    "schema": {"type": "string"},
+                    "example": ",".join(SETTLEMENT_CSV_COLUMNS),
+                },
+                "application/x-ndjson": {
+                    "schema": schemas.SettlementTopupRow.model_json_schema()
+                },
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": schemas.SettlementTopupRow.model_json_schema(),
+                    }
+                },
+            },
+        }
+    },
+)
+async def top_up_customer_accounts_from_settlement(
+    request: Request,
+    reference: str = Query(min_length=1, max_length=64),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Credited rows are recorded under the reference, so a file can be sent
+    # again after a failure and only the rest is applied
+    try:
+        return await topups.apply_settlement_topups(
+            reference=reference,
+            rows=read_settlement_rows(request),
+            chunk_size=secret.SETTLEMENT_TOPUP_CHUNK_SIZE,
+            db=db,
+        )
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="This settlement is being applied by another request",
+        )
+    except topups.SettlementRowChanged as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"{e}, send a changed file under a new reference",
+        )
+
+
+@router.get("/{user_id}/usage", response_model=list[schemas.UsagePeriod])
+async def get_customer_usage(
+    user_id: int,
+    granularity: Literal["hourly", "daily"] = "hourly",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Consumption per period, naive bounds are in the tariff's timezone"""
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_admin:
+        raise HTTPException(status_code=403, detail="User must be a customer")
+    try:
+        start, end = usage.usage_range(granularity=granularity, start=start, end=end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_usage = await usage.get_usage(
+        customer_id=db_user.customer.id,
+        granularity=granularity,
+        start=start,
+        end=end,
+        db=db,
+    )
+    return FastJSONResponse([serialize_usage_period(period) for period in db_usage])
+
+
+@router.get("/{user_id}/power-quality", response_model=schemas.PowerQualityStats)
+async def get_customer_power_quality(
+    user_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_admin:
+        raise HTTPException(status_code=403, detail="User must be a customer")
+    await power_quality_monitor.checkpoint()
+    db_stats = await power_quality.get_power_quality(
+        customer_id=db_user.customer.id, db=db
+    )
+    if not db_stats:
+        raise HTTPException(status_code=404, detail="No readings yet")
+    return FastJSONResponse(power_quality_monitor.describe(db_stats))
+
+
+@router.get(
+    "/{user_id}/device-credentials",
+    response_model=list[schemas.DeviceCredential],
+)
+async def get_device_credentials(
+    user_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_admin:
+        raise HTTPException(status_code=403, detail="User must be a customer")
+    return await device_credentials.get_device_credentials(user_id=user_id, db=db)
+
+
+@router.post(
+    "/{user_id}/device-credentials",
+    response_model=schemas.DeviceCredentialIssued,
+)
+async def issue_device_credential(
+    user_id: int,
+    credential: schemas.DeviceCredentialCreate,
+    db: AsyncSession = Depends(get_async_db),
+):
+    db_user = await users.get_user_by_id(user_id=user_id, db=db)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_admin:
+        raise HTTPException(status_code=403, detail="User must be a customer")
+    return await device_credentials.create_device_credential(
+        credential=credential, db_user=db_user, db=db
+    )
+
+
+@router.delete(
+    "/{user_id}/device-credentials/{key_id}",
+    response_model=schemas.DeviceCredential,
+)
+async def revoke_device_credential(
+    user_id: int, key_id: str, db: AsyncSession = Depends(get_async_db)
+):
+    db_credential = await device_credentials.get_device_credential(
+        user_id=user_id, key_id=key_id, db=db
+    )
+    if db_credential is None:
+        raise HTTPException(status_code=404, detail="Device credential not found")
+    return await device_credentials.revoke_device_credential(
+        db_credential=db_credential, db=db
+    )
@@ -1,56 +1,326 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import case, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from datetime import datetime
 
 from sqlite import models, schemas
-from utils import return_per_unit_cost_depending_on_time
+from sqlite.crud.usage import add_readings_to_usage
+from sqlite.depletion_forecaster import depletion_forecaster
+from sqlite.power_quality import power_quality_monitor
+from sqlite.readings_buffer import readings_buffer
+from utils_tariff import tariff_schedule
+from utils_cache import principal_cache
+from utils_pubsub import service_state_broker
+from utils_sequence import reading_sequence_index
 
 
 # Customers
-def get_customer_by_id(cux_id: int, db: Session):
-    return db.query(models.Customer).filter(models.Customer.id == cux_id).first()
+async def get_customer_by_id(cux_id: int, db: AsyncSession):
+    result = await db.scalars(
+        select(models.Customer).filter(models.Customer.id == cux_id)
+    )
+    return result.first()
 
 
-def get_customer_by_nic_number(cux_nic: str, db: Session):
-    return (
-        db.query(models.Customer).filter(models.Customer.nic_number == cux_nic).first()
+async def get_customer_by_nic_number(cux_nic: str, db: AsyncSession):
+    result = await db.scalars(
+        select(models.Customer).filter(models.Customer.nic_number == cux_nic)
     )
+    return result.first()
 
 
-def top_up_account(
+async def top_up_account(
     topup_amount: schemas.CustomerTopupAccountBalanceBase,
     db_user: models.User,
-    db: Session,
+    db: AsyncSession,
 ):
-    previous_account_balance = db_user.customer.account_balance_in_rupees
+    """Credit the account and restore service in one atomic UPDATE ... RETURNING
+
+    Returns `None` if the customer was deleted in the meantime.
+    """
     new_account_balance = (
-        previous_account_balance + topup_amount.account_balance_in_rupees
+        models.Customer.account_balance_in_rupees
+        + topup_amount.account_balance_in_rupees
+    )
+    db_cux = await db.scalar(
+        update(models.Customer)
+        .where(models.Customer.id == db_user.customer.id)
+        .values(
+            account_balance_in_rupees=new_account_balance,
+            should_get_service=case(
+                (new_account_balance > 0, True),
+                else_=models.Customer.should_get_service,
+            ),
+        )
+        .returning(models.Customer)
+        .execution_options(synchronize_session="fetch")
     )
 
-    db_user.customer.account_balance_in_rupees = new_account_balance
-    if new_account_balance > 0:
-        db_user.customer.should_get_service = True
-    
-    db.commit()
+    if db_cux is None:
+        return None
+
+    await db.commit()
+    principal_cache.invalidate(user_id=db_user.id)
+    depletion_forecaster.observe_balance(
+        customer_id=db_cux.id,
+        account_balance_in_rupees=db_cux.account_balance_in_rupees,
+        should_get_service=db_cux.should_get_service,
+    )
+    service_state_broker.publish(
+        customer_id=db_cux.id,
+        should_get_service=db_cux.should_get_service,
+    )
     return db_user
 
 
-def increase_units_consumed(units_consumed: float, db_user: models.User, db: Session):
-    previous_units_consumed = db_user.customer.units_consumed
-    current_reading_units_consumed = units_consumed
+async def reset_sequence_number(db_user: models.User, db: AsyncSession):
+    """Forget the meter's sequence mark after its counter restarted, `None` if deleted"""
+    db_cux = await db.scalar(
+        update(models.Customer)
+        .where(models.Customer.id == db_user.customer.id)
+        .values(
+            last_sequence_number=None,
+            sequence_resets=models.Customer.sequence_resets + 1,
+        )
+        .returning(models.Customer)
+        .execution_options(synchronize_session="fetch")
+    )
+    if db_cux is None:
+        return None
+
+    await db.commit()
+    principal_cache.invalidate(user_id=db_user.id)
+    reading_sequence_index.forget(customer_id=db_cux.id)
+    return db_user
+
+
+def skip_replayed_readings(
+    readings: list[schemas.CustomerTimestampedReadingBase],
+    last_sequence_number: int | None,
+) -> list[schemas.CustomerTimestampedReadingBase]:
+    """Readings without a sequence number, or numbered above the mark and not repeated"""
+    fresh = []
+    seen = set()
+    for reading in readings:
+        sequence_number = reading.sequence_number
+        if sequence_number is not None:
+            if (
+                last_sequence_number is not None
+                and sequence_number <= last_sequence_number
+            ) or sequence_number in seen:
+                continue
+            seen.add(sequence_number)
+        fresh.append(reading)
+    return fresh
+
+
+async def increase_units_consumed_in_batch(
+    readings: list[schemas.CustomerTimestampedReadingBase],
+    current_user: schemas.User,
+    db: AsyncSession,
+) -> tuple[schemas.User, int]:
+    """Apply a batch of readings to the customer in a single transaction.
+
+    The balance, units and service state are all derived from the stored
+    values in one UPDATE ... RETURNING, so concurrent readings and top-ups
+    never overwrite each other. Replayed readings are skipped without a
+    query, using the in-memory high-water mark. The UPDATE only applies if
+    the stored mark is still below the batch. When another worker moved it
+    since, or reset it, the mark is re-read and the batch filtered again.
+    Returns the user and how many readings were skipped as replays.
+    """
+    customer_id = current_user.customer.id
+    sequence_resets, last_sequence_number = reading_sequence_index.high_water_mark(
+        customer_id=customer_id,
+        persisted=current_user.customer.last_sequence_number,
+        resets=current_user.customer.sequence_resets,
+    )
+    while True:
+        fresh = skip_replayed_readings(readings, last_sequence_number)
+        if not fresh:
+            return current_user, len(readings)
+        user = await apply_readings(
+            readings=fresh,
+            current_user=current_user,
+            sequence_resets=sequence_resets,
+            db=db,
+        )
+        if user is not None:
+            return user, len(readings) - len(fresh)
+
+        await db.rollback()
+        mark = (
+            await db.execute(
+                select(
+                    models.Customer.sequence_resets,
+                    models.Customer.last_sequence_number,
+                ).filter(models.Customer.id == customer_id)
+            )
+        ).first()
+        await db.commit()
+        if mark is None:
+            # The customer was deleted meanwhile, there is nothing to apply to
+            return current_user, len(readings)
+        sequence_resets, last_sequence_number = mark
+        if last_sequence_number is not None:
+            reading_sequence_index.advance(
+                customer_id=customer_id,
+                resets=sequence_resets,
+                sequence_number=last_sequence_number,
+            )
 
-    total_units_consumed_after_this_reading = (
-        previous_units_consumed + current_reading_units_consumed
+
+async def apply_readings(
+    readings: list[schemas.CustomerTimestampedReadingBase],
+    current_user: schemas.User,
+    sequence_resets: int,
+    db: AsyncSession,
+) -> schemas.User | None:
+    """Price and apply readings, `None` if the stored sequence mark has passed or been reset"""
+    sequence_numbers = [
+        reading.sequence_number
+        for reading in readings
+        if reading.sequence_number is not None
+    ]
+    readings = sorted(
+        (
+            reading.model_copy(
+                update={"timestamp": tariff_schedule.localize(reading.timestamp)}
+            )
+            for reading in readings
+        ),
+        key=lambda reading: reading.timestamp,
+    )
+    previous_reading_at = current_user.customer.previous_reading_at
+    if previous_reading_at is not None:
+        previous_reading_at = tariff_schedule.localize(previous_reading_at)
+    costs = tariff_schedule.price_readings(
+        previous_reading_at=previous_reading_at,
+        timestamps=[reading.timestamp for reading in readings],
+        units_consumed=[reading.units_consumed for reading in readings],
     )
 
-    previous_account_balance = db_user.customer.account_balance_in_rupees
-    new_account_balance = previous_account_balance - (
-        current_reading_units_consumed * float(return_per_unit_cost_depending_on_time())
+    total_units_consumed_in_this_batch = 0.0
+    total_cost_of_this_batch = 0.0
+    readings_rows = []
+    for reading, cost in zip(readings, costs):
+        per_unit_cost = (
+            cost / reading.units_consumed
+            if reading.units_consumed
+            else tariff_schedule.rate_at(reading.timestamp)
+        )
+        total_units_consumed_in_this_batch += reading.units_consumed
+        total_cost_of_this_batch += cost
+        readings_rows.append(
+            {
+                "customer_id": current_user.customer.id,
+                "timestamp": reading.timestamp,
+                "voltage": reading.voltage,
+                "current": reading.current,
+                "units_consumed": reading.units_consumed,
+                "per_unit_cost_in_rupees": per_unit_cost,
+            }
+        )
+
+    new_account_balance = (
+        models.Customer.account_balance_in_rupees - total_cost_of_this_batch
+    )
+    spending_rate = depletion_forecaster.spending_rate(
+        rate=current_user.customer.spending_rate_in_rupees_per_second,
+        previous_reading_at=previous_reading_at,
+        readings_rows=readings_rows,
+    )
+    stmt = update(models.Customer).where(models.Customer.id == current_user.customer.id)
+    if sequence_numbers:
+        stmt = stmt.where(
+            models.Customer.sequence_resets == sequence_resets,
+            or_(
+                models.Customer.last_sequence_number.is_(None),
+                models.Customer.last_sequence_number < min(sequence_numbers),
+            ),
+        ).values(last_sequence_number=max(sequence_numbers))
+    db_cux = await db.scalar(
+        stmt.values(
+            units_consumed=models.Customer.units_consumed
+            + total_units_consumed_in_this_batch,
+            account_balance_in_rupees=new_account_balance,
+            # Only ever switches service off, a top-up switches it back on
+            should_get_service=case(
+                (new_account_balance <= 0, False),
+                else_=models.Customer.should_get_service,
+            ),
+            spending_rate_in_rupees_per_second=spending_rate,
+            previous_voltage_reading=readings[-1].voltage,
+            previous_current_reading=readings[-1].current,
+            previous_reading_at=case(
+                (
+                    models.Customer.previous_reading_at.is_(None)
+                    | (models.Customer.previous_reading_at < readings[-1].timestamp),
+                    # Typed like the column, so it is stored as UTC
+                    literal(
+                        readings[-1].timestamp,
+                        models.Customer.previous_reading_at.type,
+                    ),
+                ),
+                else_=models.Customer.previous_reading_at,
+            ),
+        )
+        .returning(models.Customer)
+        .execution_options(synchronize_session="fetch")
+    )
+    if db_cux is None:
+        return None
+    # In the same transaction as the balance, so history and balance agree
+    await add_readings_to_usage(
+        customer_id=current_user.customer.id,
+        readings_rows=readings_rows,
+        previous_reading_at=previous_reading_at,
+        db=db,
     )
 
-    db_user.customer.units_consumed = total_units_consumed_after_this_reading
-    db_user.customer.account_balance_in_rupees = new_account_balance
+    await db.commit()
+    if sequence_numbers:
+        reading_sequence_index.advance(
+            customer_id=db_cux.id,
+            resets=db_cux.sequence_resets,
+            sequence_number=max(sequence_numbers),
+        )
+    readings_buffer.add(readings_rows)
+    depletion_forecaster.observe_readings(
+        customer_id=db_cux.id,
+        spending_rate=db_cux.spending_rate_in_rupees_per_second,
+        reading_at=db_cux.previous_reading_at,
+        account_balance_in_rupees=db_cux.account_balance_in_rupees,
+        should_get_service=db_cux.should_get_service,
+    )
+    power_quality_monitor.observe(
+        customer_id=db_cux.id,
+        readings=((row["voltage"], row["current"]) for row in readings_rows),
+    )
+    user = current_user.model_copy(
+        update={
+            "customer": schemas.Customer.model_validate(db_cux, from_attributes=True)
+        }
+    )
+    principal_cache.refresh(user=user)
+    service_state_broker.publish(
+        customer_id=db_cux.id, should_get_service=db_cux.should_get_service
+    )
+    return user
 
-    if new_account_balance <= 0:
-        db_user.customer.should_get_service = False
 
-    db.commit()
-    return db_user
+async def increase_units_consumed(
+    readings: schemas.CustomerReadingBase,
+    current_user: schemas.User,
+    db: AsyncSession,
+) -> tuple[schemas.User, int]:
+    return await increase_units_consumed_in_batch(
+        readings=[
+            schemas.CustomerTimestampedReadingBase(
+                **readings.model_dump(),
+                timestamp=datetime.now(tariff_schedule.timezone)
+            )
+        ],
+        current_user=current_user,
+        db=db,
+    )
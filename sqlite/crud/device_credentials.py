@@ -0,0 +1,60 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlite import models, schemas
+from utils import return_datetime_in_proper_format
+from utils_device_credentials import device_credential_index
+
+
+async def get_device_credentials(user_id: int, db: AsyncSession):
+    result = await db.scalars(
+        select(models.DeviceCredential)
+        .filter(models.DeviceCredential.user_id == user_id)
+        .order_by(models.DeviceCredential.id)
+    )
+    return result.all()
+
+
+async def get_device_credential(user_id: int, key_id: str, db: AsyncSession):
+    result = await db.scalars(
+        select(models.DeviceCredential).filter(
+            models.DeviceCredential.user_id == user_id,
+            models.DeviceCredential.key_id == key_id,
+        )
+    )
+    return result.first()
+
+
+async def create_device_credential(
+    credential: schemas.DeviceCredentialCreate, db_user: models.User, db: AsyncSession
+) -> schemas.DeviceCredentialIssued:
+    """Issue a new API key, it is only ever returned from here"""
+    key_id, api_key, secret_digest = device_credential_index.generate()
+    db_credential = models.DeviceCredential(
+        key_id=key_id,
+        user_id=db_user.id,
+        name=credential.name,
+        secret_digest=secret_digest,
+    )
+    db.add(db_credential)
+
+    await db.commit()
+    device_credential_index.add(
+        key_id=key_id, secret_digest=secret_digest, user_id=db_user.id
+    )
+    return schemas.DeviceCredentialIssued(
+        **schemas.DeviceCredential.model_validate(
+            db_credential, from_attributes=True
+        ).model_dump(),
+        api_key=api_key,
+    )
+
+
+async def revoke_device_credential(
+    db_credential: models.DeviceCredential, db: AsyncSession
+):
+    if db_credential.revoked_at is None:
+        db_credential.revoked_at = return_datetime_in_proper_format()
+        await db.commit()
+    device_credential_index.remove(key_id=db_credential.key_id)
+    return db_credential
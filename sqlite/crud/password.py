@@ -1,15 +1,26 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from sqlite.crud.users import get_user_by_email
 
-from utils import verify_password
+from utils import secret
+from utils_hashing import password_hasher
 
 
-def authenticate_user(email: str, password: str, db: Session):
+async def authenticate_user(email: str, password: str, db: AsyncSession):
     """Authenticate a user, check if their password is correct"""
-    user = get_user_by_email(user_email=email, db=db)
+    user = await get_user_by_email(user_email=email, db=db)
     if not user:
         return False
-    if not verify_password(plain_password=password, hashed_password=user.password):
+    # Hand the connection back while bcrypt runs, so waiting logins never
+    # exhaust the pool that meter requests need
+    await db.commit()
+    is_verified, new_hash = await password_hasher.verify_and_update(
+        plain_password=password, hashed_password=user.password
+    )
+    if not is_verified:
         return False
+    if new_hash is not None and secret.PASSWORD_REHASH_ON_LOGIN:
+        # Upgrade hashes made with fewer rounds while the plain password is at hand
+        user.password = new_hash
+        await db.commit()
     return user
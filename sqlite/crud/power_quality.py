@@ -0,0 +1,72 @@
+from sqlalchemy import case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlite import models
+
+
+def upsert_power_quality(dialect_name: str):
+    """INSERT that folds statistics into an existing row, see sqlite/power_quality.py
+
+    Means and sums of squared deviations combine with the parallel form of
+    Welford's algorithm. MySQL assigns left to right, seeing the values
+    already assigned, so every column is assigned after those it reads, in
+    the order of `values` rather than of the table's columns.
+    """
+    table = models.PowerQualityStats.__table__
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    statement = insert(table)
+    new = statement.inserted if dialect_name == "mysql" else statement.excluded
+    count = table.c.readings_count
+    new_count = new.readings_count
+    total = count + new_count
+
+    values = []
+    for quantity in ("voltage", "current"):
+        mean, m2 = f"{quantity}_mean", f"{quantity}_m2"
+        low, high = f"{quantity}_min", f"{quantity}_max"
+        delta = new[mean] - table.c[mean]
+        values += [
+            (m2, table.c[m2] + new[m2] + delta * delta * count * new_count / total),
+            (mean, table.c[mean] + delta * new_count / total),
+            (low, case((new[low] < table.c[low], new[low]), else_=table.c[low])),
+            (high, case((new[high] > table.c[high], new[high]), else_=table.c[high])),
+            (f"{quantity}_ewma", new[f"{quantity}_ewma"]),
+        ]
+    for column in ("sag_readings", "swell_readings", "overcurrent_readings"):
+        values.append((column, table.c[column] + new[column]))
+    values.append(("updated_at", new.updated_at))
+    values.append(("readings_count", total))
+
+    if dialect_name == "mysql":
+        return statement.on_duplicate_key_update(values)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.customer_id], set_=dict(values)
+    )
+
+
+async def get_power_quality(customer_id: int, db: AsyncSession):
+    return await db.get(models.PowerQualityStats, customer_id)
+
+
+async def get_power_quality_page(
+    db: AsyncSession,
+    conditions: list | None = None,
+    after_id: int | None = None,
+    limit: int = 100,
+) -> tuple[list[models.PowerQualityStats], int | None]:
+    """Keyset page of statistics ordered by customer id, with the next page's cursor"""
+    stmt = select(models.PowerQualityStats).filter(*conditions or ())
+    if after_id is not None:
+        stmt = stmt.filter(models.PowerQualityStats.customer_id > after_id)
+    result = await db.scalars(
+        stmt.order_by(models.PowerQualityStats.customer_id).limit(limit + 1)
+    )
+    rows = result.all()
+    next_cursor = rows[limit - 1].customer_id if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,213 @@
+import hashlib
+import json
+from typing import Any, AsyncIterable
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, case, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlite import models, schemas
+from sqlite.depletion_forecaster import depletion_forecaster
+from utils_cache import principal_cache
+from utils_pubsub import service_state_broker
+
+
+class SettlementRowChanged(Exception):
+    """A row already credited under the reference was sent again with other content"""
+
+    def __init__(self, row_number: int) -> None:
+        super().__init__(f"Row {row_number} differs from the one already applied")
+        self.row_number = row_number
+
+
+def row_digest(row: schemas.SettlementTopupRow) -> str:
+    return hashlib.sha256(
+        json.dumps([row.nic_number, row.user_id, row.amount_in_rupees]).encode()
+    ).hexdigest()
+
+
+async def apply_settlement_topups(
+    reference: str,
+    rows: AsyncIterable[Any],
+    chunk_size: int,
+    db: AsyncSession,
+) -> schemas.SettlementTopupReport:
+    """Credit the rows of a settlement file, `chunk_size` rows per transaction.
+
+    Rows are read as they arrive, so a file is never held in memory. Every
+    credited row is recorded under (reference, row number) with a digest of
+    its content, and sending the same file again skips those, whether the
+    first run finished or not. A recorded row sent again with other content,
+    e.g. from a corrected or re-sorted file, raises `SettlementRowChanged`.
+    Chunks before the one it is in have been applied by then. Rows that
+    could not be parsed come as a `SettlementTopupFailure`, reported as is.
+    """
+    report = schemas.SettlementTopupReport(
+        reference=reference,
+        applied=0,
+        already_applied=0,
+        failed=0,
+        restored_service=0,
+        failures=[],
+    )
+    chunk = []
+    row_number = 0
+    async for row in rows:
+        row_number += 1
+        chunk.append((row_number, row))
+        if len(chunk) == chunk_size:
+            await apply_settlement_chunk(reference, chunk, report, db)
+            chunk = []
+    if chunk:
+        await apply_settlement_chunk(reference, chunk, report, db)
+    report.failures.sort(key=lambda failure: failure.row_number)
+    report.failed = len(report.failures)
+    return report
+
+
+async def apply_settlement_chunk(
+    reference: str,
+    chunk: list[tuple[int, Any]],
+    report: schemas.SettlementTopupReport,
+    db: AsyncSession,
+) -> None:
+    """Credit one chunk in one transaction, with a fixed number of queries"""
+    valid: list[tuple[int, schemas.SettlementTopupRow]] = []
+    for row_number, row in chunk:
+        if isinstance(row, schemas.SettlementTopupFailure):
+            # A line the reader could not parse
+            report.failures.append(row.model_copy(update={"row_number": row_number}))
+            continue
+        try:
+            valid.append((row_number, schemas.SettlementTopupRow.model_validate(row)))
+        except ValidationError as e:
+            report.failures.append(
+                schemas.SettlementTopupFailure(
+                    row_number=row_number,
+                    errors=[
+                        f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}"
+                        for error in e.errors()
+                    ],
+                )
+            )
+    if not valid:
+        return
+
+    digests = {row_number: row_digest(row) for row_number, row in valid}
+    result = await db.execute(
+        select(
+            models.SettlementTopup.row_number, models.SettlementTopup.row_digest
+        ).filter(
+            models.SettlementTopup.reference == reference,
+            models.SettlementTopup.row_number.in_(digests),
+        )
+    )
+    already_applied = set()
+    for row_number, digest in result.all():
+        if digest is not None and digest != digests[row_number]:
+            raise SettlementRowChanged(row_number=row_number)
+        already_applied.add(row_number)
+    report.already_applied += len(already_applied)
+    valid = [
+        (row_number, row)
+        for row_number, row in valid
+        if row_number not in already_applied
+    ]
+    if not valid:
+        return
+
+    nic_numbers = {row.nic_number for _, row in valid if row.nic_number is not None}
+    user_ids = {row.user_id for _, row in valid if row.user_id is not None}
+    result = await db.execute(
+        select(
+            models.Customer.id,
+            models.Customer.user_id,
+            models.Customer.nic_number,
+            models.Customer.should_get_service,
+        ).filter(
+            or_(
+                models.Customer.nic_number.in_(nic_numbers),
+                models.Customer.user_id.in_(user_ids),
+            )
+        )
+    )
+    customers = result.all()
+    customers_by_nic_number = {customer.nic_number: customer for customer in customers}
+    customers_by_user_id = {customer.user_id: customer for customer in customers}
+
+    records = []
+    increments: dict[int, float] = {}
+    for row_number, row in valid:
+        customer = (
+            customers_by_nic_number.get(row.nic_number)
+            if row.nic_number is not None
+            else customers_by_user_id.get(row.user_id)
+        )
+        if customer is None:
+            report.failures.append(
+                schemas.SettlementTopupFailure(
+                    row_number=row_number, errors=["Customer not found"]
+                )
+            )
+            continue
+        records.append(
+            {
+                "reference": reference,
+                "row_number": row_number,
+                "customer_id": customer.id,
+                "amount_in_rupees": row.amount_in_rupees,
+                "row_digest": digests[row_number],
+            }
+        )
+        increments[customer.id] = (
+            increments.get(customer.id, 0.0) + row.amount_in_rupees
+        )
+    if not records:
+        return
+
+    # Recording the rows first makes a concurrent run of the same file fail
+    # on the primary key instead of crediting twice
+    await db.execute(insert(models.SettlementTopup), records)
+    table = models.Customer.__table__
+    new_account_balance = table.c.account_balance_in_rupees + bindparam("amount")
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("customer_id"))
+        .values(
+            account_balance_in_rupees=new_account_balance,
+            should_get_service=case(
+                (new_account_balance > 0, True),
+                else_=table.c.should_get_service,
+            ),
+        ),
+        [
+            {"customer_id": customer_id, "amount": amount}
+            for customer_id, amount in increments.items()
+        ],
+    )
+    result = await db.execute(
+        select(
+            models.Customer.id,
+            models.Customer.user_id,
+            models.Customer.account_balance_in_rupees,
+            models.Customer.should_get_service,
+        ).filter(models.Customer.id.in_(increments))
+    )
+    updated = result.all()
+    await db.commit()
+
+    report.applied += len(records)
+    had_service = {customer.id: customer.should_get_service for customer in customers}
+    for customer in updated:
+        if customer.user_id is not None:
+            principal_cache.invalidate(user_id=customer.user_id)
+        depletion_forecaster.observe_balance(
+            customer_id=customer.id,
+            account_balance_in_rupees=customer.account_balance_in_rupees,
+            should_get_service=customer.should_get_service,
+        )
+        if customer.should_get_service and not had_service[customer.id]:
+            report.restored_service += 1
+            service_state_broker.publish(
+                customer_id=customer.id, should_get_service=True
+            )
@@ -0,0 +1,179 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlite import models
+from utils_tariff import tariff_schedule
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+USAGE_ROLLUPS = {
+    "hourly": (models.HourlyUsage, hour_of),
+    "daily": (models.DailyUsage, day_of),
+}
+# Span of a period, and of a query with no start
+USAGE_PERIODS = {"hourly": timedelta(hours=1), "daily": timedelta(days=1)}
+DEFAULT_USAGE_RANGES = {"hourly": timedelta(days=1), "daily": timedelta(days=30)}
+MAX_USAGE_PERIODS = 10000
+
+
+def usage_range(
+    granularity: str, start: datetime | None, end: datetime | None
+) -> tuple[datetime, datetime]:
+    """Localized bounds of a usage query, ending now and spanning the default range when omitted"""
+    end = (
+        datetime.now(tariff_schedule.timezone)
+        if end is None
+        else tariff_schedule.localize(end)
+    )
+    start = (
+        end - DEFAULT_USAGE_RANGES[granularity]
+        if start is None
+        else tariff_schedule.localize(start)
+    )
+    if start >= end:
+        raise ValueError("start must be before end")
+    if (end - start) / USAGE_PERIODS[granularity] > MAX_USAGE_PERIODS:
+        raise ValueError(
+            f"Range spans more than {MAX_USAGE_PERIODS} {granularity} periods"
+        )
+    return start, end
+
+
+def summarize_readings(
+    customer_id: int,
+    readings_rows: list[dict],
+    peak_units_consumed: list[float],
+    period_of,
+) -> list:
+    """Fold readings rows, with the peak units of each, into one usage row per period"""
+    periods: dict[datetime, dict] = {}
+    for row, peak_units in zip(readings_rows, peak_units_consumed):
+        timestamp = row["timestamp"]
+        units_consumed = row["units_consumed"]
+        period_start = period_of(timestamp)
+        period = periods.get(period_start)
+        if period is None:
+            period = periods[period_start] = {
+                "customer_id": customer_id,
+                "period_start": period_start,
+                "readings_count": 0,
+                "units_consumed": 0.0,
+                "cost_in_rupees": 0.0,
+                "peak_units_consumed": 0.0,
+                "off_peak_units_consumed": 0.0,
+                "min_voltage": row["voltage"],
+                "max_voltage": row["voltage"],
+                "min_current": row["current"],
+                "max_current": row["current"],
+            }
+        period["readings_count"] += 1
+        period["units_consumed"] += units_consumed
+        period["cost_in_rupees"] += units_consumed * row["per_unit_cost_in_rupees"]
+        period["peak_units_consumed"] += peak_units
+        period["off_peak_units_consumed"] += units_consumed - peak_units
+        period["min_voltage"] = min(period["min_voltage"], row["voltage"])
+        period["max_voltage"] = max(period["max_voltage"], row["voltage"])
+        period["min_current"] = min(period["min_current"], row["current"])
+        period["max_current"] = max(period["max_current"], row["current"])
+    return list(periods.values())
+
+
+def upsert_usage(model, dialect_name: str):
+    """INSERT that folds into an existing period row instead of conflicting"""
+    table = model.__table__
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    statement = insert(table)
+    new = statement.inserted if dialect_name == "mysql" else statement.excluded
+
+    def lower(column: str):
+        return case((new[column] < table.c[column], new[column]), else_=table.c[column])
+
+    def higher(column: str):
+        return case((new[column] > table.c[column], new[column]), else_=table.c[column])
+
+    values = {
+        column: table.c[column] + new[column]
+        for column in (
+            "readings_count",
+            "units_consumed",
+            "cost_in_rupees",
+            "peak_units_consumed",
+            "off_peak_units_consumed",
+        )
+    }
+    values.update(
+        min_voltage=lower("min_voltage"),
+        max_voltage=higher("max_voltage"),
+        min_current=lower("min_current"),
+        max_current=higher("max_current"),
+    )
+
+    if dialect_name == "mysql":
+        return statement.on_duplicate_key_update(**values)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.customer_id, table.c.period_start], set_=values
+    )
+
+
+async def add_readings_to_usage(
+    customer_id: int,
+    readings_rows: list[dict],
+    previous_reading_at: datetime | None,
+    db: AsyncSession,
+) -> None:
+    """Fold readings into the hourly and daily rollups, within the caller's transaction.
+
+    Timestamps must already be localized to the tariff's timezone and in
+    order, so periods follow its wall clock. Peak and off-peak units are split
+    over the interval since the previous reading, as the cost was.
+    """
+    peak_units_consumed = tariff_schedule.peak_units_of_readings(
+        previous_reading_at=previous_reading_at,
+        timestamps=[row["timestamp"] for row in readings_rows],
+        units_consumed=[row["units_consumed"] for row in readings_rows],
+    )
+    dialect_name = db.bind.dialect.name
+    for model, period_of in USAGE_ROLLUPS.values():
+        rows = summarize_readings(
+            customer_id, readings_rows, peak_units_consumed, period_of
+        )
+        await db.execute(upsert_usage(model, dialect_name), rows)
+
+
+async def get_usage(
+    customer_id: int,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    db: AsyncSession,
+):
+    """Rollup rows of the periods overlapping [start, end), oldest first.
+
+    One range scan of the primary key, however many readings the periods hold.
+    """
+    model, period_of = USAGE_ROLLUPS[granularity]
+    result = await db.scalars(
+        select(model)
+        .filter(
+            model.customer_id == customer_id,
+            model.period_start >= period_of(start),
+            model.period_start < end,
+        )
+        .order_by(model.period_start)
+    )
+    return result.all()
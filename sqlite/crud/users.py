@@ -1,63 +1,143 @@
-from sqlalchemy.orm import Session, joinedload
+from pydantic import ValidationError
+from sqlalchemy import insert, literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from sqlite import models, schemas
-from utils import return_datetime_in_proper_format, get_password_hash
+from sqlite.depletion_forecaster import depletion_forecaster
+from sqlite.power_quality import power_quality_monitor
+from utils import return_datetime_in_proper_format
+from utils_hashing import password_hasher
+from utils_cache import principal_cache
+from utils_device_credentials import device_credential_index
+from utils_pubsub import service_state_broker
+from utils_sequence import reading_sequence_index
 
 
 # Users
-def get_everyone(db: Session):
-    return db.query(models.User).options(joinedload(models.User.customer)).all()
+async def get_users_page(
+    db: AsyncSession,
+    is_admin: bool | None = None,
+    after_id: int | None = None,
+    limit: int = 100,
+    user_fields: list[str] | None = None,
+    customer_fields: list[str] | None = None,
+) -> tuple[list[dict], int | None]:
+    """Keyset page of users ordered by id, selecting only the requested columns.
 
-
-def get_admins(db: Session):
-    return (
-        db.query(models.User)
-        .filter(models.User.is_admin == True)
-        .options(joinedload(models.User.customer))
-        .all()
+    `id` is always selected for users and, when any customer field is asked
+    for, for customers too. Returns the rows and the cursor of the next page,
+    which is `None` on the last page.
+    """
+    user_fields = ["id", *(f for f in user_fields or () if f != "id")]
+    customer_fields = (
+        ["id", *(f for f in customer_fields if f != "id")] if customer_fields else []
     )
 
+    columns = [getattr(models.User, f).label(f) for f in user_fields]
+    columns += [
+        getattr(models.Customer, f).label(f"customer.{f}") for f in customer_fields
+    ]
+    stmt = select(*columns)
+    if customer_fields:
+        stmt = stmt.outerjoin(
+            models.Customer, models.Customer.user_id == models.User.id
+        )
+    if is_admin is not None:
+        stmt = stmt.filter(models.User.is_admin == is_admin)
+    if after_id is not None:
+        stmt = stmt.filter(models.User.id > after_id)
+    result = await db.execute(stmt.order_by(models.User.id).limit(limit + 1))
+    rows = result.mappings().all()
+
+    page = []
+    for row in rows[:limit]:
+        user = {f: row[f] for f in user_fields}
+        if customer_fields:
+            user["customer"] = (
+                {f: row[f"customer.{f}"] for f in customer_fields}
+                if row["customer.id"] is not None
+                else None
+            )
+        page.append(user)
+
+    next_cursor = page[-1]["id"] if len(rows) > limit else None
+    return page, next_cursor
 
-def get_customers(db: Session):
-    return (
-        db.query(models.User)
+
+async def stream_customers_export(
+    db: AsyncSession, should_get_service: bool | None = None, chunk_size: int = 1000
+):
+    """Yield customers with their balances `chunk_size` rows at a time from a server side cursor"""
+    stmt = (
+        select(
+            models.User.id.label("user_id"),
+            models.Customer.id.label("customer_id"),
+            models.User.name,
+            models.User.email,
+            models.Customer.nic_number,
+            models.Customer.units_consumed,
+            models.Customer.account_balance_in_rupees,
+            models.Customer.should_get_service,
+        )
+        .join(models.Customer, models.Customer.user_id == models.User.id)
         .filter(models.User.is_admin == False)
-        .options(joinedload(models.User.customer))
-        .all()
+        .order_by(models.User.id)
+        .execution_options(yield_per=chunk_size)
     )
+    if should_get_service is not None:
+        stmt = stmt.filter(models.Customer.should_get_service == should_get_service)
+
+    result = await db.stream(stmt)
+    async for partition in result.mappings().partitions():
+        yield partition
+
+
+async def get_everyone(db: AsyncSession, **page_options):
+    return await get_users_page(db=db, **page_options)
+
+
+async def get_admins(db: AsyncSession, **page_options):
+    return await get_users_page(db=db, is_admin=True, **page_options)
+
+
+async def get_customers(db: AsyncSession, **page_options):
+    return await get_users_page(db=db, is_admin=False, **page_options)
 
 
-def get_user_by_id(user_id: int, db: Session):
-    return (
-        db.query(models.User)
+async def get_user_by_id(user_id: int, db: AsyncSession):
+    result = await db.scalars(
+        select(models.User)
         .filter(models.User.id == user_id)
         .options(joinedload(models.User.customer))
-        .first()
     )
+    return result.first()
 
 
-def get_user_by_email(user_email: str, db: Session):
-    return (
-        db.query(models.User)
+async def get_user_by_email(user_email: str, db: AsyncSession):
+    result = await db.scalars(
+        select(models.User)
         .filter(models.User.email == user_email)
         .options(joinedload(models.User.customer))
-        .first()
     )
+    return result.first()
 
 
-def create_admin_user(user: schemas.UserAdminCreate, db: Session):
-    user.password = get_password_hash(user.password)
+async def create_admin_user(user: schemas.UserAdminCreate, db: AsyncSession):
+    user.password = await password_hasher.hash(user.password)
     db_user = models.User(**user.__dict__, is_admin=True)
     db.add(db_user)
-    
-    db.commit()
-    db.refresh(db_user)
+
+    await db.commit()
+    await db.refresh(db_user, attribute_names=["customer"])
     return db_user
 
 
-def create_customer_user(user: schemas.UserCustomerCreate, db: Session):
+async def create_customer_user(user: schemas.UserCustomerCreate, db: AsyncSession):
     db_user = models.User(
-        name=user.name, email=user.email, password=get_password_hash(user.password)
+        name=user.name,
+        email=user.email,
+        password=await password_hasher.hash(user.password),
     )
     # Create Customer instance
     db_user.customer = models.Customer(
@@ -70,35 +150,150 @@ def create_customer_user(user: schemas.UserCustomerCreate, db: Session):
         previous_current_reading=0.0,
     )
     db.add(db_user)
-    
-    db.commit()
+
+    await db.commit()
     return db_user
 
 
-def update_admin_user(
-    user: schemas.UserUpdateWithoutCustomer, db_user: models.User, db: Session
+async def provision_customers(
+    rows: list, db: AsyncSession
+) -> schemas.CustomerProvisioningReport:
+    """Create customers in bulk, reporting per row why any could not be created.
+
+    Rows are validated like POST /users/customer. Emails and NIC numbers are
+    checked against the rest of the upload, then against the database in a
+    single query. Passwords are hashed in parallel on the bulk pool, and
+    every user and customer is inserted with two executemany INSERTs in one
+    transaction.
+    """
+    results = [
+        schemas.CustomerProvisioningResult(row_number=row_number)
+        for row_number in range(1, len(rows) + 1)
+    ]
+    valid: list[tuple[schemas.CustomerProvisioningResult, schemas.UserCustomerCreate]]
+    valid = []
+    for result, row in zip(results, rows):
+        if isinstance(row, dict) and isinstance(row.get("email"), str):
+            result.email = row["email"]
+        try:
+            valid.append((result, schemas.UserCustomerCreate.model_validate(row)))
+        except ValidationError as e:
+            result.errors = [
+                f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}"
+                for error in e.errors()
+            ]
+
+    first_row_by_email: dict[str, int] = {}
+    first_row_by_nic: dict[str, int] = {}
+    for result, user in valid:
+        email, nic_number = user.email, user.customer.nic_number
+        if email in first_row_by_email:
+            result.errors.append(f"email: same as row {first_row_by_email[email]}")
+        else:
+            first_row_by_email[email] = result.row_number
+        if nic_number in first_row_by_nic:
+            result.errors.append(
+                f"customer.nic_number: same as row {first_row_by_nic[nic_number]}"
+            )
+        else:
+            first_row_by_nic[nic_number] = result.row_number
+
+    if valid:
+        existing = await db.execute(
+            union_all(
+                select(literal("email"), models.User.email).filter(
+                    models.User.email.in_(first_row_by_email)
+                ),
+                select(literal("nic_number"), models.Customer.nic_number).filter(
+                    models.Customer.nic_number.in_(first_row_by_nic)
+                ),
+            )
+        )
+        existing = set(existing.tuples())
+        for result, user in valid:
+            if ("email", user.email) in existing:
+                result.errors.append("email: user already exists")
+            if ("nic_number", user.customer.nic_number) in existing:
+                result.errors.append("customer.nic_number: customer already exists")
+
+    to_create = [(result, user) for result, user in valid if not result.errors]
+    if to_create:
+        # Hand the connection back while bcrypt runs, which can take minutes
+        # for a large upload. The unique constraints still catch any email or
+        # NIC number taken meanwhile.
+        await db.commit()
+        passwords = await password_hasher.hash_many(
+            [user.password for _, user in to_create]
+        )
+        user_ids = await db.scalars(
+            insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+            [
+                {"name": user.name, "email": user.email, "password": password}
+                for (_, user), password in zip(to_create, passwords)
+            ],
+        )
+        user_ids = user_ids.all()
+        await db.execute(
+            insert(models.Customer),
+            [
+                {
+                    "user_id": user_id,
+                    "nic_number": user.customer.nic_number,
+                    "units_consumed": 0.0,
+                    "account_balance_in_rupees": 0.0,
+                    "should_get_service": False,
+                    "previous_voltage_reading": 0.0,
+                    "previous_current_reading": 0.0,
+                }
+                for (_, user), user_id in zip(to_create, user_ids)
+            ],
+        )
+        await db.commit()
+        for (result, _), user_id in zip(to_create, user_ids):
+            result.user_id = user_id
+
+    return schemas.CustomerProvisioningReport(
+        created=len(to_create), failed=len(rows) - len(to_create), rows=results
+    )
+
+
+async def update_admin_user(
+    user: schemas.UserUpdateWithoutCustomer, db_user: models.User, db: AsyncSession
 ):
     db_user.update(user)
-    
-    db.commit()
+
+    await db.commit()
+    principal_cache.invalidate(user_id=db_user.id)
     return db_user
 
 
-def update_customer_user(
+async def update_customer_user(
     user: schemas.UserUpdateWithCustomer,
     db_user: models.User,
-    db: Session,
+    db: AsyncSession,
 ):
     db_user.update(user)
     db_user.customer.update(user.customer)
     db_user.customer.updated_at = return_datetime_in_proper_format()
-    
-    db.commit()
+
+    await db.commit()
+    principal_cache.invalidate(user_id=db_user.id)
+    service_state_broker.publish(
+        customer_id=db_user.customer.id,
+        should_get_service=db_user.customer.should_get_service,
+    )
     return db_user
 
 
-def delete_user(db_user: models.User, db: Session):
-    db.delete(db_user)
-    
-    db.commit()
+async def delete_user(db_user: models.User, db: AsyncSession):
+    await db.delete(db_user)
+
+    await db.commit()
+    principal_cache.invalidate(user_id=db_user.id)
+    device_credential_index.remove_user(user_id=db_user.id)
+    if db_user.customer is not None:
+        service_state_broker.close(customer_id=db_user.customer.id)
+        reading_sequence_index.forget(customer_id=db_user.customer.id)
+        depletion_forecaster.forget(customer_id=db_user.customer.id)
+        power_quality_monitor.forget(customer_id=db_user.customer.id)
     return {"detail": "Deleted successfully"}
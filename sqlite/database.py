@@ -1,17 +1,137 @@
-from sqlalchemy import create_engine
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime, TypeDecorator, create_engine
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from sqlalchemy import event
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///sqlite.db"
+from utils import secret
+
+# Async drivers used when ASYNC_DATABASE_URL is not set explicitly
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_url_for(url: URL) -> URL:
+    """Swap the driver of a sync database URL for its async counterpart"""
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+class UTCDateTime(TypeDecorator):
+    """Aware datetimes stored as UTC, and read back as UTC.
+
+    SQLite and MySQL drop the offset of an aware datetime, so values in
+    other timezones would come back as naive wall-clock times. Naive values
+    are taken to be UTC, like `return_datetime_in_proper_format` and the
+    databases' own `CURRENT_TIMESTAMP`.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: datetime | None, dialect):
+        if value is None or value.tzinfo is None:
+            return value
+        value = value.astimezone(timezone.utc)
+        return value if dialect.name == "postgresql" else value.replace(tzinfo=None)
+
+    def process_result_value(self, value: datetime | None, dialect):
+        if value is None:
+            return value
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+
+def sqlite_pragmas(
+    journal_mode: str,
+    synchronous: str,
+    mmap_size_in_bytes: int,
+    cache_size_in_kibibytes: int,
+    busy_timeout_in_milliseconds: int,
+):
+    """Build a connect listener that tunes every new SQLite connection"""
+    pragmas = (
+        "pragma foreign_keys=on",
+        f"pragma journal_mode={journal_mode}",
+        f"pragma synchronous={synchronous}",
+        f"pragma mmap_size={mmap_size_in_bytes}",
+        # Negative values are in KiB rather than pages
+        f"pragma cache_size=-{cache_size_in_kibibytes}",
+        f"pragma busy_timeout={busy_timeout_in_milliseconds}",
+    )
+
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return set_pragmas
+
 
+def engine_options(url: URL, is_async: bool = False) -> dict:
+    """Pool and driver options for the configured database"""
+    if url.get_backend_name() != "sqlite":
+        return {
+            "pool_size": secret.DATABASE_POOL_SIZE,
+            "max_overflow": secret.DATABASE_MAX_OVERFLOW,
+            "pool_timeout": secret.DATABASE_POOL_TIMEOUT_IN_SECONDS,
+            "pool_recycle": secret.DATABASE_POOL_RECYCLE_IN_SECONDS,
+            "pool_pre_ping": True,
+        }
+    if url.database in (None, "", ":memory:"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "connect_args": {"check_same_thread": False},
+        "poolclass": AsyncAdaptedQueuePool if is_async else QueuePool,
+        "pool_size": secret.DATABASE_POOL_SIZE,
+        "max_overflow": secret.DATABASE_MAX_OVERFLOW,
+        "pool_timeout": secret.DATABASE_POOL_TIMEOUT_IN_SECONDS,
+    }
+
+
+SQLALCHEMY_DATABASE_URL = make_url(secret.DATABASE_URL)
+SQLALCHEMY_ASYNC_DATABASE_URL = (
+    make_url(secret.ASYNC_DATABASE_URL)
+    if secret.ASYNC_DATABASE_URL
+    else async_url_for(SQLALCHEMY_DATABASE_URL)
+)
+
+set_sqlite_pragmas = sqlite_pragmas(
+    journal_mode=secret.SQLITE_JOURNAL_MODE,
+    synchronous=secret.SQLITE_SYNCHRONOUS,
+    mmap_size_in_bytes=secret.SQLITE_MMAP_SIZE_IN_BYTES,
+    cache_size_in_kibibytes=secret.SQLITE_CACHE_SIZE_IN_KIBIBYTES,
+    busy_timeout_in_milliseconds=secret.SQLITE_BUSY_TIMEOUT_IN_MILLISECONDS,
+)
+
+# Synchronous engine, used by alembic and offline tooling
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-event.listen(engine, 'connect', lambda c, _: c.execute('pragma foreign_keys=on'))
+# Asynchronous engine, used by the API so queries never block the event loop
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL,
+    **engine_options(SQLALCHEMY_ASYNC_DATABASE_URL, is_async=True),
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+if SQLALCHEMY_DATABASE_URL.get_backend_name() == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+if SQLALCHEMY_ASYNC_DATABASE_URL.get_backend_name() == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
 
 Base = declarative_base()
 
@@ -23,3 +143,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    db: AsyncSession = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
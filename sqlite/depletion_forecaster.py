@@ -0,0 +1,306 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, update
+
+from sqlite import models, schemas
+from sqlite.database import AsyncSessionLocal
+from utils import secret
+from utils_cache import principal_cache
+from utils_pubsub import service_state_broker
+from utils_tariff import tariff_schedule
+
+logger = logging.getLogger(__name__)
+
+# Wait before retrying cut-offs the database refused
+RETRY_DELAY_IN_SECONDS = 5.0
+
+
+def cut_off_time(reading_at: float, balance: float, rate: float | None) -> float | None:
+    """When the balance as of a reading runs out at `rate` rupees per second"""
+    if rate is None or rate <= 0 or balance <= 0:
+        return None
+    return reading_at + balance / rate
+
+
+class DepletionForecaster:
+    """Projects when each customer's balance runs out, and cuts service off then.
+
+    Spending is estimated per customer in rupees per second, as a moving
+    average of the readings weighted by how recent they are, with a time
+    constant of `window_in_seconds`. It starts from zero, so a customer's
+    first few readings cannot project a cut-off much earlier than the window
+    of spending they cover warrants. The estimate is stored with the balance
+    as `Customer.spending_rate_in_rupees_per_second`, so every worker, and
+    the gateway, project the same cut-off from the same customer row. With
+    the balance after the latest reading, that gives the moment the balance
+    reaches zero. The moments of the customers whose readings this process
+    applied are kept in a heap, so the background task only ever sleeps
+    until the earliest one. When it comes, the stored balance, latest
+    reading and rate are read again and service is switched off, unless they
+    now project a later cut-off, e.g. after a top-up through another worker,
+    in which case it is rescheduled. Readings still settle the balance.
+    """
+
+    def __init__(
+        self, window_in_seconds: float, session_factory=AsyncSessionLocal
+    ) -> None:
+        self.window_in_seconds = window_in_seconds
+        self.session_factory = session_factory
+        self.cut_offs_total = 0
+        # Rupees per second, and the balance as of the latest reading
+        self._rates: dict[int, float] = {}
+        self._balances: dict[int, tuple[float, float]] = {}
+        self._cut_off_at: dict[int, float] = {}
+        # (cut-off time, customer id), entries no longer in `_cut_off_at` are stale
+        self._heap: list[tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+
+    def _schedule(self, customer_id: int, should_get_service: bool) -> None:
+        reading_at, balance = self._balances.get(customer_id, (0.0, 0.0))
+        cut_off_at = cut_off_time(reading_at, balance, self._rates.get(customer_id))
+        if not should_get_service or cut_off_at is None:
+            self._cut_off_at.pop(customer_id, None)
+            return
+        if self._cut_off_at.get(customer_id) == cut_off_at:
+            return
+        self._cut_off_at[customer_id] = cut_off_at
+        if not self._heap or cut_off_at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (cut_off_at, customer_id))
+        if len(self._heap) > 2 * len(self._cut_off_at) + 1024:
+            # Every reading reschedules, drop the stale entries it left behind
+            self._heap = [(at, id_) for id_, at in self._cut_off_at.items()]
+            heapq.heapify(self._heap)
+
+    def spending_rate(
+        self,
+        rate: float | None,
+        previous_reading_at: datetime | None,
+        readings_rows: list[dict],
+    ) -> float | None:
+        """The rate after readings, oldest first, starting from the stored one"""
+        reading_at = (
+            None if previous_reading_at is None else previous_reading_at.timestamp()
+        )
+        for row in readings_rows:
+            timestamp = row["timestamp"].timestamp()
+            if reading_at is not None and timestamp > reading_at:
+                interval = timestamp - reading_at
+                spent_per_second = (
+                    row["units_consumed"] * row["per_unit_cost_in_rupees"] / interval
+                )
+                weight = 1 - math.exp(-interval / self.window_in_seconds)
+                rate = weight * spent_per_second + (1 - weight) * (rate or 0.0)
+            if reading_at is None or timestamp > reading_at:
+                reading_at = timestamp
+        return rate
+
+    def observe_readings(
+        self,
+        customer_id: int,
+        spending_rate: float | None,
+        reading_at: datetime,
+        account_balance_in_rupees: float,
+        should_get_service: bool,
+    ) -> None:
+        """Reschedule after readings were applied, with the rate stored with them"""
+        if spending_rate is None:
+            self._rates.pop(customer_id, None)
+        else:
+            self._rates[customer_id] = spending_rate
+        self._balances[customer_id] = (
+            tariff_schedule.localize(reading_at).timestamp(),
+            account_balance_in_rupees,
+        )
+        self._schedule(customer_id, should_get_service)
+
+    def observe_balance(
+        self,
+        customer_id: int,
+        account_balance_in_rupees: float,
+        should_get_service: bool,
+    ) -> None:
+        """Reschedule after a top-up, keeping the time of the latest reading"""
+        if customer_id not in self._balances:
+            return
+        reading_at, _ = self._balances[customer_id]
+        self._balances[customer_id] = (reading_at, account_balance_in_rupees)
+        self._schedule(customer_id, should_get_service)
+
+    def forget(self, customer_id: int) -> None:
+        self._rates.pop(customer_id, None)
+        self._balances.pop(customer_id, None)
+        self._cut_off_at.pop(customer_id, None)
+
+    def projected_cut_off_at(self, customer: schemas.Customer) -> datetime | None:
+        """The cut-off projected from the customer's stored balance and rate"""
+        if not customer.should_get_service or customer.previous_reading_at is None:
+            return None
+        cut_off_at = cut_off_time(
+            tariff_schedule.localize(customer.previous_reading_at).timestamp(),
+            customer.account_balance_in_rupees,
+            customer.spending_rate_in_rupees_per_second,
+        )
+        if cut_off_at is None:
+            return None
+        return datetime.fromtimestamp(cut_off_at, timezone.utc)
+
+    async def load(self) -> None:
+        """Schedule customers with service from their stored rates.
+
+        Customers without one, whose readings predate it being stored, are
+        seeded from the last window of hourly usage.
+        """
+        now = datetime.now(tariff_schedule.timezone)
+        since = now - timedelta(seconds=self.window_in_seconds)
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    models.Customer.id,
+                    models.Customer.account_balance_in_rupees,
+                    models.Customer.previous_reading_at,
+                    models.Customer.spending_rate_in_rupees_per_second,
+                    func.sum(models.HourlyUsage.cost_in_rupees),
+                )
+                .outerjoin(
+                    models.HourlyUsage,
+                    (models.HourlyUsage.customer_id == models.Customer.id)
+                    & (models.HourlyUsage.period_start >= since),
+                )
+                .filter(
+                    models.Customer.should_get_service,
+                    models.Customer.previous_reading_at.is_not(None),
+                )
+                .group_by(models.Customer.id)
+            )
+            rows = result.all()
+        for customer_id, balance, previous_reading_at, rate, cost in rows:
+            if customer_id in self._balances:
+                continue
+            if rate is None:
+                if not cost:
+                    continue
+                rate = cost / self.window_in_seconds
+            self._rates[customer_id] = rate
+            self._balances[customer_id] = (
+                tariff_schedule.localize(previous_reading_at).timestamp(),
+                balance,
+            )
+            self._schedule(customer_id, should_get_service=True)
+
+    def _pop_due(self, now: float) -> tuple[list[int], float | None]:
+        """Customers whose cut-off has come, and seconds until the next one"""
+        due = []
+        while self._heap:
+            cut_off_at, customer_id = self._heap[0]
+            if self._cut_off_at.get(customer_id) != cut_off_at:
+                heapq.heappop(self._heap)
+                continue
+            if cut_off_at > now:
+                return due, cut_off_at - now
+            heapq.heappop(self._heap)
+            del self._cut_off_at[customer_id]
+            due.append(customer_id)
+        return due, None
+
+    async def cut_off(self, customer_ids: list[int]) -> int:
+        """Switch off service of customers still projected to have run out"""
+        now = time.time()
+        cut_off = []
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    models.Customer.id,
+                    models.Customer.account_balance_in_rupees,
+                    models.Customer.previous_reading_at,
+                    models.Customer.spending_rate_in_rupees_per_second,
+                ).filter(
+                    models.Customer.id.in_(customer_ids),
+                    models.Customer.should_get_service,
+                )
+            )
+            for customer_id, balance, previous_reading_at, rate in result.all():
+                if previous_reading_at is not None and customer_id in self._balances:
+                    stored = (
+                        tariff_schedule.localize(previous_reading_at).timestamp(),
+                        balance,
+                    )
+                    if stored != self._balances[customer_id] or rate != self._rates.get(
+                        customer_id
+                    ):
+                        # Readings or a top-up through another worker
+                        self._balances[customer_id] = stored
+                        if rate is not None:
+                            self._rates[customer_id] = rate
+                        self._schedule(customer_id, should_get_service=True)
+                        if self._cut_off_at.get(customer_id, now) > now:
+                            continue
+                        self._cut_off_at.pop(customer_id, None)
+                updated = await db.execute(
+                    update(models.Customer)
+                    .where(
+                        models.Customer.id == customer_id,
+                        models.Customer.should_get_service,
+                        # A top-up since the read above keeps the service on
+                        models.Customer.account_balance_in_rupees <= balance,
+                    )
+                    .values(should_get_service=False)
+                    .returning(models.Customer.user_id)
+                )
+                for (user_id,) in updated:
+                    cut_off.append((customer_id, user_id))
+            await db.commit()
+
+        for customer_id, user_id in cut_off:
+            if user_id is not None:
+                principal_cache.invalidate(user_id=user_id)
+            service_state_broker.publish(
+                customer_id=customer_id, should_get_service=False
+            )
+        self.cut_offs_total += len(cut_off)
+        return len(cut_off)
+
+    async def run(self) -> None:
+        """Cut service off as projections come due, meant to run as a background task"""
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            due, timeout = self._pop_due(time.time())
+            if due:
+                try:
+                    await self.cut_off(due)
+                except Exception:
+                    logger.exception("Could not cut off %s customers", len(due))
+                    retry_at = time.time() + RETRY_DELAY_IN_SECONDS
+                    for customer_id in due:
+                        self._cut_off_at.setdefault(customer_id, retry_at)
+                        heapq.heappush(self._heap, (retry_at, customer_id))
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "customers": len(self._rates),
+            "scheduled": len(self._cut_off_at),
+            "next_cut_off_at": min(
+                (
+                    datetime.fromtimestamp(cut_off_at, timezone.utc)
+                    for cut_off_at in self._cut_off_at.values()
+                ),
+                default=None,
+            ),
+            "cut_offs_total": self.cut_offs_total,
+        }
+
+
+depletion_forecaster = DepletionForecaster(
+    window_in_seconds=secret.SERVICE_FORECAST_WINDOW_IN_SECONDS
+)
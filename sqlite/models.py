@@ -4,22 +4,21 @@ from sqlalchemy import (
     Float,
     String,
     Boolean,
-    DateTime,
     ForeignKey,
     Enum,
+    Index,
+    PrimaryKeyConstraint,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import declared_attr, relationship
 from sqlalchemy.sql import func
 
-from sqlite.database import Base, engine
+from sqlite.database import Base, UTCDateTime
 from sqlite.schemas import (
     UserUpdateWithoutCustomer,
     CustomerCreateOrUpdate,
     CustomerReadingBase,
 )
 
-Base.metadata.create_all(bind=engine)
-
 
 class User(Base):
     __tablename__ = "users"
@@ -37,10 +36,11 @@ class User(Base):
         cascade="all,delete",
     )
 
-    created_at = Column(
-        DateTime(timezone=True), nullable=True, server_default=func.now()
-    )
-    updated_at = Column(DateTime(timezone=True), nullable=True, onupdate=func.now())
+    created_at = Column(UTCDateTime(), nullable=True, server_default=func.now())
+    updated_at = Column(UTCDateTime(), nullable=True, onupdate=func.now())
+
+    # Fetch server generated columns on flush, async sessions cannot lazy load
+    __mapper_args__ = {"eager_defaults": True}
 
     def update(self, user: UserUpdateWithoutCustomer, **kwargs):
         self.name = user.name
@@ -58,11 +58,18 @@ class Customer(Base):
     should_get_service = Column(Boolean, nullable=False, default=False)
     previous_voltage_reading = Column(Float, nullable=False, default=0.0)
     previous_current_reading = Column(Float, nullable=False, default=0.0)
+    previous_reading_at = Column(UTCDateTime(), nullable=True)
+    # Highest sequence number applied from the meter, see utils_sequence
+    last_sequence_number = Column(Integer, nullable=True)
+    # Moving average of spending, see sqlite/depletion_forecaster.py
+    spending_rate_in_rupees_per_second = Column(Float, nullable=True)
+    # Times the mark was reset for a meter whose counter restarted
+    sequence_resets = Column(Integer, nullable=False, default=0, server_default="0")
 
-    created_at = Column(
-        DateTime(timezone=True), nullable=True, server_default=func.now()
-    )
-    updated_at = Column(DateTime(timezone=True), nullable=True, onupdate=func.now())
+    created_at = Column(UTCDateTime(), nullable=True, server_default=func.now())
+    updated_at = Column(UTCDateTime(), nullable=True, onupdate=func.now())
+
+    __mapper_args__ = {"eager_defaults": True}
 
     def update(self, cux: CustomerCreateOrUpdate, **kwargs):
         self.nic_number = cux.nic_number
@@ -70,3 +77,122 @@ class Customer(Base):
     def update_previous_readings(self, readings: CustomerReadingBase, **kwargs):
         self.previous_voltage_reading = readings.voltage
         self.previous_current_reading = readings.current
+
+
+class Reading(Base):
+    __tablename__ = "readings"
+
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(
+        Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+    )
+    timestamp = Column(UTCDateTime(), nullable=False)
+    voltage = Column(Float, nullable=False)
+    current = Column(Float, nullable=False)
+    units_consumed = Column(Float, nullable=False)
+    per_unit_cost_in_rupees = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_readings_customer_id_timestamp", customer_id, timestamp),
+    )
+
+
+class UsageMixin:
+    """Consumption of a customer over one period, updated as readings arrive.
+
+    `period_start` is on the tariff's wall clock. The primary key doubles as
+    the index that range queries scan.
+    """
+
+    @declared_attr
+    def customer_id(cls):
+        return Column(
+            Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+        )
+
+    period_start = Column(UTCDateTime(), nullable=False)
+    readings_count = Column(Integer, nullable=False)
+    units_consumed = Column(Float, nullable=False)
+    cost_in_rupees = Column(Float, nullable=False)
+    # Units of readings taken while a band above the base rate applied
+    peak_units_consumed = Column(Float, nullable=False)
+    off_peak_units_consumed = Column(Float, nullable=False)
+    min_voltage = Column(Float, nullable=False)
+    max_voltage = Column(Float, nullable=False)
+    min_current = Column(Float, nullable=False)
+    max_current = Column(Float, nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        # Customer first, so a customer's periods are contiguous in the index
+        return (PrimaryKeyConstraint("customer_id", "period_start"),)
+
+
+class HourlyUsage(UsageMixin, Base):
+    __tablename__ = "hourly_usage"
+
+
+class DailyUsage(UsageMixin, Base):
+    __tablename__ = "daily_usage"
+
+
+class PowerQualityStats(Base):
+    """Voltage and current statistics of a customer's readings, see sqlite/power_quality.py"""
+
+    __tablename__ = "power_quality_stats"
+
+    customer_id = Column(
+        Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True
+    )
+    readings_count = Column(Integer, nullable=False)
+    # Welford's running mean and sum of squared deviations
+    voltage_mean = Column(Float, nullable=False)
+    voltage_m2 = Column(Float, nullable=False)
+    voltage_min = Column(Float, nullable=False)
+    voltage_max = Column(Float, nullable=False)
+    voltage_ewma = Column(Float, nullable=False)
+    current_mean = Column(Float, nullable=False)
+    current_m2 = Column(Float, nullable=False)
+    current_min = Column(Float, nullable=False)
+    current_max = Column(Float, nullable=False)
+    current_ewma = Column(Float, nullable=False)
+    sag_readings = Column(Integer, nullable=False)
+    swell_readings = Column(Integer, nullable=False)
+    overcurrent_readings = Column(Integer, nullable=False)
+
+    updated_at = Column(UTCDateTime(), nullable=True)
+
+
+class SettlementTopup(Base):
+    """A settlement file row that has been credited, so it is never credited twice"""
+
+    __tablename__ = "settlement_topups"
+
+    reference = Column(String, primary_key=True)
+    row_number = Column(Integer, primary_key=True)
+    customer_id = Column(
+        Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+    )
+    amount_in_rupees = Column(Float, nullable=False)
+    # SHA-256 of the row as sent, see sqlite/crud/topups.py, NULL before it was kept
+    row_digest = Column(String(64), nullable=True)
+
+    created_at = Column(UTCDateTime(), nullable=True, server_default=func.now())
+
+
+class DeviceCredential(Base):
+    __tablename__ = "device_credentials"
+
+    id = Column(Integer, primary_key=True)
+    key_id = Column(String, unique=True, index=True, nullable=False)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    name = Column(String, nullable=True)
+    # HMAC-SHA256 of the secret part of the key, the key itself is never stored
+    secret_digest = Column(String, nullable=False)
+
+    created_at = Column(UTCDateTime(), nullable=True, server_default=func.now())
+    revoked_at = Column(UTCDateTime(), nullable=True)
+
+    __mapper_args__ = {"eager_defaults": True}
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import math
+from array import array
+from datetime import datetime, timezone
+from typing import Iterable
+
+from sqlite import models
+from sqlite.crud.power_quality import upsert_power_quality
+from sqlite.database import AsyncSessionLocal
+from sqlite.readings_buffer import execute_for_existing_customers
+from utils import secret
+
+logger = logging.getLogger(__name__)
+
+# Layout of a customer's statistics in the state array
+COUNT, SAGS, SWELLS, OVERCURRENTS, VOLTAGE, CURRENT = 0, 1, 2, 3, 4, 9
+# Offsets within the VOLTAGE and CURRENT blocks
+MEAN, M2, MIN, MAX, EWMA = range(5)
+STRIDE = 14
+EMPTY = array("d", [0.0] * STRIDE)
+EMPTY[VOLTAGE + EWMA] = EMPTY[CURRENT + EWMA] = math.nan
+
+
+class PowerQualityMonitor:
+    """Streaming voltage and current statistics per customer, for sags, swells and overcurrent.
+
+    Every reading updates its customer's statistics in constant time: a
+    count, Welford's mean and sum of squared deviations, min and max, a
+    moving average, and counters of readings beyond the thresholds. They
+    live in one flat `array("d")` at a fixed stride per customer, rather
+    than in an object per customer. What accumulated since the last
+    checkpoint is folded into the customer's row every
+    `checkpoint_interval_in_seconds` with the parallel form of Welford's
+    algorithm, so several workers can add to the same row. Only the moving
+    averages, which the anomaly flags are based on, are last writer wins.
+    Statistics of customers deleted since their readings are dropped.
+    """
+
+    def __init__(
+        self,
+        nominal_voltage: float,
+        voltage_tolerance: float,
+        max_current: float,
+        ewma_weight: float,
+        checkpoint_interval_in_seconds: float,
+        session_factory=AsyncSessionLocal,
+    ) -> None:
+        self.sag_voltage = nominal_voltage * (1 - voltage_tolerance)
+        self.swell_voltage = nominal_voltage * (1 + voltage_tolerance)
+        self.max_current = max_current
+        self.ewma_weight = ewma_weight
+        self.checkpoint_interval_in_seconds = checkpoint_interval_in_seconds
+        self.session_factory = session_factory
+        self.checkpointed_total = 0
+        self._state = array("d")
+        self._slots: dict[int, int] = {}
+        self._free_slots: list[int] = []
+        # Customers with readings since the last checkpoint
+        self._dirty: set[int] = set()
+        self._checkpoint_lock = asyncio.Lock()
+
+    def _base(self, customer_id: int) -> int:
+        slot = self._slots.get(customer_id)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self._state[slot * STRIDE : (slot + 1) * STRIDE] = EMPTY
+            else:
+                slot = len(self._state) // STRIDE
+                self._state.extend(EMPTY)
+            self._slots[customer_id] = slot
+        return slot * STRIDE
+
+    def _add(self, base: int, value: float, count: float) -> None:
+        state = self._state
+        delta = value - state[base + MEAN]
+        state[base + MEAN] += delta / count
+        state[base + M2] += delta * (value - state[base + MEAN])
+        if count == 1 or value < state[base + MIN]:
+            state[base + MIN] = value
+        if count == 1 or value > state[base + MAX]:
+            state[base + MAX] = value
+        ewma = state[base + EWMA]
+        state[base + EWMA] = (
+            value if ewma != ewma else ewma + self.ewma_weight * (value - ewma)
+        )
+
+    def observe(
+        self, customer_id: int, readings: Iterable[tuple[float, float]]
+    ) -> None:
+        """Add (voltage, current) readings, oldest first"""
+        state = self._state
+        base = self._base(customer_id)
+        for voltage, current in readings:
+            count = state[base + COUNT] + 1
+            state[base + COUNT] = count
+            self._add(base + VOLTAGE, voltage, count)
+            self._add(base + CURRENT, current, count)
+            if voltage < self.sag_voltage:
+                state[base + SAGS] += 1
+            elif voltage > self.swell_voltage:
+                state[base + SWELLS] += 1
+            if current > self.max_current:
+                state[base + OVERCURRENTS] += 1
+        self._dirty.add(customer_id)
+
+    def forget(self, customer_id: int) -> None:
+        slot = self._slots.pop(customer_id, None)
+        if slot is not None:
+            self._free_slots.append(slot)
+        self._dirty.discard(customer_id)
+
+    def _take_row(self, customer_id: int, updated_at: datetime) -> dict:
+        """The statistics since the last checkpoint as a row, starting them again"""
+        state = self._state
+        base = self._slots[customer_id] * STRIDE
+        row = {
+            "customer_id": customer_id,
+            "readings_count": int(state[base + COUNT]),
+            "sag_readings": int(state[base + SAGS]),
+            "swell_readings": int(state[base + SWELLS]),
+            "overcurrent_readings": int(state[base + OVERCURRENTS]),
+            "updated_at": updated_at,
+        }
+        for quantity, block in (("voltage", VOLTAGE), ("current", CURRENT)):
+            for field, offset in (
+                ("mean", MEAN),
+                ("m2", M2),
+                ("min", MIN),
+                ("max", MAX),
+                ("ewma", EWMA),
+            ):
+                row[f"{quantity}_{field}"] = state[base + block + offset]
+        # The moving averages carry on across checkpoints
+        state[base : base + VOLTAGE + EWMA] = EMPTY[: VOLTAGE + EWMA]
+        state[base + CURRENT : base + CURRENT + EWMA] = EMPTY[CURRENT : CURRENT + EWMA]
+        return row
+
+    def _restore_row(self, row: dict) -> None:
+        """Fold a row that could not be written back in, under the readings since"""
+        state = self._state
+        base = self._base(row["customer_id"])
+        count = state[base + COUNT]
+        row_count = row["readings_count"]
+        total = count + row_count
+        for quantity, block in (("voltage", VOLTAGE), ("current", CURRENT)):
+            row_mean = row[f"{quantity}_mean"]
+            delta = state[base + block + MEAN] - row_mean
+            state[base + block + M2] += (
+                row[f"{quantity}_m2"] + delta * delta * count * row_count / total
+            )
+            state[base + block + MEAN] = row_mean + delta * count / total
+            for field, offset, pick in (("min", MIN, min), ("max", MAX, max)):
+                row_value = row[f"{quantity}_{field}"]
+                state[base + block + offset] = (
+                    pick(state[base + block + offset], row_value)
+                    if count
+                    else row_value
+                )
+        state[base + COUNT] = total
+        state[base + SAGS] += row["sag_readings"]
+        state[base + SWELLS] += row["swell_readings"]
+        state[base + OVERCURRENTS] += row["overcurrent_readings"]
+        self._dirty.add(row["customer_id"])
+
+    def _restore_rows(self, rows: list[dict]) -> None:
+        for row in rows:
+            # Unless the customer was deleted meanwhile
+            if row["customer_id"] in self._slots:
+                self._restore_row(row)
+
+    async def _write(self, rows: list[dict]) -> list[dict]:
+        """Upsert rows, leaving out those of customers that no longer exist"""
+        async with self.session_factory() as db:
+            return await execute_for_existing_customers(
+                statement=upsert_power_quality(db.bind.dialect.name), rows=rows, db=db
+            )
+
+    async def checkpoint(self) -> int:
+        """Fold the statistics since the last checkpoint into the database"""
+        async with self._checkpoint_lock:
+            if not self._dirty:
+                return 0
+            updated_at = datetime.now(timezone.utc)
+            rows = [
+                self._take_row(customer_id, updated_at) for customer_id in self._dirty
+            ]
+            self._dirty = set()
+            try:
+                written = await self._write(rows)
+            except asyncio.CancelledError:
+                # Cancelled on shutdown, the final checkpoint writes them
+                self._restore_rows(rows)
+                raise
+            except Exception:
+                logger.exception(
+                    "Could not checkpoint power quality of %s customers", len(rows)
+                )
+                # The session rolls back on close, the rows wait for the next one
+                self._restore_rows(rows)
+                return 0
+            if len(written) < len(rows):
+                # Customers deleted by another worker can never be written
+                kept = {row["customer_id"] for row in written}
+                for row in rows:
+                    if row["customer_id"] not in kept:
+                        self.forget(row["customer_id"])
+                logger.warning(
+                    "Dropped power quality of %s deleted customers",
+                    len(rows) - len(written),
+                )
+            self.checkpointed_total += len(written)
+            return len(written)
+
+    async def checkpoint_periodically(self) -> None:
+        """Checkpoint on an interval, meant to run as a background task"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval_in_seconds)
+            await self.checkpoint()
+
+    def flag_conditions(self) -> dict:
+        """SQL condition of each anomaly flag"""
+        table = models.PowerQualityStats
+        return {
+            "sag": table.voltage_ewma < self.sag_voltage,
+            "swell": table.voltage_ewma > self.swell_voltage,
+            "overcurrent": table.current_ewma > self.max_current,
+        }
+
+    def describe(self, db_stats: models.PowerQualityStats) -> dict:
+        """A checkpointed row with standard deviations and anomaly flags"""
+        count = db_stats.readings_count
+        stats = {
+            "customer_id": db_stats.customer_id,
+            "readings_count": count,
+            "sag_readings": db_stats.sag_readings,
+            "swell_readings": db_stats.swell_readings,
+            "overcurrent_readings": db_stats.overcurrent_readings,
+            "updated_at": db_stats.updated_at,
+        }
+        for quantity in ("voltage", "current"):
+            m2 = getattr(db_stats, f"{quantity}_m2")
+            stats.update(
+                {
+                    f"{quantity}_mean": getattr(db_stats, f"{quantity}_mean"),
+                    f"{quantity}_std_dev": math.sqrt(m2 / (count - 1))
+                    if count > 1
+                    else 0.0,
+                    f"{quantity}_min": getattr(db_stats, f"{quantity}_min"),
+                    f"{quantity}_max": getattr(db_stats, f"{quantity}_max"),
+                    f"{quantity}_ewma": getattr(db_stats, f"{quantity}_ewma"),
+                }
+            )
+        stats["flags"] = [
+            flag
+            for flag, flagged in (
+                ("sag", stats["voltage_ewma"] < self.sag_voltage),
+                ("swell", stats["voltage_ewma"] > self.swell_voltage),
+                ("overcurrent", stats["current_ewma"] > self.max_current),
+            )
+            if flagged
+        ]
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "customers": len(self._slots),
+            "pending_checkpoint": len(self._dirty),
+            "state_bytes": self._state.itemsize * len(self._state),
+            "checkpointed_total": self.checkpointed_total,
+        }
+
+
+power_quality_monitor = PowerQualityMonitor(
+    nominal_voltage=secret.POWER_QUALITY_NOMINAL_VOLTAGE,
+    voltage_tolerance=secret.POWER_QUALITY_VOLTAGE_TOLERANCE,
+    max_current=secret.POWER_QUALITY_MAX_CURRENT,
+    ewma_weight=secret.POWER_QUALITY_EWMA_WEIGHT,
+    checkpoint_interval_in_seconds=secret.POWER_QUALITY_CHECKPOINT_INTERVAL_IN_SECONDS,
+)
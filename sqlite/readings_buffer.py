@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import deque
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlite import models
+from sqlite.database import AsyncSessionLocal
+from utils import secret
+
+logger = logging.getLogger(__name__)
+
+
+async def execute_for_existing_customers(
+    statement, rows: list[dict], db: AsyncSession
+) -> list[dict]:
+    """Execute and commit a statement for rows keyed by customer id.
+
+    When a customer was deleted since its rows were queued, the foreign key
+    fails the whole statement, so it is executed again with only the rows
+    of customers that still exist. Returns the rows written.
+    """
+    try:
+        await db.execute(statement, rows)
+        await db.commit()
+        return rows
+    except IntegrityError:
+        await db.rollback()
+
+    existing = set(
+        await db.scalars(
+            select(models.Customer.id).where(
+                models.Customer.id.in_({row["customer_id"] for row in rows})
+            )
+        )
+    )
+    rows = [row for row in rows if row["customer_id"] in existing]
+    if rows:
+        await db.execute(statement, rows)
+        await db.commit()
+    return rows
+
+
+class ReadingsBuffer:
+    """In-process write buffer for the append-only readings table.
+
+    Rows are held in memory and written by a background task with a single
+    executemany INSERT once `flush_size` rows are pending, every
+    `flush_interval_in_seconds`, or when the app shuts down. At most `max_size`
+    rows are held; if the database is unavailable for long enough to fill the
+    buffer, the oldest rows are dropped. Rows of customers deleted since they
+    were queued are dropped rather than retried, since they can never be
+    written.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        flush_size: int,
+        flush_interval_in_seconds: float,
+        session_factory=AsyncSessionLocal,
+    ) -> None:
+        self.max_size = max_size
+        self.flush_size = min(flush_size, max_size)
+        self.flush_interval_in_seconds = flush_interval_in_seconds
+        self.session_factory = session_factory
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self._rows: deque[dict] = deque()
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        return len(self._rows)
+
+    def _extend(self, rows: list[dict], at_front: bool = False) -> None:
+        if at_front:
+            self._rows.extendleft(reversed(rows))
+        else:
+            self._rows.extend(rows)
+        overflow = len(self._rows) - self.max_size
+        for _ in range(max(overflow, 0)):
+            self._rows.popleft()
+        self.dropped_total += max(overflow, 0)
+
+    def add(self, rows: list[dict]) -> None:
+        """Queue readings rows, waking the flush task once the size threshold is hit"""
+        self._extend(rows)
+        if self.depth >= self.flush_size:
+            self._flush_requested.set()
+
+    async def _write(self, rows: list[dict]) -> int:
+        """Insert rows, leaving out those of customers that no longer exist"""
+        async with self.session_factory() as db:
+            written = await execute_for_existing_customers(
+                statement=insert(models.Reading.__table__), rows=rows, db=db
+            )
+            return len(written)
+
+    async def flush(self) -> int:
+        """Write every pending row with one executemany INSERT"""
+        async with self._flush_lock:
+            rows = list(self._rows)
+            self._rows.clear()
+            if not rows:
+                return 0
+
+            try:
+                written = await self._write(rows)
+            except asyncio.CancelledError:
+                # Cancelled on shutdown, the final flush writes them
+                self._extend(rows, at_front=True)
+                raise
+            except Exception:
+                logger.exception("Could not flush %s readings", len(rows))
+                self._extend(rows, at_front=True)
+                return 0
+            if written < len(rows):
+                logger.warning(
+                    "Dropped %s readings of deleted customers", len(rows) - written
+                )
+
+            self.flushed_total += written
+            self.dropped_total += len(rows) - written
+            return written
+
+    async def flush_periodically(self) -> None:
+        """Flush on the size or time threshold, meant to run as a background task"""
+        self._flush_requested = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(),
+                    timeout=self.flush_interval_in_seconds,
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "flushed_total": self.flushed_total,
+            "dropped_total": self.dropped_total,
+        }
+
+
+readings_buffer = ReadingsBuffer(
+    max_size=secret.READINGS_BUFFER_MAX_SIZE,
+    flush_size=secret.READINGS_BUFFER_FLUSH_SIZE,
+    flush_interval_in_seconds=secret.READINGS_BUFFER_FLUSH_INTERVAL_IN_SECONDS,
+)
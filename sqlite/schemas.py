@@ -1,5 +1,9 @@
 from datetime import datetime
-from pydantic import BaseModel, field_validator
+from typing import Literal
+
+from pydantic import BaseModel, field_validator, model_validator
+
+MAX_READINGS_PER_BATCH = 1000
 
 
 class Token(BaseModel):
@@ -60,6 +64,10 @@ class Customer(CustomerBase):
 
     previous_voltage_reading: float
     previous_current_reading: float
+    previous_reading_at: datetime | None = None
+    last_sequence_number: int | None = None
+    sequence_resets: int = 0
+    spending_rate_in_rupees_per_second: float | None = None
 
     created_at: datetime
     updated_at: datetime | None
@@ -72,6 +80,8 @@ class CustomerReadingBase(BaseModel):
     voltage: float
     current: float
     units_consumed: float
+    # Numbered by the meter, a reading at or below the last applied one is a replay
+    sequence_number: int | None = None
 
     @field_validator("voltage", "current")
     @classmethod
@@ -80,6 +90,107 @@ class CustomerReadingBase(BaseModel):
             raise ValueError("must be a positive value")
         return v
 
+    @field_validator("sequence_number")
+    @classmethod
+    def sequence_number_validator(cls, v: int | None) -> int | None:
+        if v is not None and v < 0:
+            raise ValueError("must not be negative")
+        return v
+
+
+class CustomerTimestampedReadingBase(CustomerReadingBase):
+    timestamp: datetime
+
+
+class CustomerReadingBatchBase(BaseModel):
+    readings: list[CustomerTimestampedReadingBase]
+
+    @field_validator("readings")
+    @classmethod
+    def readings_validator(
+        cls, v: list[CustomerTimestampedReadingBase]
+    ) -> list[CustomerTimestampedReadingBase]:
+        if len(v) == 0:
+            raise ValueError("must contain at least one reading")
+        if len(v) > MAX_READINGS_PER_BATCH:
+            raise ValueError(
+                f"must not contain more than {MAX_READINGS_PER_BATCH} readings"
+            )
+        return v
+
+
+class UsagePeriod(BaseModel):
+    period_start: datetime
+    readings_count: int
+    units_consumed: float
+    cost_in_rupees: float
+    peak_units_consumed: float
+    off_peak_units_consumed: float
+    min_voltage: float
+    max_voltage: float
+    min_current: float
+    max_current: float
+
+    class Config:
+        orm_mode = True
+
+
+class ReadingsBufferStats(BaseModel):
+    depth: int
+    max_size: int
+    flushed_total: int
+    dropped_total: int
+
+
+class PrincipalCacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class PasswordHasherStats(BaseModel):
+    max_workers: int
+    max_pending: int
+    pending: int
+    completed_total: int
+    rejected_total: int
+
+
+class DepletionForecasterStats(BaseModel):
+    customers: int
+    scheduled: int
+    next_cut_off_at: datetime | None
+    cut_offs_total: int
+
+
+class PowerQualityMonitorStats(BaseModel):
+    customers: int
+    pending_checkpoint: int
+    state_bytes: int
+    checkpointed_total: int
+
+
+class PowerQualityStats(BaseModel):
+    customer_id: int
+    readings_count: int
+    voltage_mean: float
+    voltage_std_dev: float
+    voltage_min: float
+    voltage_max: float
+    voltage_ewma: float
+    current_mean: float
+    current_std_dev: float
+    current_min: float
+    current_max: float
+    current_ewma: float
+    sag_readings: int
+    swell_readings: int
+    overcurrent_readings: int
+    flags: list[Literal["sag", "swell", "overcurrent"]]
+    updated_at: datetime
+
 
 class CustomerTopupAccountBalanceBase(BaseModel):
     account_balance_in_rupees: float
@@ -92,6 +203,40 @@ class CustomerTopupAccountBalanceBase(BaseModel):
         return v
 
 
+class SettlementTopupRow(BaseModel):
+    # The customer's NIC number or user id, whichever the bank has
+    nic_number: str | None = None
+    user_id: int | None = None
+    amount_in_rupees: float
+
+    @field_validator("amount_in_rupees")
+    @classmethod
+    def value_validator(cls, v: float) -> float:
+        if v <= 0:
+            raise ValueError("must be greater than zero")
+        return v
+
+    @model_validator(mode="after")
+    def customer_validator(self) -> "SettlementTopupRow":
+        if (self.nic_number is None) == (self.user_id is None):
+            raise ValueError("give either nic_number or user_id")
+        return self
+
+
+class SettlementTopupFailure(BaseModel):
+    row_number: int
+    errors: list[str]
+
+
+class SettlementTopupReport(BaseModel):
+    reference: str
+    applied: int
+    already_applied: int
+    failed: int
+    restored_service: int
+    failures: list[SettlementTopupFailure]
+
+
 # User
 class UserBase(BaseModel):
     name: str
@@ -157,4 +302,80 @@ class User(UserOrmBase):
     updated_at: datetime | None
 
 
+class CustomerWithForecast(Customer):
+    # When service is projected to be cut off at the stored rate of spending,
+    # `None` without service or before a rate is known
+    projected_cut_off_at: datetime | None = None
+
+
+class UserWithForecast(User):
+    customer: CustomerWithForecast | None = None
+
+
+class CustomerProvisioningResult(BaseModel):
+    row_number: int
+    email: str | None = None
+    user_id: int | None = None
+    errors: list[str] = []
+
+
+class CustomerProvisioningReport(BaseModel):
+    created: int
+    failed: int
+    rows: list[CustomerProvisioningResult]
+
+
+# Device credential
+class DeviceCredentialCreate(BaseModel):
+    name: str | None = None
+
+
+class DeviceCredential(BaseModel):
+    key_id: str
+    user_id: int
+    name: str | None = None
+
+    created_at: datetime
+    revoked_at: datetime | None = None
+
+    class Config:
+        orm_mode = True
+
+
+class DeviceCredentialIssued(DeviceCredential):
+    api_key: str
+
+
+class CustomerPartial(BaseModel):
+    id: int
+    nic_number: str | None = None
+    units_consumed: float | None = None
+    account_balance_in_rupees: float | None = None
+    should_get_service: bool | None = None
+
+    previous_voltage_reading: float | None = None
+    previous_current_reading: float | None = None
+    previous_reading_at: datetime | None = None
+    last_sequence_number: int | None = None
+    sequence_resets: int | None = None
+    spending_rate_in_rupees_per_second: float | None = None
+
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+class UserAdminPartial(BaseModel):
+    id: int
+    name: str | None = None
+    email: str | None = None
+    is_admin: bool | None = None
+
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+class UserPartial(UserAdminPartial):
+    customer: CustomerPartial | None = None
+
+
 Token.model_rebuild()
@@ -1,11 +1,15 @@
+import functools
 import os
-from jose import jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from dotenv import load_dotenv
 
-# Getting all environment variables and loading them to memory
-load_dotenv()
+# Getting all environment variables and loading them to memory. The path is
+# fixed, so a missing file costs one stat instead of importing python-dotenv
+# and walking up the directory tree looking for it
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+
+    load_dotenv(ENV_FILE)
 
 
 class Secret:
@@ -14,6 +18,51 @@ class Secret:
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     PER_UNIT_COST_IN_RUPEES: float
     PER_UNIT_PEAK_FACTOR_COST_IN_RUPEES: float
+    READINGS_BUFFER_MAX_SIZE: int
+    READINGS_BUFFER_FLUSH_SIZE: int
+    READINGS_BUFFER_FLUSH_INTERVAL_IN_SECONDS: float
+    PRINCIPAL_CACHE_MAX_SIZE: int
+    PRINCIPAL_CACHE_TTL_IN_SECONDS: float
+    SERVICE_STATE_HEARTBEAT_INTERVAL_IN_SECONDS: float
+    DATABASE_URL: str
+    ASYNC_DATABASE_URL: str | None
+    DATABASE_POOL_SIZE: int
+    DATABASE_MAX_OVERFLOW: int
+    DATABASE_POOL_TIMEOUT_IN_SECONDS: float
+    DATABASE_POOL_RECYCLE_IN_SECONDS: int
+    SQLITE_JOURNAL_MODE: str
+    SQLITE_SYNCHRONOUS: str
+    SQLITE_MMAP_SIZE_IN_BYTES: int
+    SQLITE_CACHE_SIZE_IN_KIBIBYTES: int
+    SQLITE_BUSY_TIMEOUT_IN_MILLISECONDS: int
+    EXPORT_CHUNK_SIZE: int
+    TARIFF_TIMEZONE: str
+    TARIFF_SCHEDULE: str | None
+    PASSWORD_HASHING_MAX_WORKERS: int
+    PASSWORD_HASHING_MAX_PENDING: int
+    PASSWORD_BCRYPT_ROUNDS: int
+    PASSWORD_REHASH_ON_LOGIN: bool
+    DEVICE_CREDENTIALS_RESYNC_INTERVAL_IN_SECONDS: float
+    METRICS_HOST: str
+    METRICS_PORT: int | None
+    QUERY_TRACING: bool
+    SLOW_QUERY_THRESHOLD_IN_MILLISECONDS: float | None
+    CREATE_DATABASE_SCHEMA_ON_STARTUP: bool
+    PASSWORD_HASHING_BULK_MAX_WORKERS: int
+    BULK_PROVISIONING_MAX_ROWS: int
+    SETTLEMENT_TOPUP_CHUNK_SIZE: int
+    SERVICE_FORECAST_WINDOW_IN_SECONDS: float
+    GATEWAY_HOST: str
+    GATEWAY_PORT: int | None
+    GATEWAY_BATCH_WINDOW_IN_MILLISECONDS: float
+    GATEWAY_TLS_CERT_FILE: str | None
+    GATEWAY_TLS_KEY_FILE: str | None
+    GATEWAY_ALLOW_PLAINTEXT: bool
+    POWER_QUALITY_NOMINAL_VOLTAGE: float
+    POWER_QUALITY_VOLTAGE_TOLERANCE: float
+    POWER_QUALITY_MAX_CURRENT: float
+    POWER_QUALITY_EWMA_WEIGHT: float
+    POWER_QUALITY_CHECKPOINT_INTERVAL_IN_SECONDS: float
 
     def __init__(
         self,
@@ -22,6 +71,51 @@ class Secret:
         access_token_expire_minutes: float | str,
         per_unit_cost_in_rupees,
         per_unit_peak_factor_cost_in_rupess,
+        readings_buffer_max_size: int | str = 10000,
+        readings_buffer_flush_size: int | str = 500,
+        readings_buffer_flush_interval_in_seconds: float | str = 2.0,
+        principal_cache_max_size: int | str = 10000,
+        principal_cache_ttl_in_seconds: float | str = 60.0,
+        service_state_heartbeat_interval_in_seconds: float | str = 15.0,
+        database_url: str = "sqlite:///sqlite.db",
+        async_database_url: str | None = None,
+        database_pool_size: int | str = 5,
+        database_max_overflow: int | str = 10,
+        database_pool_timeout_in_seconds: float | str = 30.0,
+        database_pool_recycle_in_seconds: int | str = 1800,
+        sqlite_journal_mode: str = "WAL",
+        sqlite_synchronous: str = "NORMAL",
+        sqlite_mmap_size_in_bytes: int | str = 268435456,
+        sqlite_cache_size_in_kibibytes: int | str = 65536,
+        sqlite_busy_timeout_in_milliseconds: int | str = 5000,
+        export_chunk_size: int | str = 1000,
+        tariff_timezone: str = "Asia/Karachi",
+        tariff_schedule: str | None = None,
+        password_hashing_max_workers: int | str | None = None,
+        password_hashing_max_pending: int | str = 64,
+        password_bcrypt_rounds: int | str = 12,
+        password_rehash_on_login: bool | str = False,
+        device_credentials_resync_interval_in_seconds: float | str = 30.0,
+        metrics_host: str = "127.0.0.1",
+        metrics_port: int | str | None = None,
+        query_tracing: bool | str = False,
+        slow_query_threshold_in_milliseconds: float | str | None = None,
+        create_database_schema_on_startup: bool | str = False,
+        password_hashing_bulk_max_workers: int | str | None = None,
+        bulk_provisioning_max_rows: int | str = 10000,
+        settlement_topup_chunk_size: int | str = 1000,
+        service_forecast_window_in_seconds: float | str = 3600,
+        gateway_host: str = "127.0.0.1",
+        gateway_port: int | str | None = None,
+        gateway_batch_window_in_milliseconds: float | str = 20,
+        gateway_tls_cert_file: str | None = None,
+        gateway_tls_key_file: str | None = None,
+        gateway_allow_plaintext: bool | str = False,
+        power_quality_nominal_voltage: float | str = 230,
+        power_quality_voltage_tolerance: float | str = 0.1,
+        power_quality_max_current: float | str = 60,
+        power_quality_ewma_weight: float | str = 0.1,
+        power_quality_checkpoint_interval_in_seconds: float | str = 60,
     ) -> None:
         self.SECRET_KEY = secret_key
         self.ALGORITHM = algorithm
@@ -30,6 +124,88 @@ class Secret:
         self.PER_UNIT_PEAK_FACTOR_COST_IN_RUPEES = float(
             per_unit_peak_factor_cost_in_rupess
         )
+        self.READINGS_BUFFER_MAX_SIZE = int(readings_buffer_max_size)
+        self.READINGS_BUFFER_FLUSH_SIZE = int(readings_buffer_flush_size)
+        self.READINGS_BUFFER_FLUSH_INTERVAL_IN_SECONDS = float(
+            readings_buffer_flush_interval_in_seconds
+        )
+        self.PRINCIPAL_CACHE_MAX_SIZE = int(principal_cache_max_size)
+        self.PRINCIPAL_CACHE_TTL_IN_SECONDS = float(principal_cache_ttl_in_seconds)
+        self.SERVICE_STATE_HEARTBEAT_INTERVAL_IN_SECONDS = float(
+            service_state_heartbeat_interval_in_seconds
+        )
+        self.DATABASE_URL = database_url
+        self.ASYNC_DATABASE_URL = async_database_url
+        self.DATABASE_POOL_SIZE = int(database_pool_size)
+        self.DATABASE_MAX_OVERFLOW = int(database_max_overflow)
+        self.DATABASE_POOL_TIMEOUT_IN_SECONDS = float(database_pool_timeout_in_seconds)
+        self.DATABASE_POOL_RECYCLE_IN_SECONDS = int(database_pool_recycle_in_seconds)
+        self.SQLITE_JOURNAL_MODE = sqlite_journal_mode
+        self.SQLITE_SYNCHRONOUS = sqlite_synchronous
+        self.SQLITE_MMAP_SIZE_IN_BYTES = int(sqlite_mmap_size_in_bytes)
+        self.SQLITE_CACHE_SIZE_IN_KIBIBYTES = int(sqlite_cache_size_in_kibibytes)
+        self.SQLITE_BUSY_TIMEOUT_IN_MILLISECONDS = int(
+            sqlite_busy_timeout_in_milliseconds
+        )
+        self.EXPORT_CHUNK_SIZE = int(export_chunk_size)
+        self.TARIFF_TIMEZONE = tariff_timezone
+        self.TARIFF_SCHEDULE = tariff_schedule
+        # bcrypt competes with the event loop for CPU, so leave it half the cores
+        self.PASSWORD_HASHING_MAX_WORKERS = (
+            int(password_hashing_max_workers)
+            if password_hashing_max_workers
+            else max(1, (os.cpu_count() or 1) // 2)
+        )
+        self.PASSWORD_HASHING_MAX_PENDING = int(password_hashing_max_pending)
+        self.PASSWORD_BCRYPT_ROUNDS = int(password_bcrypt_rounds)
+        self.PASSWORD_REHASH_ON_LOGIN = str(password_rehash_on_login).lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+        self.DEVICE_CREDENTIALS_RESYNC_INTERVAL_IN_SECONDS = float(
+            device_credentials_resync_interval_in_seconds
+        )
+        self.METRICS_HOST = metrics_host
+        self.METRICS_PORT = int(metrics_port) if metrics_port else None
+        self.QUERY_TRACING = str(query_tracing).lower() in ("1", "true", "yes")
+        self.SLOW_QUERY_THRESHOLD_IN_MILLISECONDS = (
+            float(slow_query_threshold_in_milliseconds)
+            if slow_query_threshold_in_milliseconds
+            else None
+        )
+        self.CREATE_DATABASE_SCHEMA_ON_STARTUP = str(
+            create_database_schema_on_startup
+        ).lower() in ("1", "true", "yes")
+        self.PASSWORD_HASHING_BULK_MAX_WORKERS = (
+            int(password_hashing_bulk_max_workers)
+            if password_hashing_bulk_max_workers
+            else max(1, (os.cpu_count() or 1) // 2)
+        )
+        self.BULK_PROVISIONING_MAX_ROWS = int(bulk_provisioning_max_rows)
+        self.SETTLEMENT_TOPUP_CHUNK_SIZE = int(settlement_topup_chunk_size)
+        self.SERVICE_FORECAST_WINDOW_IN_SECONDS = float(
+            service_forecast_window_in_seconds
+        )
+        self.GATEWAY_HOST = gateway_host
+        self.GATEWAY_PORT = int(gateway_port) if gateway_port else None
+        self.GATEWAY_BATCH_WINDOW_IN_MILLISECONDS = float(
+            gateway_batch_window_in_milliseconds
+        )
+        self.GATEWAY_TLS_CERT_FILE = gateway_tls_cert_file or None
+        self.GATEWAY_TLS_KEY_FILE = gateway_tls_key_file or None
+        self.GATEWAY_ALLOW_PLAINTEXT = str(gateway_allow_plaintext).lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+        self.POWER_QUALITY_NOMINAL_VOLTAGE = float(power_quality_nominal_voltage)
+        self.POWER_QUALITY_VOLTAGE_TOLERANCE = float(power_quality_voltage_tolerance)
+        self.POWER_QUALITY_MAX_CURRENT = float(power_quality_max_current)
+        self.POWER_QUALITY_EWMA_WEIGHT = float(power_quality_ewma_weight)
+        self.POWER_QUALITY_CHECKPOINT_INTERVAL_IN_SECONDS = float(
+            power_quality_checkpoint_interval_in_seconds
+        )
 
 
 secret = Secret(
@@ -40,9 +216,86 @@ secret = Secret(
     per_unit_peak_factor_cost_in_rupess=os.getenv(
         "PER_UNIT_PEAK_FACTOR_COST_IN_RUPEES"
     ),
+    readings_buffer_max_size=os.getenv("READINGS_BUFFER_MAX_SIZE", 10000),
+    readings_buffer_flush_size=os.getenv("READINGS_BUFFER_FLUSH_SIZE", 500),
+    readings_buffer_flush_interval_in_seconds=os.getenv(
+        "READINGS_BUFFER_FLUSH_INTERVAL_IN_SECONDS", 2.0
+    ),
+    principal_cache_max_size=os.getenv("PRINCIPAL_CACHE_MAX_SIZE", 10000),
+    principal_cache_ttl_in_seconds=os.getenv("PRINCIPAL_CACHE_TTL_IN_SECONDS", 60.0),
+    service_state_heartbeat_interval_in_seconds=os.getenv(
+        "SERVICE_STATE_HEARTBEAT_INTERVAL_IN_SECONDS", 15.0
+    ),
+    database_url=os.getenv("DATABASE_URL", "sqlite:///sqlite.db"),
+    async_database_url=os.getenv("ASYNC_DATABASE_URL"),
+    database_pool_size=os.getenv("DATABASE_POOL_SIZE", 5),
+    database_max_overflow=os.getenv("DATABASE_MAX_OVERFLOW", 10),
+    database_pool_timeout_in_seconds=os.getenv(
+        "DATABASE_POOL_TIMEOUT_IN_SECONDS", 30.0
+    ),
+    database_pool_recycle_in_seconds=os.getenv(
+        "DATABASE_POOL_RECYCLE_IN_SECONDS", 1800
+    ),
+    sqlite_journal_mode=os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    sqlite_synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    sqlite_mmap_size_in_bytes=os.getenv("SQLITE_MMAP_SIZE_IN_BYTES", 268435456),
+    sqlite_cache_size_in_kibibytes=os.getenv("SQLITE_CACHE_SIZE_IN_KIBIBYTES", 65536),
+    sqlite_busy_timeout_in_milliseconds=os.getenv(
+        "SQLITE_BUSY_TIMEOUT_IN_MILLISECONDS", 5000
+    ),
+    export_chunk_size=os.getenv("EXPORT_CHUNK_SIZE", 1000),
+    tariff_timezone=os.getenv("TARIFF_TIMEZONE", "Asia/Karachi"),
+    tariff_schedule=os.getenv("TARIFF_SCHEDULE"),
+    password_hashing_max_workers=os.getenv("PASSWORD_HASHING_MAX_WORKERS"),
+    password_hashing_max_pending=os.getenv("PASSWORD_HASHING_MAX_PENDING", 64),
+    password_bcrypt_rounds=os.getenv("PASSWORD_BCRYPT_ROUNDS", 12),
+    password_rehash_on_login=os.getenv("PASSWORD_REHASH_ON_LOGIN", False),
+    device_credentials_resync_interval_in_seconds=os.getenv(
+        "DEVICE_CREDENTIALS_RESYNC_INTERVAL_IN_SECONDS", 30.0
+    ),
+    metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+    metrics_port=os.getenv("METRICS_PORT"),
+    query_tracing=os.getenv("QUERY_TRACING", False),
+    slow_query_threshold_in_milliseconds=os.getenv(
+        "SLOW_QUERY_THRESHOLD_IN_MILLISECONDS"
+    ),
+    create_database_schema_on_startup=os.getenv(
+        "CREATE_DATABASE_SCHEMA_ON_STARTUP", False
+    ),
+    password_hashing_bulk_max_workers=os.getenv("PASSWORD_HASHING_BULK_MAX_WORKERS"),
+    bulk_provisioning_max_rows=os.getenv("BULK_PROVISIONING_MAX_ROWS", 10000),
+    settlement_topup_chunk_size=os.getenv("SETTLEMENT_TOPUP_CHUNK_SIZE", 1000),
+    service_forecast_window_in_seconds=os.getenv(
+        "SERVICE_FORECAST_WINDOW_IN_SECONDS", 3600
+    ),
+    gateway_host=os.getenv("GATEWAY_HOST", "127.0.0.1"),
+    gateway_port=os.getenv("GATEWAY_PORT"),
+    gateway_batch_window_in_milliseconds=os.getenv(
+        "GATEWAY_BATCH_WINDOW_IN_MILLISECONDS", 20
+    ),
+    gateway_tls_cert_file=os.getenv("GATEWAY_TLS_CERT_FILE"),
+    gateway_tls_key_file=os.getenv("GATEWAY_TLS_KEY_FILE"),
+    gateway_allow_plaintext=os.getenv("GATEWAY_ALLOW_PLAINTEXT", False),
+    power_quality_nominal_voltage=os.getenv("POWER_QUALITY_NOMINAL_VOLTAGE", 230),
+    power_quality_voltage_tolerance=os.getenv("POWER_QUALITY_VOLTAGE_TOLERANCE", 0.1),
+    power_quality_max_current=os.getenv("POWER_QUALITY_MAX_CURRENT", 60),
+    power_quality_ewma_weight=os.getenv("POWER_QUALITY_EWMA_WEIGHT", 0.1),
+    power_quality_checkpoint_interval_in_seconds=os.getenv(
+        "POWER_QUALITY_CHECKPOINT_INTERVAL_IN_SECONDS", 60
+    ),
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@functools.cache
+def get_password_context():
+    """The bcrypt `CryptContext`, built on first use so importing utils stays cheap"""
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=secret.PASSWORD_BCRYPT_ROUNDS,
+    )
 
 
 def are_object_to_edit_and_other_object_same_by_nic(
@@ -69,39 +322,14 @@ def return_datetime_in_proper_format() -> datetime:
     return datetime.strptime(current_timestamp, "%Y-%m-%dT%H:%M:%S")
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify if the provided plain and hashed password strings match"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> bool:
-    """Generate a hash for the provided password string"""
-    return pwd_context.hash(password)
-
-
 def create_access_token(
     data: dict, expires_delta: timedelta, key: str, algorithm: str
 ) -> str:
     """Generate JWT based access token"""
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, key=key, algorithm=algorithm)
     return encoded_jwt
-
-
-def return_per_unit_cost_depending_on_time() -> float:
-    current_time = datetime.now()
-    datetime_6pm = datetime(
-        year=current_time.year,
-        month=current_time.month,
-        day=current_time.day,
-        hour=18,
-        minute=0,
-    )
-    datetime_10pm = datetime_6pm + timedelta(hours=4)
-
-    if current_time >= datetime_6pm and current_time <= datetime_10pm:
-        return float(secret.PER_UNIT_PEAK_FACTOR_COST_IN_RUPEES)
-    else:
-        return float(secret.PER_UNIT_COST_IN_RUPEES)
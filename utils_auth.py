@@ -1,30 +1,49 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from sqlite.database import get_db
-from sqlalchemy.orm import Session
+from sqlite.database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from typing import Annotated
 from jose import JWTError, jwt
 
-from sqlite.schemas import TokenData
-from sqlite.crud.users import get_user_by_email
-from sqlite.models import User
+from sqlite.schemas import TokenData, User
+from sqlite.crud.users import get_user_by_email, get_user_by_id
 from utils import secret
+from utils_cache import principal_cache
+from utils_device_credentials import API_KEY_PREFIX, device_credential_index
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Get current user, based on the access token that they provided"""
+    """Get current user, based on the access token or device API key that they provided"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if token.startswith(API_KEY_PREFIX):
+        # Checked on every request, so a revoked key stops working at once
+        user_id = device_credential_index.authenticate(token)
+        if user_id is None:
+            raise credentials_exception
+        user = principal_cache.get(token)
+        if user is not None:
+            return user
+        db_user = await get_user_by_id(user_id=user_id, db=db)
+        if db_user is None:
+            raise credentials_exception
+        return principal_cache.set(token=token, db_user=db_user)
+
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
     try:
         payload = jwt.decode(token, secret.SECRET_KEY, algorithms=[secret.ALGORITHM])
         email: str = payload.get("sub")
@@ -33,10 +52,12 @@ async def get_current_user(
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = get_user_by_email(user_email=token_data.email, db=db)
-    if user is None:
+    db_user = await get_user_by_email(user_email=token_data.email, db=db)
+    if db_user is None:
         raise credentials_exception
-    return user
+    return principal_cache.set(
+        token=token, db_user=db_user, token_expires_at=payload.get("exp")
+    )
 
 
 async def user_should_be_admin(
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+from sqlite import models, schemas
+from utils import secret
+
+
+class PrincipalCache:
+    """Bounded LRU/TTL cache of access tokens to the user they authenticate.
+
+    Entries are read-only `schemas.User` snapshots so they can be shared
+    between requests. Any write that changes a user must either `invalidate`
+    or `refresh` it, otherwise the snapshot is served until it expires. The
+    cache is per process, so with several workers a change made on one worker
+    can be served stale by the others for up to `ttl_in_seconds`.
+    """
+
+    def __init__(self, max_size: int, ttl_in_seconds: float) -> None:
+        self.max_size = max_size
+        self.ttl_in_seconds = ttl_in_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[schemas.User, float]] = OrderedDict()
+        self._tokens_by_user_id: dict[int, set[str]] = {}
+
+    def get(self, token: str) -> schemas.User | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def set(
+        self, token: str, db_user: models.User, token_expires_at: float | None = None
+    ) -> schemas.User:
+        """Snapshot the user and cache it, never beyond the token's own expiry"""
+        user = schemas.User.model_validate(db_user, from_attributes=True)
+        expires_at = time.monotonic() + self.ttl_in_seconds
+        if token_expires_at is not None:
+            expires_at = min(
+                expires_at, time.monotonic() + token_expires_at - time.time()
+            )
+
+        self._remove(token)
+        self._entries[token] = (user, expires_at)
+        self._tokens_by_user_id.setdefault(user.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return user
+
+    def refresh(self, user: schemas.User) -> None:
+        """Replace the cached snapshots of this user with its current state"""
+        tokens = self._tokens_by_user_id.get(user.id)
+        if not tokens:
+            return
+        for token in tokens:
+            _, expires_at = self._entries[token]
+            self._entries[token] = (user, expires_at)
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop every cached token of this user"""
+        for token in list(self._tokens_by_user_id.get(user_id, ())):
+            self._remove(token)
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user_id.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user_id[entry[0].id]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+principal_cache = PrincipalCache(
+    max_size=secret.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl_in_seconds=secret.PRINCIPAL_CACHE_TTL_IN_SECONDS,
+)
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+
+from sqlalchemy import select
+
+from sqlite import models
+from sqlite.database import AsyncSessionLocal
+from utils import secret
+
+logger = logging.getLogger(__name__)
+
+API_KEY_PREFIX = "sem_"
+
+
+class DeviceCredentialIndex:
+    """In-memory index of active device API keys, checked without DB or bcrypt.
+
+    A key looks like `sem_<key_id>.<secret>`. Only an HMAC-SHA256 digest of
+    the secret is stored, keyed by `key_id`, and presented keys are compared
+    against it in constant time. Each process keeps its own copy, reloaded
+    from the database every `resync_interval_in_seconds`, so keys issued or
+    revoked through another worker take effect here within that interval.
+    """
+
+    def __init__(
+        self,
+        signing_key: str,
+        resync_interval_in_seconds: float,
+        session_factory=AsyncSessionLocal,
+    ) -> None:
+        self.resync_interval_in_seconds = resync_interval_in_seconds
+        self.session_factory = session_factory
+        self._signing_key = signing_key.encode()
+        self._entries: dict[str, tuple[bytes, int]] = {}
+        # Changes made while a reload is reading the table, replayed over it
+        self._changes_during_load: dict[str, tuple[bytes, int] | None] | None = None
+
+    def digest(self, key_secret: str) -> bytes:
+        return hmac.new(self._signing_key, key_secret.encode(), hashlib.sha256).digest()
+
+    def generate(self) -> tuple[str, str, str]:
+        """Returns a new key id, the full API key and the hex digest to store"""
+        key_id = secrets.token_hex(8)
+        key_secret = secrets.token_urlsafe(32)
+        return (
+            key_id,
+            f"{API_KEY_PREFIX}{key_id}.{key_secret}",
+            self.digest(key_secret).hex(),
+        )
+
+    def add(self, key_id: str, secret_digest: str, user_id: int) -> None:
+        entry = (bytes.fromhex(secret_digest), user_id)
+        self._entries[key_id] = entry
+        if self._changes_during_load is not None:
+            self._changes_during_load[key_id] = entry
+
+    def remove(self, key_id: str) -> None:
+        self._entries.pop(key_id, None)
+        if self._changes_during_load is not None:
+            self._changes_during_load[key_id] = None
+
+    def remove_user(self, user_id: int) -> None:
+        for key_id, (_, key_user_id) in list(self._entries.items()):
+            if key_user_id == user_id:
+                self.remove(key_id)
+
+    def authenticate(self, api_key: str) -> int | None:
+        """The id of the user the key belongs to, `None` if it is unknown or revoked"""
+        key_id, _, key_secret = api_key.removeprefix(API_KEY_PREFIX).partition(".")
+        entry = self._entries.get(key_id)
+        # Digest even unknown keys, so timing does not reveal which key ids exist
+        presented_digest = self.digest(key_secret)
+        if entry is None:
+            return None
+        secret_digest, user_id = entry
+        if not hmac.compare_digest(presented_digest, secret_digest):
+            return None
+        return user_id
+
+    async def load(self) -> None:
+        """Replace the index with every unrevoked credential in the database"""
+        self._changes_during_load = {}
+        try:
+            async with self.session_factory() as db:
+                result = await db.execute(
+                    select(
+                        models.DeviceCredential.key_id,
+                        models.DeviceCredential.secret_digest,
+                        models.DeviceCredential.user_id,
+                    ).filter(models.DeviceCredential.revoked_at.is_(None))
+                )
+                entries = {
+                    key_id: (bytes.fromhex(secret_digest), user_id)
+                    for key_id, secret_digest, user_id in result
+                }
+            for key_id, entry in self._changes_during_load.items():
+                if entry is None:
+                    entries.pop(key_id, None)
+                else:
+                    entries[key_id] = entry
+            self._entries = entries
+        finally:
+            self._changes_during_load = None
+
+    async def resync_periodically(self) -> None:
+        """Reload the index on an interval, meant to run as a background task"""
+        while True:
+            await asyncio.sleep(self.resync_interval_in_seconds)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Could not reload device credentials")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+device_credential_index = DeviceCredentialIndex(
+    signing_key=secret.SECRET_KEY,
+    resync_interval_in_seconds=secret.DEVICE_CREDENTIALS_RESYNC_INTERVAL_IN_SECONDS,
+)
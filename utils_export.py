@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Iterable, Mapping
+
+CUSTOMER_EXPORT_FIELDS = (
+    "user_id",
+    "customer_id",
+    "name",
+    "email",
+    "nic_number",
+    "units_consumed",
+    "account_balance_in_rupees",
+    "should_get_service",
+)
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values and `*`"""
+    qualities = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def encode_ndjson(rows: Iterable[Mapping]) -> bytes:
+    return "".join(json.dumps(dict(row)) + "\n" for row in rows).encode()
+
+
+class CsvEncoder:
+    """Encode chunks of rows as CSV, writing the header before the first one"""
+
+    def __init__(self, fields: tuple[str, ...]) -> None:
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=fields)
+        self._writer.writeheader()
+
+    def __call__(self, rows: Iterable[Mapping]) -> bytes:
+        self._writer.writerows(rows)
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk.encode()
+
+
+async def encode_export(
+    chunks: AsyncIterator[Iterable[Mapping]],
+    format: str,
+    fields: tuple[str, ...],
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """Encode every chunk of rows as it arrives, so only one chunk is held in memory"""
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    def compress(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor is not None else data
+
+    if format == "csv":
+        encode = CsvEncoder(fields=fields)
+        # Sends the header even if there are no rows
+        header = compress(encode(()))
+        if header:
+            yield header
+    else:
+        encode = encode_ndjson
+
+    async for rows in chunks:
+        data = compress(encode(rows))
+        if data:
+            yield data
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from utils import get_password_context, secret
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool instead of the event loop.
+
+    bcrypt releases the GIL, so `max_workers` threads hash in parallel while
+    the loop keeps serving other requests. Once `max_pending` calls are queued
+    or running, further calls fail fast with a 503 rather than queueing
+    logins behind each other for seconds.
+
+    Bulk work such as provisioning thousands of customers goes to a separate
+    pool of `bulk_max_workers` threads instead, without the pending limit,
+    so it neither gets rejected nor queues logins behind it.
+    """
+
+    def __init__(
+        self, max_workers: int, max_pending: int, bulk_max_workers: int
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.bulk_max_workers = bulk_max_workers
+        self.pending = 0
+        self.completed_total = 0
+        self.rejected_total = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hasher"
+        )
+        self._bulk_executor = ThreadPoolExecutor(
+            max_workers=bulk_max_workers, thread_name_prefix="password-hasher-bulk"
+        )
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected_total += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self.pending -= 1
+        self.completed_total += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        """Generate a hash for the provided password string"""
+        return await self._run(get_password_context().hash, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """Hash a batch of passwords in parallel on the bulk pool, in order"""
+        loop = asyncio.get_running_loop()
+        hash_password = get_password_context().hash
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(self._bulk_executor, hash_password, password)
+                for password in passwords
+            )
+        )
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        """Verify the password, with a new hash if the stored one is outdated"""
+        return await self._run(
+            get_password_context().verify_and_update,
+            plain_password,
+            hashed_password,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed_total": self.completed_total,
+            "rejected_total": self.rejected_total,
+        }
+
+
+password_hasher = PasswordHasher(
+    max_workers=secret.PASSWORD_HASHING_MAX_WORKERS,
+    max_pending=secret.PASSWORD_HASHING_MAX_PENDING,
+    bulk_max_workers=secret.PASSWORD_HASHING_BULK_MAX_WORKERS,
+)
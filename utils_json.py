@@ -0,0 +1,87 @@
+import types
+import typing
+from typing import Any, Mapping
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from sqlite import schemas
+
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson response, writing UTC as `Z` like pydantic does"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def _field_kind(annotation) -> tuple[str | None, Any]:
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        annotation = next(
+            arg for arg in typing.get_args(annotation) if arg is not type(None)
+        )
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return "model", ModelSerializer(annotation)
+    if annotation is float:
+        return "float", None
+    return None, None
+
+
+class ModelSerializer:
+    """Shape ORM objects or rows like a schema without validating them.
+
+    Built once per schema, it reads each of the schema's fields and only
+    coerces what JSON would show differently, ints stored in float columns,
+    and nested schemas. This trusts the values, so it is only for data the
+    app read from its own database or has already validated, never for
+    input.
+    """
+
+    def __init__(self, schema: type[BaseModel]) -> None:
+        self.schema = schema
+        self.fields = [
+            (name, *_field_kind(field.annotation))
+            for name, field in schema.model_fields.items()
+        ]
+        self._fields_by_name = {
+            name: (kind, nested) for name, kind, nested in self.fields
+        }
+
+    def __call__(self, obj) -> dict | None:
+        """Every field of an ORM object or schema instance, read as attributes"""
+        if obj is None:
+            return None
+        # Loaded ORM columns and pydantic fields both live in the instance
+        # dict, reading it skips the attribute instrumentation
+        attributes = obj.__dict__
+        row = {}
+        for name, kind, nested in self.fields:
+            value = attributes[name] if name in attributes else getattr(obj, name)
+            if value is not None:
+                if kind == "float":
+                    value = float(value)
+                elif kind == "model":
+                    value = nested(value)
+            row[name] = value
+        return row
+
+    def mapping(self, row: Mapping | None) -> dict | None:
+        """Only the fields present in a mapping, e.g. a projected row"""
+        if row is None:
+            return None
+        result = {}
+        for name, value in row.items():
+            kind, nested = self._fields_by_name[name]
+            if value is not None:
+                if kind == "float":
+                    value = float(value)
+                elif kind == "model":
+                    value = nested.mapping(value)
+            result[name] = value
+        return result
+
+
+serialize_user = ModelSerializer(schemas.User)
+serialize_user_partial = ModelSerializer(schemas.UserPartial)
+serialize_usage_period = ModelSerializer(schemas.UsagePeriod)
@@ -0,0 +1,357 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils import secret
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow_queries")
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class Histogram:
+    """Cumulative-on-export histogram, observing is one bisect and two additions"""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        cumulative = 0
+        for bucket, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield bucket, cumulative
+
+
+class RequestQueries:
+    """Queries run on behalf of the current request, by statement when traced"""
+
+    __slots__ = ("count", "duration", "statements")
+
+    def __init__(self, trace: bool = False) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] | None = Counter() if trace else None
+
+    def repeated(self) -> list[tuple[str, int]]:
+        """Statements run more than once, the usual sign of an N+1 pattern"""
+        if self.statements is None:
+            return []
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count > 1
+        ]
+
+
+request_queries: ContextVar[RequestQueries | None] = ContextVar(
+    "request_queries", default=None
+)
+
+
+class Metrics:
+    """Process wide request and database metrics in Prometheus text format.
+
+    Everything is plain ints and floats updated from the event loop thread,
+    so recording takes no locks. Queries run from sync sessions on the
+    threadpool can race with it and occasionally lose an increment, which is
+    fine for monitoring. With several workers every process reports its own.
+
+    With `trace_queries` every request also counts its statements by SQL text,
+    and statements slower than `slow_query_threshold_in_seconds` are logged
+    with their parameters redacted.
+    """
+
+    def __init__(
+        self,
+        trace_queries: bool = False,
+        slow_query_threshold_in_seconds: float | None = None,
+    ) -> None:
+        self.trace_queries = trace_queries
+        self.slow_query_threshold_in_seconds = slow_query_threshold_in_seconds
+        self.in_flight = 0
+        self.requests: defaultdict[tuple[str, str, int], int] = defaultdict(int)
+        self.request_durations: dict[tuple[str, str], Histogram] = {}
+        self.queries_per_request: dict[tuple[str, str], Histogram] = {}
+        self.query_durations: dict[str, Histogram] = {}
+        self.engines: dict[str, Engine] = {}
+
+    def observe_request(
+        self,
+        method: str,
+        route: str,
+        status_code: int,
+        duration: float,
+        queries: RequestQueries,
+    ) -> None:
+        key = (method, route)
+        self.requests[(method, route, status_code)] += 1
+        histogram = self.request_durations.get(key)
+        if histogram is None:
+            histogram = self.request_durations[key] = Histogram(
+                REQUEST_DURATION_BUCKETS
+            )
+            self.queries_per_request[key] = Histogram(QUERIES_PER_REQUEST_BUCKETS)
+        histogram.observe(duration)
+        self.queries_per_request[key].observe(queries.count)
+
+    def observe_query(
+        self, statement: str, parameters, executemany: bool, duration: float
+    ) -> None:
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        histogram = self.query_durations.get(operation)
+        if histogram is None:
+            histogram = self.query_durations[operation] = Histogram(
+                QUERY_DURATION_BUCKETS
+            )
+        histogram.observe(duration)
+
+        if (
+            self.slow_query_threshold_in_seconds is not None
+            and duration >= self.slow_query_threshold_in_seconds
+        ):
+            slow_query_logger.warning(
+                "Query took %.1f ms: %s with %s",
+                duration * 1000,
+                " ".join(statement.split()),
+                redact_parameters(parameters, executemany),
+            )
+
+        queries = request_queries.get()
+        if queries is not None:
+            queries.count += 1
+            queries.duration += duration
+            if queries.statements is not None:
+                queries.statements[statement] += 1
+
+    def instrument_engine(self, engine: Engine, name: str) -> None:
+        """Time every statement run on the engine and report its pool"""
+        self.engines[name] = engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+            conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+            started_at = conn.info["query_started_at"].pop()
+            self.observe_query(
+                statement, parameters, many, time.perf_counter() - started_at
+            )
+
+        @event.listens_for(engine, "handle_error")
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            if conn is not None and conn.info.get("query_started_at"):
+                conn.info["query_started_at"].pop()
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_in_flight Requests being served right now",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Requests served, by route and status code",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.requests.items()):
+            lines.append(
+                f'http_requests_total{{method="{method}",route="{route}",'
+                f'status_code="{status_code}"}} {count}'
+            )
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, by route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.request_durations.items()):
+            lines += _histogram_lines(
+                "http_request_duration_seconds",
+                f'method="{method}",route="{route}"',
+                histogram,
+            )
+
+        lines += [
+            "# HELP http_request_db_queries Database queries per request, by route",
+            "# TYPE http_request_db_queries histogram",
+        ]
+        for (method, route), histogram in sorted(self.queries_per_request.items()):
+            lines += _histogram_lines(
+                "http_request_db_queries",
+                f'method="{method}",route="{route}"',
+                histogram,
+            )
+
+        lines += [
+            "# HELP db_query_duration_seconds Statement latency, by SQL operation",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        for operation, histogram in sorted(self.query_durations.items()):
+            lines += _histogram_lines(
+                "db_query_duration_seconds", f'operation="{operation}"', histogram
+            )
+
+        for gauge, help_text in (
+            ("size", "Connections the pool keeps open"),
+            ("checkedin", "Idle connections in the pool"),
+            ("checkedout", "Connections in use"),
+            ("overflow", "Connections opened beyond the pool size"),
+        ):
+            lines += [
+                f"# HELP db_pool_{gauge} {help_text}",
+                f"# TYPE db_pool_{gauge} gauge",
+            ]
+            for name, engine in sorted(self.engines.items()):
+                # Pools such as NullPool and StaticPool do not track these
+                value = getattr(engine.pool, gauge, None)
+                if value is not None:
+                    lines.append(f'db_pool_{gauge}{{engine="{name}"}} {value()}')
+
+        return "\n".join(lines) + "\n"
+
+
+def redact_parameters(parameters, executemany: bool) -> str:
+    """Only the type of each bound parameter, values may be personal data"""
+    if executemany:
+        return f"{len(parameters)} parameter sets"
+    if isinstance(parameters, dict):
+        return repr({key: type(value).__name__ for key, value in parameters.items()})
+    return repr(tuple(type(value).__name__ for value in parameters or ()))
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list[str]:
+    lines = [
+        f'{name}_bucket{{{labels},le="{bucket}"}} {count}'
+        for bucket, count in histogram.samples()
+    ]
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {sum(histogram.counts)}")
+    return lines
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording every HTTP request into `metrics`"""
+
+    def __init__(self, app, metrics: "Metrics") -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        queries = RequestQueries(trace=self.metrics.trace_queries)
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if queries.statements is not None:
+                    # Streamed bodies can run more queries after this, the
+                    # log line written once the request is done has them all
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            *_trace_headers(queries),
+                        ],
+                    }
+            await send(message)
+
+        token = request_queries.set(queries)
+        self.metrics.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            request_queries.reset(token)
+            route = scope.get("route")
+            duration = time.perf_counter() - started_at
+            self.metrics.observe_request(
+                method=scope["method"],
+                # The route template keeps label cardinality bounded
+                route=route.path if route is not None else "unmatched",
+                status_code=status_code,
+                duration=duration,
+                queries=queries,
+            )
+            if queries.statements is not None:
+                _log_trace(scope, status_code, duration, queries)
+
+
+def _trace_headers(queries: RequestQueries) -> list[tuple[bytes, bytes]]:
+    repeated = sum(count - 1 for _, count in queries.repeated())
+    return [
+        (b"x-db-queries", str(queries.count).encode()),
+        (b"x-db-time-ms", f"{queries.duration * 1000:.2f}".encode()),
+        (b"x-db-repeated-queries", str(repeated).encode()),
+    ]
+
+
+def _log_trace(scope, status_code: int, duration: float, queries: RequestQueries):
+    repeated = queries.repeated()
+    logger.log(
+        logging.WARNING if repeated else logging.INFO,
+        "%s %s %s took %.1f ms, %s queries in %.1f ms%s",
+        scope["method"],
+        scope["path"],
+        status_code,
+        duration * 1000,
+        queries.count,
+        queries.duration * 1000,
+        "".join(
+            f"\n  {count}x {' '.join(statement.split())}"
+            for statement, count in repeated
+        ),
+    )
+
+
+metrics = Metrics(
+    trace_queries=secret.QUERY_TRACING,
+    slow_query_threshold_in_seconds=(
+        secret.SLOW_QUERY_THRESHOLD_IN_MILLISECONDS / 1000
+        if secret.SLOW_QUERY_THRESHOLD_IN_MILLISECONDS is not None
+        else None
+    ),
+)
+
+
+async def serve_metrics(host: str, port: int):
+    """Serve `/metrics` without authentication on a separate, private bind"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[:2] == [b"GET", b"/metrics"]:
+                body = metrics.render().encode()
+                head = "200 OK\r\nContent-Type: text/plain; version=0.0.4"
+            else:
+                body = b"Not Found\n"
+                head = "404 Not Found\r\nContent-Type: text/plain"
+            writer.write(
+                f"HTTP/1.1 {head}\r\nContent-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host=host, port=port)
@@ -0,0 +1,118 @@
+import math
+import struct
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+
+from sqlite import schemas
+
+PACKED_READINGS_MEDIA_TYPE = "application/x-packed-readings"
+
+
+def construct(schema: type[BaseModel], values: dict) -> BaseModel:
+    """`schema.model_construct(**values)` for values of every field, minus its overhead"""
+    instance = schema.__new__(schema)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__pydantic_fields_set__", set(values))
+    object.__setattr__(instance, "__pydantic_extra__", None)
+    object.__setattr__(instance, "__pydantic_private__", None)
+    return instance
+
+
+class PackedReadingsCodec:
+    """Fixed-layout binary readings, for meters that cannot afford JSON.
+
+    A reading is 24 bytes, little-endian: the sequence number as an int64,
+    -1 for none, then voltage and current as float32 and units consumed,
+    which are billed, as float64. A timestamped reading is 32 bytes, the
+    same fields after the time as float64 Unix seconds. A batch is its readings back to back, with no
+    header. Decoding unpacks straight from the body's buffer, runs the
+    same checks as the JSON schemas and builds the schema objects without
+    validating them again.
+    """
+
+    reading = struct.Struct("<qffd")
+    timestamped_reading = struct.Struct("<dqffd")
+
+    def __init__(self, max_batch_size: int) -> None:
+        self.max_batch_size = max_batch_size
+
+    def _fields(
+        self,
+        sequence_number: int,
+        voltage: float,
+        current: float,
+        units_consumed: float,
+    ) -> dict:
+        """The fields of a reading, checked like the JSON schema checks them"""
+        if not math.isfinite(voltage + current + units_consumed):
+            raise ValueError("voltage, current and units_consumed must be finite")
+        check = schemas.CustomerReadingBase.value_validator
+        try:
+            check(voltage)
+        except ValueError as e:
+            raise ValueError(f"voltage: {e}")
+        try:
+            check(current)
+        except ValueError as e:
+            raise ValueError(f"current: {e}")
+        if sequence_number < -1:
+            raise ValueError("sequence_number: must not be negative")
+        return {
+            "voltage": voltage,
+            "current": current,
+            "units_consumed": units_consumed,
+            "sequence_number": None if sequence_number == -1 else sequence_number,
+        }
+
+    def unpack_reading(self, body: bytes) -> schemas.CustomerReadingBase:
+        if len(body) != self.reading.size:
+            raise ValueError(f"A reading must be {self.reading.size} bytes")
+        return construct(
+            schemas.CustomerReadingBase, self._fields(*self.reading.unpack(body))
+        )
+
+    def unpack_batch(self, body: bytes) -> list[schemas.CustomerTimestampedReadingBase]:
+        size = self.timestamped_reading.size
+        if not body or len(body) % size:
+            raise ValueError(f"A batch must be a non-empty multiple of {size} bytes")
+        if len(body) // size > self.max_batch_size:
+            raise ValueError(
+                f"A batch must not contain more than {self.max_batch_size} readings"
+            )
+        readings = []
+        for index, (timestamp, *fields) in enumerate(
+            self.timestamped_reading.iter_unpack(memoryview(body))
+        ):
+            try:
+                values = self._fields(*fields)
+                values["timestamp"] = datetime.fromtimestamp(timestamp, timezone.utc)
+            except (ValueError, OverflowError, OSError) as e:
+                raise ValueError(f"Reading {index}: {e}")
+            readings.append(construct(schemas.CustomerTimestampedReadingBase, values))
+        return readings
+
+    def pack_reading(self, reading: schemas.CustomerReadingBase) -> bytes:
+        return self.reading.pack(
+            -1 if reading.sequence_number is None else reading.sequence_number,
+            reading.voltage,
+            reading.current,
+            reading.units_consumed,
+        )
+
+    def pack_batch(
+        self, readings: list[schemas.CustomerTimestampedReadingBase]
+    ) -> bytes:
+        return b"".join(
+            self.timestamped_reading.pack(
+                reading.timestamp.timestamp(),
+                -1 if reading.sequence_number is None else reading.sequence_number,
+                reading.voltage,
+                reading.current,
+                reading.units_consumed,
+            )
+            for reading in readings
+        )
+
+
+packed_readings = PackedReadingsCodec(max_batch_size=schemas.MAX_READINGS_PER_BATCH)
@@ -0,0 +1,55 @@
+import asyncio
+
+from utils import secret
+
+
+class ServiceStateBroker:
+    """In-process pub/sub of `Customer.should_get_service`, keyed by customer id.
+
+    Every subscriber gets a queue that only ever holds the latest state, so a
+    slow meter connection can never make the broker buffer more than one value.
+    Publishing with no subscribers is a dict lookup. Only meters connected to
+    this process are notified, so with several workers each one pushes the
+    changes it applies itself.
+    """
+
+    def __init__(self, heartbeat_interval_in_seconds: float) -> None:
+        self.heartbeat_interval_in_seconds = heartbeat_interval_in_seconds
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+
+    def subscribe(self, customer_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(customer_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, customer_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(customer_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[customer_id]
+
+    def _put_latest(self, queue: asyncio.Queue, value: bool | None) -> None:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(value)
+
+    def publish(self, customer_id: int, should_get_service: bool) -> None:
+        """Hand the state to every subscriber, they only send it on if it changed"""
+        for queue in self._subscribers.get(customer_id, ()):
+            self._put_latest(queue, should_get_service)
+
+    def close(self, customer_id: int) -> None:
+        """End every subscription of this customer, e.g. when it is deleted"""
+        for queue in self._subscribers.get(customer_id, ()):
+            self._put_latest(queue, None)
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+
+service_state_broker = ServiceStateBroker(
+    heartbeat_interval_in_seconds=secret.SERVICE_STATE_HEARTBEAT_INTERVAL_IN_SECONDS
+)
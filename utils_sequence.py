@@ -0,0 +1,43 @@
+class ReadingSequenceIndex:
+    """Highest sequence number applied for each customer's meter, in memory.
+
+    Meters number their readings, and a reading at or below the high-water
+    mark has already been applied, e.g. a retry after a timeout. The mark is
+    persisted as `Customer.last_sequence_number`, and this index only keeps
+    the newest value this process has seen, so checking a reading costs a
+    dict lookup rather than a query. A mark can lag behind one applied by
+    another worker, which is why the write itself is guarded in SQL too.
+
+    A meter whose counter restarts has its mark reset by an admin, which also
+    increments `Customer.sequence_resets`. Marks are kept per reset, so one
+    seen here before a reset is dropped once the newer count is seen.
+    """
+
+    def __init__(self) -> None:
+        self._high_water_marks: dict[int, tuple[int, int]] = {}
+
+    def high_water_mark(
+        self, customer_id: int, persisted: int | None, resets: int
+    ) -> tuple[int, int | None]:
+        """The latest reset count, with the newer of the mark seen here and the persisted one"""
+        seen = self._high_water_marks.get(customer_id)
+        if seen is None or seen[0] < resets:
+            return resets, persisted
+        if seen[0] > resets or persisted is None or seen[1] > persisted:
+            return seen
+        return resets, persisted
+
+    def advance(self, customer_id: int, resets: int, sequence_number: int) -> None:
+        if (resets, sequence_number) > self._high_water_marks.get(
+            customer_id, (-1, -1)
+        ):
+            self._high_water_marks[customer_id] = (resets, sequence_number)
+
+    def forget(self, customer_id: int) -> None:
+        self._high_water_marks.pop(customer_id, None)
+
+    def __len__(self) -> int:
+        return len(self._high_water_marks)
+
+
+reading_sequence_index = ReadingSequenceIndex()
@@ -0,0 +1,309 @@
+import bisect
+import copy
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Iterable, Sequence
+from zoneinfo import ZoneInfo
+
+from utils import secret
+
+SECONDS_IN_A_DAY = 24 * 60 * 60
+SECONDS_IN_A_WEEK = 7 * SECONDS_IN_A_DAY
+# 1970-01-01 was a Thursday, shifting by 3 days makes weeks start on Monday
+EPOCH_WEEKDAY_OFFSET = 3 * SECONDS_IN_A_DAY
+WALL_CLOCK_EPOCH = datetime(1970, 1, 1)
+EVERY_DAY = (0, 1, 2, 3, 4, 5, 6)
+
+
+@dataclass(frozen=True)
+class TariffBand:
+    """A rate that applies from `start` to `end` on the given weekdays, 0 is Monday"""
+
+    start: time
+    end: time
+    per_unit_cost_in_rupees: float
+    weekdays: tuple[int, ...] = EVERY_DAY
+
+
+class TariffSchedule:
+    """Time-of-use tariff, compiled once into a piecewise constant weekly rate.
+
+    Later bands win where bands overlap, a band whose `end` is not after its
+    `start` runs past midnight, and holidays are charged the base rate all
+    day. Bands are in wall clock time of `timezone`, naive timestamps are taken
+    to already be in it.
+
+    A reading is priced over the interval since the previous one, assuming the
+    units were consumed evenly over it, so consumption that straddles a band
+    boundary is split between the bands. Its peak units, those consumed at a
+    rate above the base rate, are split the same way.
+    """
+
+    def __init__(
+        self,
+        base_per_unit_cost_in_rupees: float,
+        bands: Iterable[TariffBand] = (),
+        holidays: Iterable[date] = (),
+        timezone: str = "UTC",
+    ) -> None:
+        self.base_per_unit_cost_in_rupees = float(base_per_unit_cost_in_rupees)
+        self.bands = tuple(bands)
+        self.holidays = tuple(sorted(set(holidays)))
+        self.timezone = ZoneInfo(timezone)
+
+        painted = [(0, SECONDS_IN_A_WEEK, self.base_per_unit_cost_in_rupees)]
+        for band in self.bands:
+            for start, end in self._band_spans(band):
+                painted.append((start, end, float(band.per_unit_cost_in_rupees)))
+
+        boundaries = sorted({b for start, end, _ in painted for b in (start, end)})
+        self._boundaries: list[int] = []
+        self._rates: list[float] = []
+        for start in boundaries[:-1]:
+            rate = next(r for s, e, r in reversed(painted) if s <= start < e)
+            if not self._rates or self._rates[-1] != rate:
+                self._boundaries.append(start)
+                self._rates.append(rate)
+
+        self._integrate()
+
+        self._holiday_starts = [
+            (datetime.combine(day, time()) - WALL_CLOCK_EPOCH).total_seconds()
+            for day in self.holidays
+        ]
+
+        # Charges 1 while the rate is above the base rate and 0 otherwise, so
+        # pricing a reading with it gives its peak units
+        self._peak_schedule = copy.copy(self)
+        self._peak_schedule.base_per_unit_cost_in_rupees = 0.0
+        self._peak_schedule._rates = [
+            1.0 if rate > self.base_per_unit_cost_in_rupees else 0.0
+            for rate in self._rates
+        ]
+        self._peak_schedule._integrate()
+
+    def _integrate(self) -> None:
+        # Cost of one unit per second from the start of the week to each boundary
+        self._integrals = [0.0]
+        for i, rate in enumerate(self._rates):
+            end = (
+                self._boundaries[i + 1]
+                if i + 1 < len(self._boundaries)
+                else SECONDS_IN_A_WEEK
+            )
+            self._integrals.append(
+                self._integrals[-1] + rate * (end - self._boundaries[i])
+            )
+        self._week_integral = self._integrals.pop()
+
+    @staticmethod
+    def _band_spans(band: TariffBand) -> list[tuple[int, int]]:
+        start = band.start.hour * 3600 + band.start.minute * 60 + band.start.second
+        end = band.end.hour * 3600 + band.end.minute * 60 + band.end.second
+        if end <= start:
+            end += SECONDS_IN_A_DAY
+
+        spans = []
+        for weekday in band.weekdays:
+            span_start = weekday * SECONDS_IN_A_DAY + start
+            span_end = weekday * SECONDS_IN_A_DAY + end
+            spans.append((span_start, min(span_end, SECONDS_IN_A_WEEK)))
+            if span_end > SECONDS_IN_A_WEEK:
+                # Sunday night into Monday morning
+                spans.append((0, span_end - SECONDS_IN_A_WEEK))
+        return spans
+
+    @classmethod
+    def from_json(cls, value: str, timezone: str) -> "TariffSchedule":
+        config = json.loads(value)
+        return cls(
+            base_per_unit_cost_in_rupees=config["base_per_unit_cost_in_rupees"],
+            bands=[
+                TariffBand(
+                    start=time.fromisoformat(band["start"]),
+                    end=time.fromisoformat(band["end"]),
+                    per_unit_cost_in_rupees=band["per_unit_cost_in_rupees"],
+                    weekdays=tuple(band.get("weekdays", EVERY_DAY)),
+                )
+                for band in config.get("bands", [])
+            ],
+            holidays=[date.fromisoformat(day) for day in config.get("holidays", [])],
+            timezone=timezone,
+        )
+
+    def localize(self, moment: datetime) -> datetime:
+        """The moment as an aware datetime in the tariff's timezone"""
+        if moment.tzinfo is None:
+            return moment.replace(tzinfo=self.timezone)
+        return moment.astimezone(self.timezone)
+
+    def wall_seconds(self, moment: datetime) -> float:
+        """Seconds since 1970-01-01 on the tariff's wall clock"""
+        moment = self.localize(moment)
+        return moment.timestamp() + moment.utcoffset().total_seconds()
+
+    def _is_holiday(self, seconds: float) -> bool:
+        i = bisect.bisect_right(self._holiday_starts, seconds) - 1
+        return i >= 0 and seconds < self._holiday_starts[i] + SECONDS_IN_A_DAY
+
+    def _rate_at(self, seconds: float) -> float:
+        if self._is_holiday(seconds):
+            return self.base_per_unit_cost_in_rupees
+        position = (seconds + EPOCH_WEEKDAY_OFFSET) % SECONDS_IN_A_WEEK
+        return self._rates[bisect.bisect_right(self._boundaries, position) - 1]
+
+    def _integral_to(self, seconds: float) -> float:
+        weeks, position = divmod(seconds + EPOCH_WEEKDAY_OFFSET, SECONDS_IN_A_WEEK)
+        i = bisect.bisect_right(self._boundaries, position) - 1
+        return (
+            weeks * self._week_integral
+            + self._integrals[i]
+            + self._rates[i] * (position - self._boundaries[i])
+        )
+
+    def _integral(self, start: float, end: float) -> float:
+        integral = self._integral_to(end) - self._integral_to(start)
+        first = bisect.bisect_right(self._holiday_starts, start - SECONDS_IN_A_DAY)
+        for holiday_start in self._holiday_starts[first:]:
+            if holiday_start >= end:
+                break
+            overlap_start = max(start, holiday_start)
+            overlap_end = min(end, holiday_start + SECONDS_IN_A_DAY)
+            integral += self.base_per_unit_cost_in_rupees * (
+                overlap_end - overlap_start
+            ) - (self._integral_to(overlap_end) - self._integral_to(overlap_start))
+        return integral
+
+    def rate_at(self, moment: datetime) -> float:
+        return self._rate_at(self.wall_seconds(moment))
+
+    def price_interval(
+        self, start: datetime | None, end: datetime, units_consumed: float
+    ) -> float:
+        """Cost of units consumed evenly from `start` to `end`, at `end`'s rate without a start"""
+        end_seconds = self.wall_seconds(end)
+        start_seconds = end_seconds if start is None else self.wall_seconds(start)
+        if start_seconds >= end_seconds:
+            return units_consumed * self._rate_at(end_seconds)
+        return (
+            units_consumed
+            * self._integral(start_seconds, end_seconds)
+            / (end_seconds - start_seconds)
+        )
+
+    def price_intervals(self, starts, ends, units_consumed):
+        """Vectorized `price_interval` over arrays of wall clock seconds.
+
+        `starts` may hold NaN for readings without a start. Returns a NumPy
+        array of costs.
+        """
+        import numpy as np
+
+        ends = np.asarray(ends, dtype=np.float64)
+        starts = np.asarray(starts, dtype=np.float64)
+        units_consumed = np.asarray(units_consumed, dtype=np.float64)
+        boundaries = np.asarray(self._boundaries, dtype=np.float64)
+        rates = np.asarray(self._rates, dtype=np.float64)
+        integrals = np.asarray(self._integrals, dtype=np.float64)
+
+        def locate(seconds):
+            weeks, position = np.divmod(
+                seconds + EPOCH_WEEKDAY_OFFSET, SECONDS_IN_A_WEEK
+            )
+            return weeks, position, np.searchsorted(boundaries, position, "right") - 1
+
+        def integral_to(seconds):
+            weeks, position, i = locate(seconds)
+            return (
+                weeks * self._week_integral
+                + integrals[i]
+                + rates[i] * (position - boundaries[i])
+            )
+
+        is_instant = ~(starts < ends)
+        starts = np.where(is_instant, ends, starts)
+        integral = integral_to(ends) - integral_to(starts)
+
+        _, _, end_band = locate(ends)
+        instant_rates = rates[end_band]
+        if self._holiday_starts:
+            lowest, highest = starts.min(), ends.max()
+            for holiday_start in self._holiday_starts:
+                holiday_end = holiday_start + SECONDS_IN_A_DAY
+                if holiday_end <= lowest or holiday_start > highest:
+                    continue
+                overlap_start = np.clip(starts, holiday_start, holiday_end)
+                overlap_end = np.clip(ends, holiday_start, holiday_end)
+                integral += self.base_per_unit_cost_in_rupees * (
+                    overlap_end - overlap_start
+                ) - (integral_to(overlap_end) - integral_to(overlap_start))
+                on_holiday = (ends >= holiday_start) & (ends < holiday_end)
+                instant_rates = np.where(
+                    on_holiday, self.base_per_unit_cost_in_rupees, instant_rates
+                )
+
+        durations = np.where(is_instant, 1.0, ends - starts)
+        average_rates = np.where(is_instant, instant_rates, integral / durations)
+        return units_consumed * average_rates
+
+    def price_readings(
+        self,
+        previous_reading_at: datetime | None,
+        timestamps: Sequence[datetime],
+        units_consumed: Sequence[float],
+    ) -> list[float]:
+        """Cost of each reading in a time ordered batch, each starting at the one before"""
+        if len(timestamps) == 1:
+            return [
+                self.price_interval(
+                    start=previous_reading_at,
+                    end=timestamps[0],
+                    units_consumed=units_consumed[0],
+                )
+            ]
+
+        ends = [self.wall_seconds(timestamp) for timestamp in timestamps]
+        start = (
+            float("nan")
+            if previous_reading_at is None
+            else self.wall_seconds(previous_reading_at)
+        )
+        return self.price_intervals(
+            starts=[start, *ends[:-1]], ends=ends, units_consumed=units_consumed
+        ).tolist()
+
+    def peak_units_of_readings(
+        self,
+        previous_reading_at: datetime | None,
+        timestamps: Sequence[datetime],
+        units_consumed: Sequence[float],
+    ) -> list[float]:
+        """Units of each reading consumed at a peak rate, split like `price_readings` splits cost"""
+        return self._peak_schedule.price_readings(
+            previous_reading_at=previous_reading_at,
+            timestamps=timestamps,
+            units_consumed=units_consumed,
+        )
+
+
+def default_tariff_schedule() -> TariffSchedule:
+    """`TARIFF_SCHEDULE` if set, else the `PER_UNIT_*` rates with a 6pm to 10pm peak"""
+    if secret.TARIFF_SCHEDULE:
+        return TariffSchedule.from_json(
+            secret.TARIFF_SCHEDULE, timezone=secret.TARIFF_TIMEZONE
+        )
+    return TariffSchedule(
+        base_per_unit_cost_in_rupees=secret.PER_UNIT_COST_IN_RUPEES,
+        bands=[
+            TariffBand(
+                start=time(18),
+                end=time(22),
+                per_unit_cost_in_rupees=secret.PER_UNIT_PEAK_FACTOR_COST_IN_RUPEES,
+            )
+        ],
+        timezone=secret.TARIFF_TIMEZONE,
+    )
+
+
+tariff_schedule = default_tariff_schedule()